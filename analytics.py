@@ -0,0 +1,261 @@
+"""
+⚡ Neon Pulse 數值分析（NumPy）
+純函式，不碰 Sheets / LINE，輸入為日期與數值陣列
+"""
+
+import numpy as np
+
+BUCKETS = ('day', 'week', 'month')
+
+
+def to_days(dates):
+    """'YYYY-MM-DD' 字串列表 → datetime64[D] 陣列"""
+    return np.asarray([d[:10] for d in dates], dtype='datetime64[D]')
+
+
+def bucket_keys(days, bucket):
+    """每個日期對應的分桶起始日（週以週一為起點）"""
+    if bucket == 'day':
+        return days
+    if bucket == 'week':
+        # 1970-01-01 是週四，(d + 3) % 7 即週一為 0 的星期
+        return days - (days.astype(np.int64) + 3) % 7
+    if bucket == 'month':
+        return days.astype('datetime64[M]').astype('datetime64[D]')
+    raise ValueError(f'unknown bucket: {bucket}')
+
+
+def bucket_series(days, values, bucket='day', how='sum'):
+    """依日/週/月分桶彙總，回傳 (分桶起始日, 數值, 筆數)"""
+    days = np.asarray(days, dtype='datetime64[D]')
+    values = np.asarray(values, dtype=np.float64)
+    if days.size == 0:
+        return days, values, np.zeros(0, dtype=np.int64)
+    keys, inverse = np.unique(bucket_keys(days, bucket), return_inverse=True)
+    sums = np.bincount(inverse, weights=values, minlength=keys.size)
+    counts = np.bincount(inverse, minlength=keys.size)
+    if how == 'mean':
+        return keys, sums / counts, counts
+    return keys, sums, counts
+
+
+def bucket_count(start, end, bucket):
+    """日期區間在指定分桶下的桶數"""
+    days = np.array([start, end], dtype='datetime64[D]')
+    keys = bucket_keys(days, bucket).astype(np.int64)
+    if bucket == 'day':
+        return int(keys[1] - keys[0]) + 1
+    if bucket == 'week':
+        return int(keys[1] - keys[0]) // 7 + 1
+    months = days.astype('datetime64[M]').astype(np.int64)
+    return int(months[1] - months[0]) + 1
+
+
+def coarsen_bucket(start, end, bucket, max_points):
+    """桶數超過上限時自動改用更粗的分桶"""
+    i = BUCKETS.index(bucket)
+    while i < len(BUCKETS) - 1 and bucket_count(start, end, BUCKETS[i]) > max_points:
+        i += 1
+    return BUCKETS[i]
+
+
+# ===== 體重趨勢 =====
+WEIGHT_EMA_TAU = 10.0        # 指數移動平均的時間常數（天）
+WEIGHT_OUTLIER_RATIO = 0.08  # 與鄰近中位數相差超過 8% 視為打錯
+WEIGHT_OUTLIER_WINDOW = 7    # 判斷異常值的鄰近筆數（置中）
+
+
+def to_epoch_days(times):
+    """'YYYY-MM-DD HH:MM:SS' 字串列表 → 自 1970-01-01 起的天數（含小數）"""
+    return np.asarray(times, dtype='datetime64[s]').astype(np.int64) / 86400.0
+
+
+def outlier_mask(values, window=WEIGHT_OUTLIER_WINDOW, ratio=WEIGHT_OUTLIER_RATIO):
+    """與置中鄰近中位數相差過大的值（例如 56.5 打成 65.5）標記為 True"""
+    values = np.asarray(values, dtype=np.float64)
+    if values.size < 3:
+        return np.zeros(values.size, dtype=bool)
+    half = window // 2
+    padded = np.concatenate([np.full(half, np.nan), values, np.full(half, np.nan)])
+    windows = np.lib.stride_tricks.sliding_window_view(padded, window)
+    enough = np.sum(~np.isnan(windows), axis=1) >= 3
+    median = np.nanmedian(windows, axis=1)
+    return enough & (np.abs(values - median) > ratio * median)
+
+
+def ema(t, values, tau=WEIGHT_EMA_TAU):
+    """不等間隔的指數移動平均：ema_k = (1 - a_k) * ema_{k-1} + a_k * x_k，a_k = 1 - exp(-dt/tau)
+
+    用 E_k = ema_k / D_k（D_k 為累積衰減）把遞迴改寫成 cumsum；
+    為避免 exp 溢位，每 500*tau 天切一段，只在段與段之間用迴圈。
+    """
+    t = np.asarray(t, dtype=np.float64)
+    x = np.asarray(values, dtype=np.float64)
+    out = np.empty_like(x)
+    if x.size == 0:
+        return out
+    prev, prev_t = x[0], t[0]
+    i = 0
+    while i < x.size:
+        out[i] = prev + (1 - np.exp(-(t[i] - prev_t) / tau)) * (x[i] - prev)
+        j = max(int(np.searchsorted(t, t[i] + 500 * tau, side='right')), i + 1)
+        if j > i + 1:
+            seg_t, seg_x = t[i:j], x[i:j]
+            decay = np.exp(-(seg_t - seg_t[0]) / tau)
+            alpha = np.concatenate([[0.0], 1 - np.exp(-np.diff(seg_t) / tau)])
+            out[i:j] = decay * (out[i] + np.cumsum(alpha * seg_x / decay))
+        prev, prev_t = out[j - 1], t[j - 1]
+        i = j
+    return out
+
+
+def rolling_slope(t, values, window_days):
+    """每一點往前 window_days 天內的最小平方法斜率（單位/天），不足 2 點為 NaN"""
+    t = np.asarray(t, dtype=np.float64)
+    x = np.asarray(values, dtype=np.float64)
+    if x.size == 0:
+        return x
+    tc = t - t[0]
+    start = np.searchsorted(tc, tc - window_days, side='left')
+    end = np.arange(1, x.size + 1)
+
+    def wsum(v):
+        c = np.concatenate([[0.0], np.cumsum(v)])
+        return c[end] - c[start]
+
+    n = (end - start).astype(np.float64)
+    st, sx, stt, stx = wsum(tc), wsum(x), wsum(tc * tc), wsum(tc * x)
+    denom = n * stt - st * st
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (n * stx - st * sx) / denom
+    slope[(n < 2) | (np.abs(denom) < 1e-9)] = np.nan
+    return slope
+
+
+def value_at_or_before(t, values, day):
+    """day 當天（含）以前最後一筆；若全部都在 day 之後則取第一筆"""
+    idx = int(np.searchsorted(t, day, side='right')) - 1
+    return float(values[max(idx, 0)])
+
+
+def weight_trend(times, weights, now_day, goal=None):
+    """體重分析：異常值剔除、EMA 趨勢、7/30 天斜率、週/月變化、目標預估日"""
+    t = to_epoch_days(times)
+    w = np.asarray(weights, dtype=np.float64)
+    order = np.argsort(t, kind='stable')
+    t, w = t[order], w[order]
+
+    bad = outlier_mask(w)
+    latest_outlier = bool(bad[-1]) if bad.size else False
+    t, w = t[~bad], w[~bad]
+    if w.size == 0:
+        return None
+
+    trend = ema(t, w)
+    slope7 = rolling_slope(t, w, 7)[-1]
+    slope30 = rolling_slope(t, w, 30)[-1]
+    recent = w[t >= now_day - 30]
+    if recent.size == 0:
+        recent = w[-1:]
+
+    stats = {
+        'current': round(float(w[-1]), 1),
+        'current_date': str(np.datetime64(int(t[-1] * 86400), 's'))[:10],
+        'previous': round(float(w[-2]), 1) if w.size >= 2 else None,
+        'trend': round(float(trend[-1]), 1),
+        'slope_7d': None if np.isnan(slope7) else round(float(slope7) * 7, 2),
+        'slope_30d': None if np.isnan(slope30) else round(float(slope30) * 7, 2),
+        'week_change': round(float(w[-1]) - value_at_or_before(t, w, now_day - 7), 1) if w.size >= 2 else None,
+        'month_change': round(float(w[-1]) - value_at_or_before(t, w, now_day - 30), 1) if w.size >= 2 else None,
+        'max': round(float(recent.max()), 1),
+        'min': round(float(recent.min()), 1),
+        'outliers': int(bad.sum()),
+        'latest_outlier': latest_outlier,
+        'goal': goal or None,
+        'goal_date': None,
+    }
+
+    # 依 30 天斜率推估達標日（方向不對或超過兩年則不預估）
+    if goal:
+        gap = goal - trend[-1]
+        if abs(gap) < 0.1:
+            stats['goal_date'] = 'reached'
+        elif not np.isnan(slope30) and slope30 != 0 and np.sign(slope30) == np.sign(gap):
+            days = gap / slope30
+            if days <= 730:
+                eta = np.datetime64(int(now_day), 'D') + np.timedelta64(int(np.ceil(days)), 'D')
+                stats['goal_date'] = str(eta)
+    return stats
+
+
+# ===== 跨指標關聯 =====
+CORR_MIN_PAIRS = 10  # 少於這麼多組成對資料不算相關係數
+WEEKDAYS = ('一', '二', '三', '四', '五', '六', '日')
+
+
+def daily_grid(days, values, start, end, how='sum'):
+    """把一個指標對齊到 start..end 的每日索引；sum 型沒紀錄的日子補 0，mean 型為 NaN"""
+    index = np.arange(np.datetime64(start, 'D'), np.datetime64(end, 'D') + 1)
+    out = np.full(index.size, 0.0 if how == 'sum' else np.nan)
+    days = np.asarray(days, dtype='datetime64[D]')
+    mask = (days >= index[0]) & (days <= index[-1]) if index.size else np.zeros(days.size, dtype=bool)
+    keys, v, _ = bucket_series(days[mask], np.asarray(values, dtype=np.float64)[mask], 'day', how)
+    out[(keys - index[0]).astype(np.int64)] = v
+    return index, out
+
+
+def shift_pair(x, y, lag):
+    """x 的第 t 天配 y 的第 t+lag 天"""
+    if lag <= 0:
+        return x, y
+    return x[:-lag], y[lag:]
+
+
+def pearson(x, y, min_pairs=CORR_MIN_PAIRS):
+    """忽略 NaN 的 Pearson 相關係數，回傳 (r, 成對筆數)；資料不足或沒有變異時 r 為 None"""
+    valid = np.isfinite(x) & np.isfinite(y)
+    n = int(valid.sum())
+    if n < min_pairs:
+        return None, n
+    xv, yv = x[valid] - x[valid].mean(), y[valid] - y[valid].mean()
+    denom = np.sqrt((xv * xv).sum() * (yv * yv).sum())
+    if denom < 1e-12:
+        return None, n
+    return float((xv * yv).sum() / denom), n
+
+
+def rolling_corr(x, y, window, min_pairs=CORR_MIN_PAIRS):
+    """每一天往前 window 天（含當天）的相關係數，全部用 cumsum 一次算完；資料不足為 NaN"""
+    valid = np.isfinite(x) & np.isfinite(y)
+    xv, yv = np.where(valid, x, 0.0), np.where(valid, y, 0.0)
+
+    def wsum(v):
+        c = np.concatenate([[0.0], np.cumsum(v)])
+        end = np.arange(1, v.size + 1)
+        return c[end] - c[np.maximum(end - window, 0)]
+
+    n = wsum(valid.astype(np.float64))
+    sx, sy, sxx, syy, sxy = wsum(xv), wsum(yv), wsum(xv * xv), wsum(yv * yv), wsum(xv * yv)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = (n * sxy - sx * sy) / np.sqrt((n * sxx - sx * sx) * (n * syy - sy * sy))
+    r[(n < min_pairs) | ~np.isfinite(r)] = np.nan
+    return np.clip(r, -1.0, 1.0)
+
+
+def weekday_profile(index, values):
+    """週一到週日的平均（忽略 NaN），沒有資料的星期為 NaN"""
+    weekday = (index.astype(np.int64) + 3) % 7
+    valid = np.isfinite(values)
+    sums = np.bincount(weekday[valid], weights=values[valid], minlength=7)
+    counts = np.bincount(weekday[valid], minlength=7)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return sums / counts
+
+
+def strength(r):
+    """相關係數的白話強度"""
+    if r is None:
+        return '資料不足'
+    a = abs(r)
+    label = '強' if a >= 0.5 else '中' if a >= 0.3 else '弱' if a >= 0.1 else '幾乎無'
+    return label + ('正相關' if r > 0 else '負相關') if a >= 0.1 else label + '相關'
@@ -3,25 +3,84 @@
 新增：自訂每日目標（喝水杯數、起身次數、運動分鐘）
 """
 
+import time
+_IMPORT_START = time.perf_counter()
+
 import os
 import json
+import importlib
+import hashlib
+import uuid
+import csv
+import io
+import zlib
+import mimetypes
+import tempfile
 import re
+import heapq
+import random
+import itertools
+import contextvars
+from collections import Counter, deque
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
-import time
 import threading
-from flask import Flask, request, abort, render_template, jsonify
-import gspread
-from google.oauth2.service_account import Credentials
-from linebot.v3 import WebhookHandler
-from linebot.v3.messaging import (
-    Configuration, ApiClient, MessagingApi, PushMessageRequest,
-    ReplyMessageRequest, TextMessage, FlexMessage, FlexContainer,
-    QuickReply, QuickReplyItem, MessageAction
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+import logstore
+import events
+from flask import Flask, request, abort, render_template, jsonify, Response, stream_with_context
+
+# ===== 延遲載入 =====
+# linebot.v3 / gspread / numpy 載入要 1~2 秒，等第一次用到（或 warmup）才 import
+class LazyImport:
+    """第一次用到時才 import，之後把模組裡的同名全域變數換成真正的物件"""
+
+    def __init__(self, module, name=None, alias=None, optional=False):
+        self._module = module
+        self._name = name
+        self._alias = alias or name or module
+        self._optional = optional
+
+    def load(self):
+        try:
+            obj = importlib.import_module(self._module)
+        except ImportError:
+            if not self._optional:
+                raise
+            obj = None  # 選用套件沒裝：全域變數換成 None
+        if obj is not None and self._name:
+            obj = getattr(obj, self._name)
+        globals()[self._alias] = obj
+        return obj
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __call__(self, *args, **kwargs):
+        return self.load()(*args, **kwargs)
+
+    def __bool__(self):
+        return self.load() is not None
+
+gspread = LazyImport('gspread')
+requests = LazyImport('requests')
+analytics = LazyImport('analytics')
+brotli = LazyImport('brotli', optional=True)  # 沒裝就只提供 gzip
+LINE_MESSAGING_NAMES = (
+    'Configuration', 'ApiClient', 'MessagingApi', 'PushMessageRequest',
+    'ReplyMessageRequest', 'TextMessage', 'FlexMessage', 'FlexContainer',
+    'QuickReply', 'QuickReplyItem', 'MessageAction', 'MulticastRequest'
 )
-from linebot.v3.webhooks import MessageEvent, TextMessageContent
-from linebot.v3.exceptions import InvalidSignatureError
-import requests
+for _name in LINE_MESSAGING_NAMES:
+    globals()[_name] = LazyImport('linebot.v3.messaging', _name)
+
+def preload_imports():
+    """一次載入所有延遲模組（warmup 或 gunicorn --preload 時在 master 先載好）"""
+    for name, obj in list(globals().items()):
+        if isinstance(obj, LazyImport):
+            obj.load()
+    get_handler()
 
 app = Flask(__name__)
 
@@ -35,47 +94,176 @@ OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
 LINE_USER_ID = os.environ.get('LINE_USER_ID')
 
 # ===== LINE Bot =====
-configuration = Configuration(access_token=LINE_CHANNEL_ACCESS_TOKEN)
-handler = WebhookHandler(LINE_CHANNEL_SECRET)
+_line_configuration = None
+_handler = None
+
+def line_configuration():
+    global _line_configuration
+    if _line_configuration is None:
+        _line_configuration = Configuration(access_token=LINE_CHANNEL_ACCESS_TOKEN)
+    return _line_configuration
+
+def get_handler():
+    """第一次收到 webhook 才建立 WebhookParser（驗簽並解析事件，處理由 handle_webhook_events 負責）"""
+    global _handler
+    if _handler is None:
+        from linebot.v3 import WebhookParser
+        _handler = WebhookParser(LINE_CHANNEL_SECRET)
+    return _handler
+
+# ===== 鎖 =====
+# 長期存在的鎖一律由 new_lock 建立並登記；gunicorn --preload 的 worker 是 fork 出來的，
+# 父行程 fork 當下被某個執行緒拿著的鎖在子行程裡永遠不會被放開，fork 後逐一重設（見 _reinit_after_fork）。
+# 每個請求或每個 key 才建立的鎖不登記，fork 時整批丟掉即可
+_fork_locks = []
+
+def new_lock(factory=threading.Lock):
+    """建立並登記一個 fork 後要重設的鎖（threading.Lock / RLock / Condition）"""
+    lock = factory()
+    _fork_locks.append(lock)
+    return lock
 
 # ===== Google Sheets =====
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
 TZ = ZoneInfo('Asia/Taipei')
 
 _gspread_client = None
-_client_time = 0
-CACHE_TTL = 300
+_spreadsheet = None
+_worksheets = {}
+_registry_lock = new_lock(threading.RLock)
+TOKEN_REFRESH_MARGIN = 300  # token 到期前 5 分鐘內才更新
+
+# 啟動時若缺少就建立的工作表
+SHEET_HEADERS = {
+    'water_log': ['timestamp'],
+    'stand_log': ['timestamp'],
+    'exercise_log': ['timestamp', 'type', 'duration', 'calories'],
+    'eye_log': ['時間', '狀態'],
+    'weight_log': ['時間', '體重(kg)'],
+    'sleep_log': ['日期', '時數', '品質(1-5)', '備註'],
+    'meal_log': ['時間', '餐別', '食物', '熱量', '備註'],
+    'mood_log': ['時間', '心情', '分數', '備註'],
+    'daily_agg': ['日期', 'water', 'stand', 'exercise_minutes', 'exercise_calories', 'eye_completed', 'eye_ignored'],
+    'events': events.EVENT_HEADERS,
+}
 
 # ===== 資料快取（減少 API 呼叫）=====
 _data_cache = {}
 _cache_time = {}
 DATA_CACHE_TTL = 30  # 快取 30 秒
+_inflight = {}
+_fetch_seq = {}
+_inflight_lock = new_lock()
+
+def _cache_fresh(key, now):
+    return key in _data_cache and (now - _cache_time.get(key, 0)) < DATA_CACHE_TTL
 
 def get_cached(key, fetch_func):
-    """取得快取資料，過期才重新讀取"""
-    now = time.time()
-    if key in _data_cache and (now - _cache_time.get(key, 0)) < DATA_CACHE_TTL:
+    """取得快取資料，過期才重新讀取（同一個 key 同時只讀一次，其他請求等結果）"""
+    if _cache_fresh(key, time.time()):
         return _data_cache[key]
-    try:
-        data = fetch_func()
-        _data_cache[key] = data
-        _cache_time[key] = now
-        return data
-    except Exception as e:
-        print(f"[Cache] Error fetching {key}: {e}")
-        # 錯誤時返回舊快取
-        if key in _data_cache:
+    with _inflight_lock:
+        key_lock = _inflight.setdefault(key, threading.Lock())
+        seq = _fetch_seq.get(key, 0)
+    with key_lock:
+        # 排隊期間別人已經讀好了就直接用
+        now = time.time()
+        if key in _data_cache and (_fetch_seq.get(key, 0) != seq or _cache_fresh(key, now)):
             return _data_cache[key]
+        try:
+            data = fetch_func()
+            _data_cache[key] = data
+            _cache_time[key] = now
+            _fetch_seq[key] = seq + 1
+            save_snapshot(key, data, now)
+            return data
+        except Exception as e:
+            print(f"[Cache] Error fetching {key}: {e}")
+            # 錯誤時返回舊快取，再不行就用硬碟上的最後一次成功資料
+            if key in _data_cache:
+                mark_offline()
+                return _data_cache[key]
+            snap = load_snapshot().get(key)
+            if snap is not None:
+                mark_offline()
+                return snap['data']
+            raise
+
+# ===== 離線快照 =====
+# get_cached 成功讀到的資料會寫到硬碟（last-known-good），Sheets 掛掉時即使重啟也能回覆
+SNAPSHOT_PATH = os.environ.get('SNAPSHOT_PATH', 'data/snapshot.json')
+SNAPSHOT_SAVE_INTERVAL = 10  # 最多每 10 秒寫一次硬碟
+_snapshot = None
+_snapshot_saved = 0
+_snapshot_lock = new_lock()
+_offline = contextvars.ContextVar('offline', default=False)
+
+def mark_offline():
+    """標記目前請求用到了離線資料（快照或本機日誌）"""
+    _offline.set(True)
+
+def is_offline():
+    return _offline.get()
+
+def write_file_atomic(path, text):
+    """寫到同目錄、每次不同名字的暫存檔再換名：不會留下寫一半的檔案，多個 worker 同時寫也不會互相蓋到暫存檔"""
+    folder = os.path.dirname(path) or '.'
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=folder, prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
         raise
 
+def load_snapshot():
+    global _snapshot
+    if _snapshot is None:
+        with _snapshot_lock:
+            if _snapshot is None:
+                try:
+                    with open(SNAPSHOT_PATH, encoding='utf-8') as f:
+                        _snapshot = json.load(f)
+                except (OSError, ValueError):
+                    _snapshot = {}
+    return _snapshot
+
+def save_snapshot(key, data, now):
+    """更新快照，並節流寫入硬碟（先寫暫存檔再換名，避免寫到一半）"""
+    global _snapshot_saved
+    if key.startswith(('series:', 'cols:')):
+        return
+    snap = load_snapshot()
+    snap[key] = {'data': data, 'time': now}
+    if now - _snapshot_saved < SNAPSHOT_SAVE_INTERVAL:
+        return
+    with _snapshot_lock:
+        _snapshot_saved = now
+        try:
+            write_file_atomic(SNAPSHOT_PATH, json.dumps(snap, ensure_ascii=False, default=str))
+        except (OSError, TypeError, ValueError) as e:
+            print(f"[Snapshot] 寫入失敗: {e}")
+
+def spawn_background(target, *args, daemon=True):
+    """背景工作；gevent 模式下 threading 已被 patch，這裡開的就是 greenlet"""
+    thread = threading.Thread(target=target, args=args, daemon=daemon)
+    thread.start()
+    return thread
+
 def clear_cache(key=None):
-    """清除快取"""
+    """清除快取（資料有變動，預先算好的報表也要重算）"""
     if key:
         _data_cache.pop(key, None)
         _cache_time.pop(key, None)
     else:
         _data_cache.clear()
         _cache_time.clear()
+    mark_reports_dirty()
 
 COLORS = {
     'bg': '#0a0a12', 'bg_light': '#1a1a2e', 'cyan': '#00f5ff',
@@ -92,29 +280,290 @@ EXERCISE_TYPES = {'跑步': 10, '走路': 4, '游泳': 12, '騎車': 8, '重訓'
 DEFAULT_GOALS = {'water': 8, 'stand': 6, 'exercise': 30}
 
 def get_goals():
-    """讀取用戶自訂目標，若無則用預設值"""
+    """讀取用戶自訂目標（設定已轉好型別），若無則用預設值"""
     try:
         settings = read_settings()
-        return {
-            'water': int(settings.get('water_goal', DEFAULT_GOALS['water'])) or DEFAULT_GOALS['water'],
-            'stand': int(settings.get('stand_goal', DEFAULT_GOALS['stand'])) or DEFAULT_GOALS['stand'],
-            'exercise': int(settings.get('exercise_goal', DEFAULT_GOALS['exercise'])) or DEFAULT_GOALS['exercise']
-        }
+        return {k: settings.get(f'{k}_goal') or v for k, v in DEFAULT_GOALS.items()}
     except:
         return DEFAULT_GOALS
 
+# ===== Sheets 配額控管 =====
+# 所有 Sheets API 呼叫都經過 GovernedClient.request：依讀/寫分別用 token bucket 限流，
+# 依優先順序排隊（LINE 互動 > PWA 寫入 > 儀表板讀取 > 背景報表），逾時就放棄，429 時自動退避
+SHEETS_READ_PER_MIN = int(os.environ.get('SHEETS_READ_PER_MIN', 60))
+SHEETS_WRITE_PER_MIN = int(os.environ.get('SHEETS_WRITE_PER_MIN', 60))
+SHEETS_MAX_RETRIES = 5
+
+PRIORITY_INTERACTIVE, PRIORITY_PWA_WRITE, PRIORITY_DASHBOARD, PRIORITY_BACKGROUND = 0, 1, 2, 3
+PRIORITY_NAMES = {0: 'interactive', 1: 'pwa_write', 2: 'dashboard', 3: 'background'}
+PRIORITY_DEADLINES = {0: 8, 1: 10, 2: 5, 3: 60}     # 排隊最多等幾秒
+PRIORITY_RESERVE = {0: 0, 1: 0, 2: 0.2, 3: 0.3}     # 低優先只能用到剩下這個比例以上的配額
+
+_sheets_priority = contextvars.ContextVar('sheets_priority', default=PRIORITY_BACKGROUND)
+
+class QuotaTimeout(Exception):
+    """排隊等配額超過期限"""
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, now, reserve=0.0):
+        self.refill(now)
+        if self.tokens - 1 >= reserve * self.capacity:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self, reserve=0.0):
+        need = reserve * self.capacity + 1 - self.tokens
+        return max(need / self.rate, 0.0)
+
+class QuotaGovernor:
+    def __init__(self, read_per_min, write_per_min):
+        self.buckets = {'read': TokenBucket(read_per_min), 'write': TokenBucket(write_per_min)}
+        self._cond = threading.Condition()
+        self._queues = {'read': [], 'write': []}
+        self._paused_until = {'read': 0.0, 'write': 0.0}
+        self._seq = itertools.count()
+        self.counters = {'granted': {n: 0 for n in PRIORITY_NAMES.values()}, 'timeouts': 0, 'throttled_429': 0, 'wait_seconds': 0.0}
+
+    def acquire(self, kind, priority):
+        """排隊取得一個配額，超過優先順序的期限就丟出 QuotaTimeout"""
+        start = time.monotonic()
+        deadline = start + PRIORITY_DEADLINES[priority]
+        ticket = (priority, next(self._seq))
+        queue, bucket = self._queues[kind], self.buckets[kind]
+        with self._cond:
+            heapq.heappush(queue, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    if queue[0] == ticket and now >= self._paused_until[kind] and bucket.try_take(now, PRIORITY_RESERVE[priority]):
+                        heapq.heappop(queue)
+                        self.counters['granted'][PRIORITY_NAMES[priority]] += 1
+                        self.counters['wait_seconds'] += now - start
+                        return
+                    if now >= deadline:
+                        self.counters['timeouts'] += 1
+                        raise QuotaTimeout(f'{kind} quota wait > {PRIORITY_DEADLINES[priority]}s ({PRIORITY_NAMES[priority]})')
+                    wait = max(self._paused_until[kind] - now, bucket.wait_time(PRIORITY_RESERVE[priority]), 0.01)
+                    self._cond.wait(min(wait, deadline - now))
+            except QuotaTimeout:
+                queue.remove(ticket)
+                heapq.heapify(queue)
+                raise
+            finally:
+                self._cond.notify_all()
+
+    def backoff(self, kind, attempt):
+        """收到 429：清空配額並暫停一段指數退避時間"""
+        delay = min(2 ** attempt, 32) + random.random()
+        with self._cond:
+            self._paused_until[kind] = max(self._paused_until[kind], time.monotonic() + delay)
+            self.buckets[kind].tokens = 0
+            self.counters['throttled_429'] += 1
+            self._cond.notify_all()
+        print(f"[Quota] {kind} 收到 429，暫停 {delay:.1f} 秒")
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._cond:
+            out = {}
+            for kind, bucket in self.buckets.items():
+                bucket.refill(now)
+                out[kind] = {
+                    'headroom': round(bucket.tokens, 1), 'capacity': bucket.capacity,
+                    'queued': len(self._queues[kind]), 'paused_for': round(max(self._paused_until[kind] - now, 0), 1)
+                }
+            return {**out, 'granted': dict(self.counters['granted']), 'timeouts': self.counters['timeouts'],
+                    'throttled_429': self.counters['throttled_429'], 'wait_seconds': round(self.counters['wait_seconds'], 2)}
+
+sheets_governor = QuotaGovernor(SHEETS_READ_PER_MIN, SHEETS_WRITE_PER_MIN)
+
+# ===== 斷路器 =====
+# 最近的 Sheets 呼叫錯誤率或慢呼叫比例過高就跳脫（open），冷卻後放一個探測請求（half-open），
+# 成功才恢復（closed）並重送離線日誌
+SHEETS_TIMEOUT = float(os.environ.get('SHEETS_TIMEOUT', 10))
+BREAKER_WINDOW = 20
+BREAKER_MIN_CALLS = 5
+BREAKER_FAILURE_RATIO = 0.5
+BREAKER_SLOW_SECONDS = 4.0
+BREAKER_COOLDOWN = 30
+
+class SheetsUnavailable(Exception):
+    """斷路器開啟中，不呼叫 Sheets"""
+
+def is_storage_outage(e):
+    """判斷是否為 Sheets 無法使用（而不是資料本身的錯誤）"""
+    if isinstance(e, (SheetsUnavailable, QuotaTimeout, requests.exceptions.RequestException)):
+        return True
+    if isinstance(e, gspread.exceptions.APIError):
+        status = getattr(e.response, 'status_code', 0) or 0
+        return status == 429 or status >= 500
+    return False
+
+class CircuitBreaker:
+    def __init__(self):
+        self.state = 'closed'
+        self.opened_at = 0.0
+        self.probing = False
+        self.calls = deque(maxlen=BREAKER_WINDOW)
+        self.trips = 0
+        self._lock = new_lock()
+        self.on_close = []
+
+    def before_call(self):
+        with self._lock:
+            if self.state == 'closed':
+                return
+            if self.state == 'open' and time.monotonic() - self.opened_at >= BREAKER_COOLDOWN:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self.probing:
+                self.probing = True
+                return
+            raise SheetsUnavailable('Google Sheets 暫時無法使用')
+
+    def record(self, ok, elapsed):
+        callbacks = []
+        with self._lock:
+            self.calls.append((ok, elapsed >= BREAKER_SLOW_SECONDS))
+            if self.state == 'half_open':
+                self.probing = False
+                if ok:
+                    self.state = 'closed'
+                    self.calls.clear()
+                    callbacks = list(self.on_close)
+                    print("[Breaker] Sheets 恢復，斷路器關閉")
+                else:
+                    self._trip()
+            elif self.state == 'closed' and len(self.calls) >= BREAKER_MIN_CALLS:
+                failed = sum(1 for c_ok, _ in self.calls if not c_ok) / len(self.calls)
+                slow = sum(1 for _, c_slow in self.calls if c_slow) / len(self.calls)
+                if failed >= BREAKER_FAILURE_RATIO or slow >= BREAKER_FAILURE_RATIO:
+                    self._trip()
+        for cb in callbacks:
+            spawn_background(cb)
+
+    def cancel_probe(self):
+        """探測請求沒送出（例如配額排隊逾時），讓下一個請求來探測"""
+        with self._lock:
+            self.probing = False
+
+    def _trip(self):
+        self.state = 'open'
+        self.opened_at = time.monotonic()
+        self.trips += 1
+        print(f"[Breaker] Sheets 異常，斷路器開啟 {BREAKER_COOLDOWN} 秒")
+
+    def is_open(self):
+        return self.state == 'open' and time.monotonic() - self.opened_at < BREAKER_COOLDOWN
+
+    def snapshot(self):
+        with self._lock:
+            return {'state': self.state, 'trips': self.trips, 'window': len(self.calls),
+                    'failures': sum(1 for ok, _ in self.calls if not ok), 'slow': sum(1 for _, slow in self.calls if slow)}
+
+sheets_breaker = CircuitBreaker()
+
+def _governed_client_class():
+    """gspread 延遲載入，所以 Client 子類別在第一次授權時才建立"""
+
+    class GovernedClient(gspread.Client):
+        """每個 HTTP 請求先經過斷路器、再向 sheets_governor 取配額，429 時退避重試"""
+
+        def request(self, method, endpoint, *args, **kwargs):
+            kind = 'read' if method.lower() == 'get' else 'write'
+            priority = _sheets_priority.get()
+            for attempt in range(SHEETS_MAX_RETRIES):
+                sheets_breaker.before_call()
+                try:
+                    sheets_governor.acquire(kind, priority)
+                except QuotaTimeout:
+                    sheets_breaker.cancel_probe()
+                    raise
+                start = time.monotonic()
+                try:
+                    resp = super().request(method, endpoint, *args, **kwargs)
+                    sheets_breaker.record(True, time.monotonic() - start)
+                    return resp
+                except Exception as e:
+                    # 資料錯誤（4xx）代表 Sheets 本身正常
+                    sheets_breaker.record(not is_storage_outage(e), time.monotonic() - start)
+                    status = getattr(getattr(e, 'response', None), 'status_code', None)
+                    if not isinstance(e, gspread.exceptions.APIError) or status != 429 or attempt == SHEETS_MAX_RETRIES - 1:
+                        raise
+                    sheets_governor.backoff(kind, attempt)
+
+    return GovernedClient
+
+def set_sheets_priority(priority):
+    """設定目前請求 / 執行緒的 Sheets 優先順序"""
+    _sheets_priority.set(priority)
+
 def get_gspread_client():
-    global _gspread_client, _client_time
-    now = time.time()
-    if _gspread_client and (now - _client_time) < CACHE_TTL:
-        return _gspread_client
-    creds = Credentials.from_service_account_info(json.loads(GOOGLE_CREDENTIALS_JSON), scopes=SCOPES)
-    _gspread_client = gspread.authorize(creds)
-    _client_time = now
+    """取得 gspread client（只建立一次，token 快到期才更新）"""
+    global _gspread_client
+    if _gspread_client is None:
+        with _registry_lock:
+            if _gspread_client is None:
+                from google.oauth2.service_account import Credentials
+                creds = Credentials.from_service_account_info(json.loads(GOOGLE_CREDENTIALS_JSON), scopes=SCOPES)
+                _gspread_client = gspread.authorize(creds, client_factory=_governed_client_class())
+                _gspread_client.set_timeout(SHEETS_TIMEOUT)
+    refresh_token_if_needed(_gspread_client.auth)
     return _gspread_client
 
+def refresh_token_if_needed(creds):
+    """token 不存在或將在 TOKEN_REFRESH_MARGIN 秒內到期時才更新"""
+    expiry = getattr(creds, 'expiry', None)
+    if creds.token and expiry and (expiry - datetime.utcnow()).total_seconds() > TOKEN_REFRESH_MARGIN:
+        return
+    with _registry_lock:
+        expiry = getattr(creds, 'expiry', None)
+        if creds.token and expiry and (expiry - datetime.utcnow()).total_seconds() > TOKEN_REFRESH_MARGIN:
+            return
+        from google.auth.transport.requests import Request
+        creds.refresh(Request())
+        print(f"[Sheets] token 已更新，到期 {creds.expiry}")
+
+def load_sheet_registry():
+    """讀一次試算表資訊，快取所有 Worksheet，並建立缺少的工作表"""
+    global _spreadsheet, _worksheets
+    if _spreadsheet is not None:
+        return _worksheets
+    with _registry_lock:
+        if _spreadsheet is None:
+            ss = get_gspread_client().open_by_key(SPREADSHEET_ID)
+            sheets = {ws.title: ws for ws in ss.worksheets()}
+            for name, headers in SHEET_HEADERS.items():
+                if name not in sheets:
+                    sheets[name] = ss.add_worksheet(title=name, rows=1000, cols=len(headers))
+                    sheets[name].append_row(headers)
+                    print(f"[Sheets] 建立工作表 {name}")
+            _worksheets = sheets
+            _spreadsheet = ss
+    return _worksheets
+
+def reset_sheet_registry():
+    """清除工作表快取（工作表被手動刪除或改名時使用）"""
+    global _spreadsheet, _worksheets
+    with _registry_lock:
+        _spreadsheet = None
+        _worksheets = {}
+
 def get_sheet(name):
-    return get_gspread_client().open_by_key(SPREADSHEET_ID).worksheet(name)
+    ws = load_sheet_registry().get(name)
+    if ws is None:
+        raise gspread.exceptions.WorksheetNotFound(name)
+    return ws
 
 def get_today():
     return datetime.now(TZ).strftime('%Y-%m-%d')
@@ -122,76 +571,289 @@ def get_today():
 def get_now():
     return datetime.now(TZ).strftime('%Y-%m-%d %H:%M:%S')
 
+# ===== 紀錄欄式儲存 =====
+# 每種紀錄讀一次後轉成 logstore.LogColumns（時間 array('q') + 數值/類別欄），跟其他快取一起過期；
+# 日期區間用二分搜尋，不用再對每一列做字串前綴比對
+NAN = float('nan')
+
+# 欄名 → (原始欄位索引, 'num' 或 'cat', 預設值)
+LOG_COLUMNS = {
+    'water_log': {},
+    'stand_log': {},
+    'exercise_log': {'type': (1, 'cat', ''), 'minutes': (2, 'num', 0.0), 'calories': (3, 'num', 0.0)},
+    'eye_log': {'status': (1, 'cat', '')},
+    'weight_log': {'weight': (1, 'num', NAN)},
+    'sleep_log': {'hours': (1, 'num', NAN), 'quality': (2, 'num', NAN)},
+    'meal_log': {'meal': (1, 'cat', ''), 'foods': (2, 'text', ''), 'calories': (3, 'num', 0.0)},
+    'mood_log': {'mood': (1, 'cat', ''), 'score': (2, 'num', NAN)},
+}
+
+def get_log_columns(name):
+    """某個紀錄工作表的欄式儲存（快取 DATA_CACHE_TTL 秒，寫入後隨 clear_cache 重建）"""
+    return get_cached(f'cols:{name}', lambda: logstore.LogColumns.from_rows(read_sheet_values(name)[1:], LOG_COLUMNS[name]))
+
+# ===== 事件紀錄 =====
+# events 工作表是系統紀錄：每次寫入先 append 一筆領域事件，再照舊寫進各紀錄表（匯出、封存、手動查看用）；
+# 每日統計（今日、週報、連續達標、成就）都從記憶體中的投影讀，本機寫入立即套用，
+# 其他 worker 的事件每 EVENT_SYNC_SECONDS 從尾端補讀。投影定期存快照，重啟時只重播快照之後的事件；
+# 沒有快照（第一次啟用或換了機器）時由各紀錄表與每日彙總重建
+EVENT_SHEET = 'events'
+EVENT_SYNC_SECONDS = DATA_CACHE_TTL
+EVENT_SNAPSHOT_PATH = os.environ.get('EVENT_SNAPSHOT_PATH', 'data/projection.json')
+EVENT_SNAPSHOT_EVERY = 200  # 套用這麼多筆事件就存一次快照
+EVENT_SNAPSHOT_SECONDS = 600
+DAY_TOTAL_KEYS = ('water', 'stand', 'exercise_minutes', 'exercise_calories')
+_projection = None
+_projection_lock = new_lock(threading.RLock)
+_projection_sync = new_lock()
+_projection_state = {'synced': 0, 'saved': 0, 'saved_applied': 0}
+
+def load_projection_snapshot():
+    try:
+        with open(EVENT_SNAPSHOT_PATH, encoding='utf-8') as f:
+            return events.Projection.from_dict(json.load(f))
+    except (OSError, ValueError, KeyError):
+        return None
+
+def save_projection():
+    """投影寫成快照（先寫暫存檔再換名）"""
+    with _projection_lock:
+        if _projection is None:
+            return
+        data = json.dumps(_projection.to_dict(), ensure_ascii=False)
+        _projection_state.update(saved=time.time(), saved_applied=_projection.applied)
+    try:
+        write_file_atomic(EVENT_SNAPSHOT_PATH, data)
+    except OSError as e:
+        print(f"[Events] 快照寫入失敗: {e}")
+
+def _maybe_save_projection():
+    p = _projection
+    if p and (p.applied - _projection_state['saved_applied'] >= EVENT_SNAPSHOT_EVERY
+              or time.time() - _projection_state['saved'] > EVENT_SNAPSHOT_SECONDS):
+        save_projection()
+
+def count_event_rows():
+    """事件表目前的事件筆數；事件只 append 不刪，資料一定從第 1 列連續排下來，
+    所以只要讀格線最後一段的 A 欄就知道最後一列在哪，不用下載整張表"""
+    flush_pending_writes(EVENT_SHEET)
+    get_sheet(EVENT_SHEET)
+    sheet = _spreadsheet.worksheet(EVENT_SHEET)  # 重新取得，row_count 才是目前的格線列數
+    start = max(sheet.row_count - EXPORT_CHUNK_ROWS + 1, 1)
+    tail = sheet.get(f'A{start}:A{sheet.row_count}')
+    if not tail and start > 1:
+        # 格線尾端有一大段空白（例如手動加了列），退回讀整個 A 欄
+        return max(len(sheet.col_values(1)) - 1, 0)
+    return max(start - 1 + len(tail) - 1, 0)
+
+# 重建時會累加進每日統計的紀錄表；更正、刪除與設定類事件重套一次結果相同，不必比對
+TALLIED_LOGS = ('water_log', 'stand_log', 'exercise_log', 'eye_log')
+TALLIED_EVENTS = {events.LOG_EVENTS[name][0]: name for name in TALLIED_LOGS}
+
+def rebuild_projection():
+    """由各紀錄表重建投影，從讀紀錄表之前事件表的尾端開始接；
+    讀紀錄表期間寫入、但紀錄表已讀到的事件記為 pending，補讀尾端時略過，不會算兩次"""
+    offset = count_event_rows()
+    cols = {name: get_log_columns(name) for name in TALLIED_LOGS}
+    p = events.Projection(offset)
+    today = get_today()
+    for d, t in read_legacy_totals('0001-01-01', today, cols).items():
+        p.day(d).update(t)
+    ex = cols['exercise_log']
+    rows = ex.span(*logstore.day_bounds('0001-01-01', today))
+    for i, t, m, c in zip(rows, ex.values('type', rows), ex.values('minutes', rows), ex.values('calories', rows)):
+        at = logstore.to_text(ex.ts[i])
+        p.day(at[:10])['exercises'].append([at, t, int(m), int(c)])
+    p.settings = read_settings()
+    p.pending = covered_tail_events(offset, cols)
+    print(f"[Events] 由紀錄表重建投影：{len(p.days)} 天，從事件表第 {offset} 筆之後開始重播"
+          f"（其中 {len(p.pending)} 筆紀錄表已涵蓋）")
+    return p
+
+def covered_tail_events(offset, cols):
+    """事件表第 offset 筆之後、紀錄表裡已有同一時間那列的累加事件 ID（依時間比對）"""
+    seen, covered = {}, set()
+    for chunk in iter_sheet_rows(get_sheet(EVENT_SHEET), first_row=offset + 2, width=len(events.EVENT_HEADERS)):
+        for row in chunk:
+            event = events.from_row(row)
+            name = event and TALLIED_EVENTS.get(event['type'])
+            if not name:
+                continue
+            if name not in seen:
+                seen[name] = set(cols[name].ts)
+            try:
+                if logstore.to_ts(event['time']) in seen[name]:
+                    covered.add(event['id'])
+            except ValueError:
+                continue
+    return covered
+
+def sync_projection():
+    """讀事件表尾端，套用其他 worker 或重啟前寫入的事件"""
+    first = _projection.offset + 2
+    chunks = list(iter_sheet_rows(get_sheet(EVENT_SHEET), first_row=first, width=len(events.EVENT_HEADERS)))
+    with _projection_lock:
+        if _projection.offset + 2 != first:
+            return 0
+        applied = sum(_projection.apply_rows(chunk) for chunk in chunks)
+        _projection_state['synced'] = time.time()
+    if applied:
+        print(f"[Events] 補套用 {applied} 筆事件（已讀到第 {_projection.offset} 筆）")
+    _maybe_save_projection()
+    return applied
+
+def get_projection():
+    """目前的投影（先讀快照、沒有就重建）；過了 EVENT_SYNC_SECONDS 由一個執行緒補讀尾端，其他執行緒先用現有的"""
+    global _projection
+    if _projection is None:
+        with _projection_lock:
+            if _projection is None:
+                _projection = load_projection_snapshot() or rebuild_projection()
+                _projection_state['saved_applied'] = _projection.applied
+    if time.time() - _projection_state['synced'] > EVENT_SYNC_SECONDS and _projection_sync.acquire(blocking=False):
+        try:
+            sync_projection()
+        except Exception as e:
+            print(f"[Events] 補讀事件失敗: {e}")
+            if is_storage_outage(e):
+                mark_offline()
+        finally:
+            _projection_sync.release()
+    return _projection
+
+def reset_projection(drop_snapshot=False):
+    """丟掉記憶體中的投影（換了試算表時使用），下次讀取重新載入"""
+    global _projection
+    with _projection_lock:
+        _projection = None
+        _projection_state.update(synced=0, saved=0, saved_applied=0)
+    if drop_snapshot and os.path.exists(EVENT_SNAPSHOT_PATH):
+        os.remove(EVENT_SNAPSHOT_PATH)
+
+def emit_event(event):
+    """append 一筆事件（Sheets 無法使用時進離線日誌）並套用到投影；先登記 ID，補讀尾端時才不會重複套用"""
+    try:
+        p = get_projection()
+    except Exception as e:
+        print(f"[Events] 投影無法載入，事件之後由尾端補套用: {e}")
+        p = None
+    if p is not None:
+        with _projection_lock:
+            p.pending.add(event['id'])
+    try:
+        append_or_journal(EVENT_SHEET, events.to_row(event))
+    except Exception:
+        if p is not None:
+            with _projection_lock:
+                p.pending.discard(event['id'])
+        raise
+    if p is not None:
+        with _projection_lock:
+            p.apply(event)
+        _maybe_save_projection()
+    return event
+
+def log_row(sheet_name, row):
+    """紀錄表寫入：先 append 事件（系統紀錄），成功後才寫原本的紀錄表，回傳紀錄表是否已直接寫入"""
+    emit_event(events.from_log_row(sheet_name, row))
+    return append_or_journal(sheet_name, row)
+
+def append_log_rows(sheet_name, rows, **kwargs):
+    """批次寫入（匯入用）：事件與紀錄表各一次 append_rows"""
+    get_sheet(EVENT_SHEET).append_rows([events.to_row(events.from_log_row(sheet_name, r)) for r in rows], **kwargs)
+    get_sheet(sheet_name).append_rows(rows, **kwargs)
+
+def projection_day(date):
+    """投影中某天的統計（複本）"""
+    p = get_projection()
+    with _projection_lock:
+        d = p.days.get(date) or events.empty_day()
+        return {**d, 'exercises': [list(e) for e in d['exercises']]}
+
+def projection_days(start_date, end_date):
+    """投影中日期區間（含頭尾）每天的喝水/起身/運動彙總"""
+    p = get_projection()
+    with _projection_lock:
+        return {d: {k: t[k] for k in DAY_TOTAL_KEYS} for d, t in p.days.items() if start_date <= d <= end_date}
+
+def projection_status():
+    p = _projection
+    if p is None:
+        return None
+    return {'days': len(p.days), 'offset': p.offset, 'pending': len(p.pending), 'applied': p.applied,
+            'synced': round(time.time() - _projection_state['synced'], 1) if _projection_state['synced'] else None}
+
 # ===== 讀取函式 =====
 def read_today_count(log_type):
-    today = get_today()
-    data = get_sheet(f'{log_type}_log').get_all_values()[1:]
-    return sum(1 for row in data if row and len(row) > 0 and row[0].startswith(today))
+    return projection_day(get_today())[log_type]
 
 def read_today_stats():
     today = get_today()
-    client = get_gspread_client()
-    ss = client.open_by_key(SPREADSHEET_ID)
-    
-    water_data = ss.worksheet('water_log').get_all_values()[1:]
-    stand_data = ss.worksheet('stand_log').get_all_values()[1:]
-    exercise_data = ss.worksheet('exercise_log').get_all_values()[1:]
-    
-    water_count = sum(1 for r in water_data if r and len(r) > 0 and r[0].startswith(today))
-    stand_count = sum(1 for r in stand_data if r and len(r) > 0 and r[0].startswith(today))
-    
-    today_exercises = [r for r in exercise_data if r and len(r) > 0 and r[0].startswith(today)]
-    ex_minutes, ex_calories, ex_details = 0, 0, []
-    
-    for row in today_exercises:
-        if len(row) >= 4:
-            ex_type = row[1] if row[1] else '運動'
-            minutes = int(row[2]) if row[2].isdigit() else 0
-            calories = int(row[3]) if row[3].isdigit() else 0
-            ex_minutes += minutes
-            ex_calories += calories
-            ex_details.append(f"{ex_type} {minutes}分鐘")
+    d = projection_day(today)
+    ex_details = [f"{t or '運動'} {int(m)}分鐘" for _, t, m, _ in d['exercises']]
     
     return {
-        'date': today, 'water_count': water_count, 'stand_count': stand_count,
-        'exercise_minutes': ex_minutes, 'exercise_calories': ex_calories,
-        'exercise_details': ex_details, 'exercise_count': len(today_exercises)
+        'date': today, 'water_count': d['water'], 'stand_count': d['stand'],
+        'exercise_minutes': d['exercise_minutes'], 'exercise_calories': d['exercise_calories'],
+        'exercise_details': ex_details, 'exercise_count': len(d['exercises'])
     }
 
+def read_daily_totals(start_date, end_date):
+    """讀取日期區間內每日的喝水/起身/運動彙總（來自事件投影）"""
+    return projection_days(start_date, end_date)
+
+def read_legacy_totals(start_date, end_date, cols):
+    """直接從各紀錄表（cols 為重建時讀到的欄式儲存）彙總每日統計（即時紀錄 + 封存彙總），重建投影時使用"""
+    lo, hi = logstore.day_bounds(start_date, end_date)
+    ex = cols['exercise_log']
+    totals = {}
+
+    def day(d):
+        return totals.setdefault(d, {'water': 0, 'stand': 0, 'exercise_minutes': 0, 'exercise_calories': 0,
+                                     'eye_completed': 0, 'eye_ignored': 0})
+
+    for key, counts in (('water', cols['water_log'].per_day(lo, hi)),
+                        ('stand', cols['stand_log'].per_day(lo, hi)),
+                        ('exercise_minutes', ex.per_day(lo, hi, 'minutes')),
+                        ('exercise_calories', ex.per_day(lo, hi, 'calories'))):
+        for d, n in counts.items():
+            day(logstore.day_text(d))[key] += int(n)
+
+    eye = cols['eye_log']
+    rows = eye.span(lo, hi)
+    for i, status in zip(rows, eye.values('status', rows)):
+        if status in ('completed', 'ignored'):
+            day(logstore.day_text(eye.ts[i] // logstore.DAY))[f'eye_{status}'] += 1
+
+    # 已封存的日期由每日彙總補上
+    for d, agg in read_daily_agg().items():
+        if start_date <= d <= end_date:
+            t = day(d)
+            for k in t:
+                t[k] += agg.get(k, 0)
+
+    return totals
+
 def read_day_stats(date_str):
     """讀取特定日期的統計"""
-    client = get_gspread_client()
-    ss = client.open_by_key(SPREADSHEET_ID)
-    
-    water_data = ss.worksheet('water_log').get_all_values()[1:]
-    stand_data = ss.worksheet('stand_log').get_all_values()[1:]
-    exercise_data = ss.worksheet('exercise_log').get_all_values()[1:]
-    
-    water = sum(1 for r in water_data if r and len(r) > 0 and r[0].startswith(date_str))
-    stand = sum(1 for r in stand_data if r and len(r) > 0 and r[0].startswith(date_str))
-    ex_min = sum(int(r[2]) for r in exercise_data if r and len(r) > 2 and r[0].startswith(date_str) and r[2].isdigit())
-    ex_cal = sum(int(r[3]) for r in exercise_data if r and len(r) > 3 and r[0].startswith(date_str) and r[3].isdigit())
-    
-    return {'water': water, 'stand': stand, 'exercise_minutes': ex_min, 'exercise_calories': ex_cal}
+    t = read_daily_totals(date_str, date_str).get(date_str, {})
+    return {'water': t.get('water', 0), 'stand': t.get('stand', 0),
+            'exercise_minutes': t.get('exercise_minutes', 0), 'exercise_calories': t.get('exercise_calories', 0)}
 
 def read_week_stats():
     """讀取本週每日統計"""
     today = datetime.now(TZ)
     start = today - timedelta(days=today.weekday())
-    client = get_gspread_client()
-    ss = client.open_by_key(SPREADSHEET_ID)
-    
-    water = ss.worksheet('water_log').get_all_values()[1:]
-    stand = ss.worksheet('stand_log').get_all_values()[1:]
-    exercise = ss.worksheet('exercise_log').get_all_values()[1:]
-    
+    end = start + timedelta(days=6)
+    totals = read_daily_totals(start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'))
+
     stats = []
     for i in range(7):
         d = (start + timedelta(days=i)).strftime('%Y-%m-%d')
-        w = sum(1 for r in water if r and len(r) > 0 and r[0].startswith(d))
-        s = sum(1 for r in stand if r and len(r) > 0 and r[0].startswith(d))
-        e = sum(int(r[2]) for r in exercise if r and len(r) > 0 and r[0].startswith(d) and len(r) > 2 and r[2].isdigit())
-        stats.append({'date': d, 'weekday': ['一','二','三','四','五','六','日'][i], 'water': w, 'stand': s, 'exercise': e})
+        t = totals.get(d, {})
+        stats.append({'date': d, 'weekday': ['一','二','三','四','五','六','日'][i],
+                      'water': t.get('water', 0), 'stand': t.get('stand', 0),
+                      'exercise': t.get('exercise_minutes', 0), 'calories': t.get('exercise_calories', 0)})
     return stats
 
 def read_week_summary():
@@ -214,14 +876,8 @@ def read_week_summary():
     days_all_ok = sum(1 for d in week_stats if d['water'] >= goals['water'] and d['stand'] >= goals['stand'] and d['exercise'] >= goals['exercise'])
     
     # 計算總熱量
-    client = get_gspread_client()
-    exercise_data = client.open_by_key(SPREADSHEET_ID).worksheet('exercise_log').get_all_values()[1:]
-    total_calories = 0
-    for row in exercise_data:
-        if row and len(row) > 3 and row[0] >= week_start and row[0] <= week_end + " 23:59:59":
-            if row[3].isdigit():
-                total_calories += int(row[3])
-    
+    total_calories = sum(d.get('calories', 0) for d in week_stats)
+
     return {
         'week_start': week_start,
         'week_end': week_end,
@@ -239,34 +895,25 @@ def read_week_summary():
 def calculate_streak():
     """計算連續達標天數（只檢查最近 30 天加速）"""
     today = datetime.now(TZ)
-    client = get_gspread_client()
-    ss = client.open_by_key(SPREADSHEET_ID)
-    
+
     goals = get_goals()
-    
+
     # 只讀取最近 35 天的資料
     cutoff = (today - timedelta(days=35)).strftime('%Y-%m-%d')
-    
-    water_data = ss.worksheet('water_log').get_all_values()[1:]
-    stand_data = ss.worksheet('stand_log').get_all_values()[1:]
-    exercise_data = ss.worksheet('exercise_log').get_all_values()[1:]
-    
-    # 過濾只保留近期資料
-    water_data = [r for r in water_data if r and len(r) > 0 and r[0] >= cutoff]
-    stand_data = [r for r in stand_data if r and len(r) > 0 and r[0] >= cutoff]
-    exercise_data = [r for r in exercise_data if r and len(r) > 0 and r[0] >= cutoff]
-    
+    totals = read_daily_totals(cutoff, today.strftime('%Y-%m-%d'))
+
     streak = 0
     check_date = today
-    
+
     # 最多檢查 30 天
     for _ in range(30):
         d = check_date.strftime('%Y-%m-%d')
-        
-        water = sum(1 for r in water_data if r[0].startswith(d))
-        stand = sum(1 for r in stand_data if r[0].startswith(d))
-        exercise = sum(int(r[2]) for r in exercise_data if r[0].startswith(d) and len(r) > 2 and r[2].isdigit())
-        
+
+        t = totals.get(d, {})
+        water = t.get('water', 0)
+        stand = t.get('stand', 0)
+        exercise = t.get('exercise_minutes', 0)
+
         # 檢查是否達標
         if water >= goals['water'] and stand >= goals['stand'] and exercise >= goals['exercise']:
             streak += 1
@@ -290,108 +937,456 @@ def normalize_time_format(t):
         return f"{int(h):02d}:{m}"
     return None
 
+# ===== 設定 =====
+# 設定只在記憶體保留一份（已轉好型別）並帶版本號：讀取不用再打 Sheets，
+# 多個欄位一次批次寫回，驗證只在寫入時做一次，且只通知真的有變動欄位的相依快取
+SETTINGS_TTL = 60  # 其他 worker 或手動改試算表的變更，最多 60 秒後生效
+
+# 欄位 → (型別, 預設值, 允許範圍)；'time' 為 HH:mm 字串
+SETTINGS_SCHEMA = {
+    'water_interval': (int, 60, (10, 180)),
+    'stand_interval': (int, 45, (10, 120)),
+    'dnd_start': ('time', '22:00', None),
+    'dnd_end': ('time', '08:00', None),
+    'enabled': (bool, True, None),
+    'water_goal': (int, 8, (1, 20)),
+    'stand_goal': (int, 6, (1, 20)),
+    'exercise_goal': (int, 30, (1, 180)),
+    'weight_goal': (float, 0, (20, 300)),
+    'water_snooze': (str, '', None),
+    'stand_snooze': (str, '', None),
+    'exercise_skip': (str, '', None),
+}
+
+# 欄位變動時要清掉的快取（沒列出的欄位只有 GAS 會讀，不影響任何快取）
+SETTING_DEPENDENTS = {
+    'water_goal': ('streak', 'week_summary', 'achievements'),
+    'stand_goal': ('streak', 'week_summary', 'achievements'),
+    'exercise_goal': ('streak', 'week_summary', 'achievements'),
+    'weight_goal': ('weight_stats',),
+}
+
+def coerce_setting(key, value, check_range=True):
+    """把輸入轉成欄位型別，格式或範圍不對就丟 ValueError"""
+    if key not in SETTINGS_SCHEMA:
+        raise ValueError(f'未知的設定：{key}')
+    kind, _, bounds = SETTINGS_SCHEMA[key]
+    try:
+        if kind is bool:
+            v = value.strip().upper() in ('TRUE', '1', 'ON', 'YES') if isinstance(value, str) else bool(value)
+        elif kind == 'time':
+            v = normalize_time_format(value)
+            if not v:
+                raise ValueError
+        elif kind is int:
+            v = int(float(value))
+        else:
+            v = kind(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{key} 格式錯誤：{value}')
+    if check_range and bounds and not bounds[0] <= v <= bounds[1]:
+        raise ValueError(f'{key} 需介於 {bounds[0]}-{bounds[1]}')
+    return v
+
+def parse_settings(raw):
+    """Sheets 的一列設定 → 帶型別的 dict（手動改壞的欄位用預設值，不認得的欄位原樣保留）"""
+    values = {k: default for k, (_, default, _) in SETTINGS_SCHEMA.items()}
+    for k, v in (raw or {}).items():
+        if k not in SETTINGS_SCHEMA:
+            if k:
+                values[k] = v
+        elif v not in ('', None):
+            try:
+                values[k] = coerce_setting(k, v, check_range=False)
+            except ValueError:
+                pass
+    return values
+
+def _setting_cell(value):
+    """寫回 Sheets 的儲存格值（布林沿用 TRUE/FALSE，GAS 兩種都認得）"""
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    return value
+
+class SettingsStore:
+    """記憶體中的設定與版本號；listeners 為 (欄位, callback)，欄位為 None 表示任何欄位"""
+
+    def __init__(self):
+        self._lock = new_lock(threading.RLock)
+        self._loading = new_lock()
+        self.values = None   # 已轉型的設定
+        self.headers = None  # Sheets 第一列的欄位順序；None 表示還沒成功讀過 Sheets
+        self.version = 0
+        self.loaded_at = 0
+        self.listeners = []
+
+    def load(self):
+        """從 Sheets 重新讀取；手動改過試算表時也會通知相依快取"""
+        rows = read_sheet_values('settings')
+        headers = rows[0] if rows else []
+        values = parse_settings(dict(zip(headers, rows[1])) if len(rows) > 1 else {})
+        with self._lock:
+            old = self.values
+            changed = {k: v for k, v in values.items() if old is not None and old.get(k) != v}
+            self.headers, self.values, self.loaded_at = list(headers), values, time.time()
+            if changed or old is None:
+                self.version += 1
+        save_snapshot('settings', values, time.time())
+        self._notify(changed)
+        return values
+
+    def get(self):
+        """目前設定（複本）；過期時由一個執行緒重讀，其他執行緒先用舊值"""
+        if self.values is None or time.time() - self.loaded_at > SETTINGS_TTL:
+            if self._loading.acquire(blocking=self.values is None):
+                try:
+                    if self.values is None or time.time() - self.loaded_at > SETTINGS_TTL:
+                        self.load()
+                except Exception as e:
+                    print(f"[Settings] 讀取失敗: {e}")
+                    mark_offline()
+                    self._fallback()
+                finally:
+                    self._loading.release()
+        return dict(self.values)
+
+    def _fallback(self):
+        """連不上 Sheets 又沒讀過設定時，先用快照或預設值"""
+        with self._lock:
+            if self.values is None:
+                snap = load_snapshot().get('settings')
+                self.values = parse_settings(snap['data'] if snap else {})
+                self.version += 1
+
+    def update(self, changes, journal=True):
+        """一次寫入多個欄位（只寫有變動的儲存格，單一批次寫入），回傳真的有變動的欄位；Sheets 無法使用時改寫離線日誌"""
+        typed = {k: coerce_setting(k, v) for k, v in changes.items()}
+        with self._lock:
+            try:
+                self.load()  # 先重讀，別的 worker 或手動改過的值不會被舊快取蓋掉
+                changed = {k: v for k, v in typed.items() if self.values.get(k) != v}
+                if not changed:
+                    return {}
+                headers, cells = list(self.headers), []
+                for k, v in changed.items():
+                    if k not in headers:
+                        headers.append(k)
+                        cells.append({'range': gspread.utils.rowcol_to_a1(1, len(headers)), 'values': [[k]]})
+                    cells.append({'range': gspread.utils.rowcol_to_a1(2, headers.index(k) + 1), 'values': [[_setting_cell(v)]]})
+                get_sheet('settings').batch_update(cells, raw=False)
+                self.headers = headers
+            except Exception as e:
+                if not (journal and is_storage_outage(e)):
+                    raise
+                print(f"[Settings] Sheets 無法使用，改寫離線日誌: {e}")
+                self._fallback()
+                changed = {k: v for k, v in typed.items() if self.values.get(k) != v}
+                for k, v in changed.items():
+                    journal_append({'op': 'setting', 'key': k, 'value': _setting_cell(v)})
+            self.values = {**self.values, **changed}
+            if changed:
+                self.version += 1
+        print(f"[Settings] 更新 {changed}（版本 {self.version}）")
+        self._notify(changed)
+        return changed
+
+    def _notify(self, changed):
+        for keys, callback in self.listeners:
+            hit = [k for k in changed if keys is None or k in keys]
+            if hit:
+                try:
+                    callback(hit)
+                except Exception as e:
+                    print(f"[Settings] 通知失敗: {e}")
+
+settings_store = SettingsStore()
+
 def read_settings():
-    data = get_sheet('settings').get_all_records()
-    if data:
-        settings = data[0]
-        # 確保有預設值
-        settings.setdefault('water_interval', 60)
-        settings.setdefault('stand_interval', 45)
-        settings.setdefault('dnd_start', '22:00')
-        settings.setdefault('dnd_end', '08:00')
-        settings.setdefault('enabled', True)
-        settings.setdefault('water_goal', 8)
-        settings.setdefault('stand_goal', 6)
-        settings.setdefault('exercise_goal', 30)
-        # 正規化時間格式
-        settings['dnd_start'] = normalize_time_format(settings.get('dnd_start')) or '22:00'
-        settings['dnd_end'] = normalize_time_format(settings.get('dnd_end')) or '08:00'
-        return settings
-    return {
-        'water_interval': 60, 'stand_interval': 45, 
-        'dnd_start': '22:00', 'dnd_end': '08:00', 'enabled': True,
-        'water_goal': 8, 'stand_goal': 6, 'exercise_goal': 30
-    }
+    """目前設定（帶型別）"""
+    return settings_store.get()
+
+def update_settings(changes, journal=True):
+    """批次更新多個設定，回傳有變動的欄位；每個變動記一筆事件（重送離線日誌時 journal=False，事件當時已記過）"""
+    changed = settings_store.update(changes, journal)
+    if journal:
+        now = get_now()
+        for k, v in changed.items():
+            try:
+                emit_event(events.new_event('GoalChanged' if k.endswith('_goal') else 'SettingChanged', now, {'key': k, 'value': v}))
+            except Exception as e:
+                print(f"[Events] 設定事件寫入失敗 {k}: {e}")
+    return changed
+
+def write_setting(key, value, journal=True):
+    """寫入單一設定，回傳是否成功"""
+    try:
+        update_settings({key: value}, journal)
+        return True
+    except Exception as e:
+        print(f"[Settings] 寫入 {key} 失敗: {e}")
+        return False
+
+def _invalidate_setting_dependents(keys):
+    for dep in {d for k in keys for d in SETTING_DEPENDENTS[k]}:
+        clear_cache(dep)
+
+settings_store.listeners.append((tuple(SETTING_DEPENDENTS), _invalidate_setting_dependents))
 
 # ===== 體重相關 =====
 def write_weight(weight):
     """記錄體重"""
-    try:
-        sheet = get_sheet('weight_log')
-    except:
-        # 如果工作表不存在，建立它
-        ss = get_gspread_client().open_by_key(SPREADSHEET_ID)
-        sheet = ss.add_worksheet(title='weight_log', rows=1000, cols=2)
-        sheet.append_row(['時間', '體重(kg)'])
-    
-    sheet.append_row([get_now(), weight])
+    log_row('weight_log', [get_now(), weight])
+    clear_cache()
     return weight
 
 def read_weight_history(days=30):
-    """讀取體重歷史"""
+    """讀取體重歷史（days=None 表示全部）"""
     try:
-        data = get_sheet('weight_log').get_all_values()[1:]
+        cols = get_log_columns('weight_log')
     except:
         return []
     
-    cutoff = (datetime.now(TZ) - timedelta(days=days)).strftime('%Y-%m-%d')
+    start = logstore.to_ts((datetime.now(TZ) - timedelta(days=days)).strftime('%Y-%m-%d')) if days else 0
+    rows = cols.span(start, 2 ** 62)
     history = []
     
-    for row in data:
-        if row and len(row) >= 2 and row[0] >= cutoff:
-            try:
-                weight = float(row[1])
-                date = row[0][:10]
-                history.append({'date': date, 'weight': weight, 'time': row[0]})
-            except:
-                pass
+    for ts, weight in zip(cols.ts[rows.start:rows.stop], cols.values('weight', rows)):
+        if weight == weight:  # NaN 表示打錯或空白
+            t = logstore.to_text(ts)
+            history.append({'date': t[:10], 'weight': weight, 'time': t})
     
     return history
 
 def get_weight_stats():
-    """取得體重統計"""
-    history = read_weight_history(30)
-    
+    """取得體重統計（全部歷史：EMA 趨勢、斜率、目標預估，剔除打錯的數值）"""
+    history = read_weight_history(None)
+
     if not history:
         return None
-    
-    latest = history[-1]
-    
-    # 找最近 7 天的記錄
-    week_ago = (datetime.now(TZ) - timedelta(days=7)).strftime('%Y-%m-%d')
-    week_records = [h for h in history if h['date'] >= week_ago]
-    
-    # 找 30 天前的記錄
-    month_ago = (datetime.now(TZ) - timedelta(days=30)).strftime('%Y-%m-%d')
-    month_start_records = [h for h in history if h['date'][:10] == month_ago[:10]]
-    
-    stats = {
-        'current': latest['weight'],
-        'current_date': latest['date'],
-        'records_count': len(history)
-    }
-    
-    # 計算週變化
-    if len(week_records) >= 2:
-        stats['week_change'] = round(latest['weight'] - week_records[0]['weight'], 1)
-    else:
-        stats['week_change'] = None
-    
-    # 計算月變化
-    if month_start_records:
-        stats['month_change'] = round(latest['weight'] - month_start_records[0]['weight'], 1)
-    elif len(history) >= 2:
-        stats['month_change'] = round(latest['weight'] - history[0]['weight'], 1)
-    else:
-        stats['month_change'] = None
-    
-    # 最高最低
-    weights = [h['weight'] for h in history]
-    stats['max'] = max(weights)
-    stats['min'] = min(weights)
-    
+
+    try:
+        goal = read_settings().get('weight_goal') or 0
+    except:
+        goal = 0
+
+    now_day = analytics.to_epoch_days([get_now()])[0]
+    stats = analytics.weight_trend([h['time'] for h in history], [h['weight'] for h in history], now_day, goal)
+    if not stats:
+        return None
+
+    stats['records_count'] = len(history)
     return stats
 
+# ===== 離線日誌 =====
+# Sheets 無法使用時，寫入先 fsync 到本機 JSONL，斷路器恢復後依工作表合併成 append_rows 重送
+JOURNAL_PATH = os.environ.get('JOURNAL_PATH', 'data/journal.jsonl')
+_journal_lock = new_lock()
+_replay_lock = new_lock()
+_journal_cache = (None, [])  # (檔案戳記, 內容)
+
+def journal_append(entry):
+    """寫一筆離線日誌（每筆都 fsync，重啟也不會遺失）"""
+    with _journal_lock:
+        os.makedirs(os.path.dirname(JOURNAL_PATH) or '.', exist_ok=True)
+        with open(JOURNAL_PATH, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+    mark_offline()
+    print(f"[Journal] Sheets 無法使用，暫存 {entry['op']} {entry.get('sheet', entry.get('key'))}")
+
+def _journal_stamp():
+    """兩個日誌檔的 (大小, 修改時間)；不存在為 None"""
+    stamp = []
+    for path in (JOURNAL_PATH + '.replaying', JOURNAL_PATH):
+        try:
+            st = os.stat(path)
+            stamp.append((st.st_size, st.st_mtime_ns))
+        except OSError:
+            stamp.append(None)
+    return tuple(stamp)
+
+def read_journal():
+    """尚未重送的日誌（含重送中的）；檔案沒變就沿用上次讀到的（日誌檔由所有 worker 共用，不能只記在記憶體）"""
+    global _journal_cache
+    with _journal_lock:
+        stamp = _journal_stamp()
+        if _journal_cache[0] != stamp:
+            entries = []
+            for path in (JOURNAL_PATH + '.replaying', JOURNAL_PATH):
+                try:
+                    with open(path, encoding='utf-8') as f:
+                        entries.extend(json.loads(line) for line in f if line.strip())
+                except (OSError, ValueError):
+                    pass
+            _journal_cache = (stamp, entries)
+        return list(_journal_cache[1])
+
+def journaled_rows(sheet_name, prefix=''):
+    return [e['row'] for e in read_journal()
+            if e['op'] == 'append' and e['sheet'] == sheet_name and str(e['row'][0]).startswith(prefix)]
+
+def replay_journal():
+    """把離線日誌補寫回 Sheets，失敗的部分留在日誌裡下次再送"""
+    if not _replay_lock.acquire(blocking=False):
+        return 0
+    replaying = JOURNAL_PATH + '.replaying'
+    try:
+        with _journal_lock:
+            if not os.path.exists(replaying):
+                if not os.path.exists(JOURNAL_PATH):
+                    return 0
+                os.replace(JOURNAL_PATH, replaying)
+        with open(replaying, encoding='utf-8') as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+
+        appends, settings = {}, []
+        for e in entries:
+            if e['op'] == 'append':
+                appends.setdefault(e['sheet'], []).append(e['row'])
+            elif e['op'] == 'setting':
+                settings.append(e)
+
+        done, remaining = 0, []
+        for name, rows in appends.items():
+            try:
+                get_sheet(name).append_rows(rows)
+                done += len(rows)
+            except Exception as e:
+                print(f"[Journal] 重送 {name} 失敗: {e}")
+                remaining.extend({'op': 'append', 'sheet': name, 'row': r} for r in rows)
+        if settings:
+            try:
+                settings_store.load()  # 記憶體裡已是離線時改的值，先讀回 Sheets 上的版本才比得出差異
+                update_settings({e['key']: e['value'] for e in settings}, journal=False)
+                done += len(settings)
+            except ValueError as e:
+                print(f"[Journal] 設定格式錯誤，略過: {e}")
+            except Exception as e:
+                print(f"[Journal] 重送設定失敗: {e}")
+                remaining.extend(settings)
+
+        with _journal_lock:
+            if remaining:
+                with open(JOURNAL_PATH, 'a', encoding='utf-8') as f:
+                    f.writelines(json.dumps(e, ensure_ascii=False) + '\n' for e in remaining)
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.remove(replaying)
+        clear_cache()
+        print(f"[Journal] 已重送 {done} 筆，剩餘 {len(remaining)} 筆")
+        return done
+    finally:
+        _replay_lock.release()
+
+sheets_breaker.on_close.append(replay_journal)
+
+def append_or_journal(sheet_name, row):
+    """新增一列；Sheets 無法使用時改寫離線日誌，回傳是否已直接寫入（批次處理中先暫存，視為已寫入）"""
+    batch = _write_batch.get()
+    if batch is not None:
+        batch.add(sheet_name, row)
+        return True
+    try:
+        get_sheet(sheet_name).append_row(row)
+    except Exception as e:
+        if not is_storage_outage(e):
+            raise
+        journal_append({'op': 'append', 'sheet': sheet_name, 'row': row})
+        return False
+    # 例如重啟前留下的日誌，Sheets 正常時順便補寫
+    if os.path.exists(JOURNAL_PATH) and not _replay_lock.locked():
+        spawn_background(replay_journal)
+    return True
+
+# ===== 批次寫入 =====
+# 同一次 webhook 的多個事件處理期間，append_or_journal 先把列收進 WriteBatch，
+# 處理完每張工作表一次 append_rows；讀整張表之前先寫出那張表暫存的列，讀得到自己剛寫的。
+# 依列號刪除的修改（修改杯數、刪除/清空運動）不能暫存，先寫出整批再直接寫（write_through）
+_write_batch = contextvars.ContextVar('write_batch', default=None)
+
+class WriteBatch:
+    """依工作表暫存待寫入的列（預取的執行緒讀表時也會寫出暫存，所以加鎖）"""
+
+    def __init__(self):
+        self.rows = {}
+        self.owners = {}  # 和 rows 對應：每一列是哪個事件寫的
+        self.owner = None  # 目前正在處理的事件
+        self.dropped = set()  # 列被作廢的事件（只有這些回覆改成忙碌）
+        self.written = 0
+        self.error = None  # 任何一次寫出失敗就記下來
+        self._lock = threading.Lock()
+
+    def add(self, sheet_name, row):
+        with self._lock:
+            self.rows.setdefault(sheet_name, []).append(row)
+            self.owners.setdefault(sheet_name, []).append(self.owner)
+
+    def flush(self, sheet_name=None):
+        """寫出暫存的列（指定工作表時只寫那一張和事件表，事件表一律最先）；Sheets 無法使用時改寫離線日誌。
+        事件表寫入失敗就整批作廢（紀錄表的列也不寫）並丟出；事件已寫入後紀錄表才失敗，改寫離線日誌稍後重送"""
+        with self._lock:
+            names = [EVENT_SHEET, sheet_name] if sheet_name else sorted(self.rows, key=lambda n: n != EVENT_SHEET)
+            pending = {n: self.rows.pop(n) for n in names if self.rows.get(n)}
+            owners = {n: self.owners.pop(n) for n in pending}
+        journaled = False
+        for name, rows in pending.items():
+            try:
+                get_sheet(name).append_rows(rows)
+            except Exception as e:
+                if not is_storage_outage(e):
+                    if name == EVENT_SHEET:
+                        print(f"[Batch] 寫入事件失敗，整批作廢: {e}")
+                        self.error = self.error or e
+                        self.dropped.update(o for n in pending for o in owners[n])
+                        raise
+                    print(f"[Batch] 寫入 {name} 失敗，改寫離線日誌稍後重送: {e}")
+                for row in rows:
+                    journal_append({'op': 'append', 'sheet': name, 'row': row})
+                journaled = True
+            self.written += len(rows)
+        # 和 append_or_journal 一樣，Sheets 正常時順便補寫之前留下的日誌
+        if pending and not journaled and os.path.exists(JOURNAL_PATH) and not _replay_lock.locked():
+            spawn_background(replay_journal)
+        return len(pending)
+
+def flush_pending_writes(sheet_name=None):
+    batch = _write_batch.get()
+    if batch is not None:
+        batch.flush(sheet_name)
+
+@contextmanager
+def write_through():
+    """先寫出整批暫存的列，區塊內的寫入不暫存、直接送出（事件仍先於紀錄表的修改）"""
+    batch = _write_batch.get()
+    if batch is not None:
+        batch.flush()
+    token = _write_batch.set(None)
+    try:
+        yield
+    finally:
+        _write_batch.reset(token)
+
+def read_sheet_values(name):
+    """整張工作表的值（先寫出同一批次裡這張表還沒寫出的列）"""
+    flush_pending_writes(name)
+    return get_sheet(name).get_all_values()
+
+def read_today_log(log_type):
+    """今日的紀錄列（含尚未重送的離線日誌）；Sheets 無法使用時以快照的筆數估計"""
+    today = get_today()
+    name = f'{log_type}_log'
+    try:
+        data = read_sheet_values(name)[1:]
+    except Exception as e:
+        if not is_storage_outage(e):
+            raise
+        mark_offline()
+        snap = _data_cache.get('today') or (load_snapshot().get('today') or {}).get('data') or {}
+        known = snap.get(f'{log_type}_count', 0) if snap.get('date') == today else 0
+        data = [[today]] * known  # 只知道筆數、不知道時間
+    return [r for r in data if r and r[0].startswith(today)] + journaled_rows(name, today)
+
 # ===== 寫入函式（加入防重複）=====
 
 # ===== 成就系統 =====
@@ -447,32 +1442,32 @@ FOOD_CALORIES = {
 }
 
 def get_or_create_sheet(name, headers):
-    """取得或建立工作表"""
-    try:
-        return get_sheet(name)
-    except:
-        ss = get_gspread_client().open_by_key(SPREADSHEET_ID)
-        sheet = ss.add_worksheet(title=name, rows=1000, cols=len(headers))
-        sheet.append_row(headers)
-        return sheet
+    """取得或建立工作表（查 registry，不存在才建立並登記）"""
+    sheets = load_sheet_registry()
+    if name in sheets:
+        return sheets[name]
+    with _registry_lock:
+        if name not in sheets:
+            sheet = _spreadsheet.add_worksheet(title=name, rows=1000, cols=len(headers))
+            sheet.append_row(headers)
+            sheets[name] = sheet
+        return sheets[name]
 
 # ===== 睡眠記錄 =====
 def write_sleep(hours, quality, note=''):
     """記錄睡眠"""
-    sheet = get_or_create_sheet('sleep_log', ['日期', '時數', '品質(1-5)', '備註'])
-    today = get_today()
-    sheet.append_row([today, hours, quality, note])
+    log_row('sleep_log', [get_today(), hours, quality, note])
     clear_cache()
     return hours, quality
 
 def read_sleep_history(days=30):
-    """讀取睡眠歷史"""
+    """讀取睡眠歷史（days=None 表示全部）"""
     try:
-        data = get_sheet('sleep_log').get_all_values()[1:]
+        data = read_sheet_values('sleep_log')[1:]
     except:
         return []
     
-    cutoff = (datetime.now(TZ) - timedelta(days=days)).strftime('%Y-%m-%d')
+    cutoff = (datetime.now(TZ) - timedelta(days=days)).strftime('%Y-%m-%d') if days else ''
     return [{'date': r[0], 'hours': float(r[1]), 'quality': int(r[2]), 'note': r[3] if len(r) > 3 else ''} 
             for r in data if r and r[0] >= cutoff]
 
@@ -495,8 +1490,6 @@ def get_sleep_stats():
 # ===== 飲食記錄 =====
 def write_meal(meal_type, foods, calories=0, note=''):
     """記錄飲食"""
-    sheet = get_or_create_sheet('meal_log', ['時間', '餐別', '食物', '熱量', '備註'])
-    
     # 自動計算熱量
     if calories == 0 and foods:
         # 支援多種分隔符：、，, 和空格
@@ -519,20 +1512,23 @@ def write_meal(meal_type, foods, calories=0, note=''):
     if calories == 0 and foods:
         calories = 300  # 預設一餐 300 卡
     
-    sheet.append_row([get_now(), meal_type, foods, calories, note])
-    clear_cache()
+    now = get_now()
+    with energy_write():
+        log_row('meal_log', [now, meal_type, foods, calories, note])
+        clear_cache()
+        energy_add(now[:10], intake=calories)
     return calories
 
 def read_meal_today():
     """讀取今日飲食"""
     try:
-        data = get_sheet('meal_log').get_all_values()[1:]
+        cols = get_log_columns('meal_log')
     except:
         return []
     
-    today = get_today()
-    return [{'time': r[0], 'type': r[1], 'foods': r[2], 'calories': int(r[3]) if r[3] else 0} 
-            for r in data if r and r[0].startswith(today)]
+    rows = cols.span(*logstore.day_bounds(get_today()))
+    return [{'time': logstore.to_text(ts), 'type': t, 'foods': f, 'calories': int(c)}
+            for ts, t, f, c in zip(cols.ts[rows.start:rows.stop], cols.values('meal', rows), cols.values('foods', rows), cols.values('calories', rows))]
 
 def get_meal_stats():
     """取得今日飲食統計"""
@@ -544,23 +1540,122 @@ def get_meal_stats():
         'meal_count': len(meals)
     }
 
+# ===== 熱量收支 =====
+# 每日攝取（meal_log）與運動消耗（exercise_log，含已封存的每日彙總）常駐記憶體，
+# write_meal / write_exercise 寫入後直接累加；週/月彙總用 analytics.bucket_series 向量化計算。
+# 重讀在鎖外進行（不擋住寫入），期間只要有寫入進行過就不採用這次的結果，
+# 因為分不出那筆寫入有沒有被讀到，沿用逐筆累加的記憶體版本，下次再重讀
+ENERGY_RECONCILE_SECONDS = 600  # 其他 worker 或匯入工具寫入的紀錄，最多 10 分鐘後併入
+
+_energy = {'days': {}, 'loaded': 0, 'gen': 0, 'writing': 0}
+_energy_lock = new_lock()
+_energy_loading = new_lock()
+
+def _load_energy():
+    """從紀錄重算 {日期: [攝取, 消耗]}"""
+    days = {}
+    for d, cal in get_log_columns('meal_log').per_day(0, 2 ** 62, 'calories').items():
+        days.setdefault(logstore.day_text(d), [0, 0])[0] += int(cal)
+    for d, t in read_daily_totals('1970-01-01', get_today()).items():
+        if t['exercise_calories']:
+            days.setdefault(d, [0, 0])[1] += t['exercise_calories']
+    return days
+
+def _reload_energy():
+    """鎖外重讀；和寫入重疊時不採用（還沒載入過就先用，但讓下次讀取再重讀一次）"""
+    with _energy_lock:
+        gen, quiet = _energy['gen'], not _energy['writing']
+    days = _load_energy()
+    with _energy_lock:
+        if quiet and gen == _energy['gen'] and not _energy['writing']:
+            _energy['days'], _energy['loaded'] = days, time.time()
+        elif not _energy['loaded']:
+            _energy['days'], _energy['loaded'] = days, time.time() - ENERGY_RECONCILE_SECONDS
+        else:
+            print("[Energy] 重讀期間有寫入，沿用記憶體中的累計")
+
+def get_energy_days():
+    """{日期: [攝取, 消耗]}（複本）；超過 ENERGY_RECONCILE_SECONDS 才重讀紀錄（同時只由一個執行緒重讀）"""
+    if time.time() - _energy['loaded'] > ENERGY_RECONCILE_SECONDS:
+        if _energy_loading.acquire(blocking=not _energy['loaded']):
+            try:
+                if time.time() - _energy['loaded'] > ENERGY_RECONCILE_SECONDS:
+                    _reload_energy()
+            except Exception as e:
+                if not _energy['loaded']:
+                    raise
+                print(f"[Energy] 重讀失敗，沿用記憶體中的累計: {e}")
+            finally:
+                _energy_loading.release()
+    with _energy_lock:
+        return {d: list(v) for d, v in _energy['days'].items()}
+
+@contextmanager
+def energy_write():
+    """包住「寫紀錄 + energy_add」：進行中的重讀會知道有寫入重疊"""
+    with _energy_lock:
+        _energy['writing'] += 1
+        _energy['gen'] += 1
+    try:
+        yield
+    finally:
+        with _energy_lock:
+            _energy['writing'] -= 1
+
+def energy_add(day, intake=0, burn=0):
+    """寫入後累加當日攝取/消耗（尚未載入時略過，載入時自然會算到）"""
+    with _energy_lock:
+        if _energy['loaded']:
+            totals = _energy['days'].setdefault(day, [0, 0])
+            totals[0] += intake
+            totals[1] += burn
+
+def reset_energy():
+    """刪除紀錄後無法用加減還原，下次讀取時重算"""
+    with _energy_lock:
+        _energy['loaded'] = 0
+        _energy['gen'] += 1
+
+def energy_balance(start, end=None):
+    """日期區間（含頭尾）的攝取、消耗與淨值"""
+    end = end or start
+    intake = burn = 0
+    for d, (i, b) in get_energy_days().items():
+        if start <= d <= end:
+            intake += i
+            burn += b
+    return {'from': start, 'to': end, 'intake': intake, 'burn': burn, 'net': intake - burn}
+
+def energy_rollup(start, end, bucket='day'):
+    """依日/週/月分桶的攝取、消耗與淨值"""
+    days = sorted((d, v) for d, v in get_energy_days().items() if start <= d <= end)
+    dates = analytics.to_days([d for d, _ in days])
+    keys, intake, _ = analytics.bucket_series(dates, [v[0] for _, v in days], bucket)
+    _, burn, _ = analytics.bucket_series(dates, [v[1] for _, v in days], bucket)
+    return [{'period': str(k), 'intake': int(i), 'burn': int(b), 'net': int(i - b)}
+            for k, i, b in zip(keys, intake, burn)]
+
+def week_start(date_str):
+    """該日所在週的週一"""
+    d = datetime.strptime(date_str, '%Y-%m-%d')
+    return (d - timedelta(days=d.weekday())).strftime('%Y-%m-%d')
+
 # ===== 心情記錄 =====
 def write_mood(emoji, note=''):
     """記錄心情"""
-    sheet = get_or_create_sheet('mood_log', ['時間', '心情', '分數', '備註'])
     score = MOOD_OPTIONS.get(emoji, 3)
-    sheet.append_row([get_now(), emoji, score, note])
+    log_row('mood_log', [get_now(), emoji, score, note])
     clear_cache()
     return emoji, score
 
 def read_mood_history(days=30):
-    """讀取心情歷史"""
+    """讀取心情歷史（days=None 表示全部）"""
     try:
-        data = get_sheet('mood_log').get_all_values()[1:]
+        data = read_sheet_values('mood_log')[1:]
     except:
         return []
     
-    cutoff = (datetime.now(TZ) - timedelta(days=days)).strftime('%Y-%m-%d')
+    cutoff = (datetime.now(TZ) - timedelta(days=days)).strftime('%Y-%m-%d') if days else ''
     return [{'time': r[0], 'emoji': r[1], 'score': int(r[2]), 'note': r[3] if len(r) > 3 else ''} 
             for r in data if r and r[0] >= cutoff]
 
@@ -585,14 +1680,11 @@ def get_mood_stats():
 # ===== 成就計算 =====
 def get_total_stats():
     """取得累計統計"""
-    try:
-        water = len(get_sheet('water_log').get_all_values()) - 1
-        stand = len(get_sheet('stand_log').get_all_values()) - 1
-        exercise_data = get_sheet('exercise_log').get_all_values()[1:]
-        exercise = sum(int(r[2]) for r in exercise_data if r and len(r) > 2 and r[2])
-    except:
-        water, stand, exercise = 0, 0, 0
-    
+    days = read_daily_totals('0001-01-01', get_today()).values()
+    water = sum(d['water'] for d in days)
+    stand = sum(d['stand'] for d in days)
+    exercise = sum(d['exercise_minutes'] for d in days)
+
     return {'total_water': water, 'total_stand': stand, 'total_exercise': exercise}
 
 def get_streak_stats():
@@ -602,7 +1694,7 @@ def get_streak_stats():
     # 計算睡眠連續天數
     sleep_streak = 0
     try:
-        sleep_data = get_sheet('sleep_log').get_all_values()[1:]
+        sleep_data = read_sheet_values('sleep_log')[1:]
         dates = set(r[0] for r in sleep_data if r)
         today = datetime.now(TZ).date()
         for i in range(100):
@@ -617,7 +1709,7 @@ def get_streak_stats():
     # 計算飲食連續天數
     meal_streak = 0
     try:
-        meal_data = get_sheet('meal_log').get_all_values()[1:]
+        meal_data = read_sheet_values('meal_log')[1:]
         dates = set(r[0][:10] for r in meal_data if r)
         today = datetime.now(TZ).date()
         for i in range(100):
@@ -632,7 +1724,7 @@ def get_streak_stats():
     # 計算心情連續天數
     mood_streak = 0
     try:
-        mood_data = get_sheet('mood_log').get_all_values()[1:]
+        mood_data = read_sheet_values('mood_log')[1:]
         dates = set(r[0][:10] for r in mood_data if r)
         today = datetime.now(TZ).date()
         for i in range(100):
@@ -689,92 +1781,150 @@ def get_achievements():
         'stats': stats
     }
 
-def write_water():
-    """新增喝水記錄（含防重複）"""
+# 喝水 / 起身的今日狀態（筆數、最後時間）放在記憶體，點一下只需 append 一列；
+# 第一次使用時從 Sheets 載入（在 _tap_lock 外、同一種紀錄同時只載入一次），跨日自動歸零，
+# 每 TAP_RECONCILE_SECONDS 秒在背景和 Sheets 對帳一次
+TAP_DEDUP_SECONDS = 30
+TAP_RECONCILE_SECONDS = 300
+_tap_state = {}
+_tap_resets = 0  # reset_tap_state 的次數，載入期間被重設過就重新載入
+_tap_lock = new_lock()
+
+def _load_tap_state(log_type):
+    rows = read_today_log(log_type)
+    last = None
+    for row in reversed(rows):
+        try:
+            last = datetime.strptime(row[0], '%Y-%m-%d %H:%M:%S').replace(tzinfo=TZ)
+            break
+        except (ValueError, IndexError):
+            continue
+    return {'day': get_today(), 'count': len(rows), 'last': last, 'loaded': time.time(), 'taps': 0, 'reconciling': False}
+
+def _reconcile_tap_state(log_type, taps_before):
+    """背景重讀今日筆數（例如其他 worker 也有寫入）；對帳期間的點擊另外加回去"""
+    try:
+        fresh = _load_tap_state(log_type)
+    except Exception as e:
+        print(f"[Tap] {log_type} 對帳失敗: {e}")
+        fresh = None
+    with _tap_lock:
+        state = _tap_state.get(log_type)
+        if state is None:
+            return
+        state['reconciling'] = False
+        state['loaded'] = time.time()
+        if fresh and fresh['day'] == state['day']:
+            state['count'] = fresh['count'] + (state['taps'] - taps_before)
+            if fresh['last'] and (state['last'] is None or fresh['last'] > state['last']):
+                state['last'] = fresh['last']
+
+def _ensure_tap_state(log_type):
+    """還沒有今日狀態就載入；讀 Sheets 時不持有 _tap_lock，其他種類的點擊不用等"""
+    with _inflight_lock:
+        key_lock = _inflight.setdefault(f'tap:{log_type}', threading.Lock())
+    with key_lock:
+        while True:
+            with _tap_lock:
+                if log_type in _tap_state:
+                    return
+                resets = _tap_resets
+            fresh = _load_tap_state(log_type)
+            with _tap_lock:
+                if resets == _tap_resets:
+                    _tap_state[log_type] = fresh
+                    return
+
+def _get_tap_state(log_type):
+    """呼叫時需持有 _tap_lock；還沒載入時回傳 None"""
     today = get_today()
+    state = _tap_state.get(log_type)
+    if state is None:
+        return None
+    if state['day'] != today:
+        state.update(day=today, count=0, last=None, loaded=time.time(), taps=0)
+    elif not state['reconciling'] and time.time() - state['loaded'] > TAP_RECONCILE_SECONDS:
+        state['reconciling'] = True
+        spawn_background(_reconcile_tap_state, log_type, state['taps'])
+    return state
+
+def reset_tap_state(log_type=None):
+    """直接改過 Sheets（修改杯數等）後呼叫，下次點擊重新載入"""
+    global _tap_resets
+    with _tap_lock:
+        _tap_resets += 1
+        if log_type:
+            _tap_state.pop(log_type, None)
+        else:
+            _tap_state.clear()
+
+def record_tap(log_type, label):
+    """新增一筆喝水/起身記錄（含防重複），回傳今日第幾次"""
     now = datetime.now(TZ)
-    sheet = get_sheet('water_log')
-    
-    # 讀取今日資料
-    data = sheet.get_all_values()[1:]
-    today_records = [r for r in data if r and len(r) > 0 and r[0].startswith(today)]
-    count = len(today_records)
-    
-    # 防重複：檢查最後一筆是否在 30 秒內
-    if today_records:
-        try:
-            last_time_str = today_records[-1][0]
-            last_time = datetime.strptime(last_time_str, '%Y-%m-%d %H:%M:%S').replace(tzinfo=TZ)
-            if (now - last_time).total_seconds() < 30:
-                print(f"[防重複] 喝水記錄跳過，距上次僅 {(now - last_time).total_seconds():.1f} 秒")
-                return count  # 不寫入，返回原本數量
-        except:
-            pass
+    while True:
+        _ensure_tap_state(log_type)
+        with _tap_lock:
+            state = _get_tap_state(log_type)
+            if state is None:
+                continue  # 載入後又被重設，重新載入
+            if state['last'] and (now - state['last']).total_seconds() < TAP_DEDUP_SECONDS:
+                print(f"[防重複] {label}記錄跳過，距上次僅 {(now - state['last']).total_seconds():.1f} 秒")
+                return state['count']  # 不寫入，返回原本數量
+            prev_last = state['last']
+            state['count'] += 1
+            state['taps'] += 1
+            state['last'] = now
+            count = state['count']
+            break
     
-    # 寫入新記錄
-    sheet.append_row([get_now()])
-    clear_cache('today')  # 清除快取
-    return count + 1
+    try:
+        log_row(f'{log_type}_log', [now.strftime('%Y-%m-%d %H:%M:%S')])
+    except Exception:
+        with _tap_lock:
+            state['count'] -= 1
+            state['taps'] -= 1
+            if state['last'] == now:  # 之後的點擊已更新就保留
+                state['last'] = prev_last
+        raise
+    clear_cache()  # 清除快取
+    return count
+
+def write_water():
+    """新增喝水記錄（含防重複）"""
+    return record_tap('water', '喝水')
 
 def write_stand():
     """新增起身記錄（含防重複）"""
-    today = get_today()
-    now = datetime.now(TZ)
-    sheet = get_sheet('stand_log')
-    
-    # 讀取今日資料
-    data = sheet.get_all_values()[1:]
-    today_records = [r for r in data if r and len(r) > 0 and r[0].startswith(today)]
-    count = len(today_records)
-    
-    # 防重複：檢查最後一筆是否在 30 秒內
-    if today_records:
-        try:
-            last_time_str = today_records[-1][0]
-            last_time = datetime.strptime(last_time_str, '%Y-%m-%d %H:%M:%S').replace(tzinfo=TZ)
-            if (now - last_time).total_seconds() < 30:
-                print(f"[防重複] 起身記錄跳過，距上次僅 {(now - last_time).total_seconds():.1f} 秒")
-                return count  # 不寫入，返回原本數量
-        except:
-            pass
-    
-    # 寫入新記錄
-    sheet.append_row([get_now()])
-    clear_cache('today')  # 清除快取
-    return count + 1
+    return record_tap('stand', '起身')
+
+def exercise_calories(ex_type, duration):
+    """依運動類型估算消耗熱量（每分鐘大卡 × 分鐘）"""
+    return duration * EXERCISE_TYPES.get(ex_type, 5)
 
 def write_exercise(ex_type, duration):
-    cal = duration * EXERCISE_TYPES.get(ex_type, 5)
-    get_sheet('exercise_log').append_row([get_now(), ex_type, duration, cal])
-    clear_cache('today')  # 清除快取
+    cal = exercise_calories(ex_type, duration)
+    now = get_now()
+    with energy_write():
+        log_row('exercise_log', [now, ex_type, duration, cal])
+        clear_cache()  # 清除快取
+        energy_add(now[:10], burn=cal)
     return cal
 
 # ===== 護眼記錄 =====
 def write_eye(status):
     """記錄護眼（completed=已護眼, ignored=忽略）"""
-    sheet = get_or_create_sheet('eye_log', ['時間', '狀態'])
-    sheet.append_row([get_now(), status])
+    log_row('eye_log', [get_now(), status])
     clear_cache()
 
 def get_eye_stats():
     """取得今日護眼統計"""
     try:
-        sheet = get_sheet('eye_log')
-        data = sheet.get_all_values()[1:]
+        d = projection_day(get_today())
     except:
         return {'completed': 0, 'ignored': 0, 'total': 0}
     
-    today = get_today()
-    completed = 0
-    ignored = 0
-    
-    for row in data:
-        if row and row[0].startswith(today):
-            if len(row) > 1:
-                if row[1] == 'completed':
-                    completed += 1
-                elif row[1] == 'ignored':
-                    ignored += 1
+    completed = d['eye_completed']
+    ignored = d['eye_ignored']
     
     return {
         'completed': completed,
@@ -782,34 +1932,14 @@ def get_eye_stats():
         'total': completed + ignored
     }
 
-def write_setting(key, value):
-    try:
-        sheet = get_sheet('settings')
-        headers = sheet.row_values(1)
-        print(f"[Settings] 設定 {key} = {value}, 現有欄位: {headers}")
-        
-        if key in headers:
-            col = headers.index(key) + 1
-            sheet.update_cell(2, col, value)
-            print(f"[Settings] 更新欄位 {key} 在第 {col} 欄")
-            clear_cache()
-            return True
-        else:
-            # 欄位不存在，新增欄位
-            new_col = len(headers) + 1
-            sheet.update_cell(1, new_col, key)
-            sheet.update_cell(2, new_col, value)
-            print(f"[Settings] 新增欄位 {key} 在第 {new_col} 欄")
-            clear_cache()
-            return True
-    except Exception as e:
-        print(f"[Settings] 錯誤: {e}")
-        return False
-
 def set_count(log_type, target):
+    with write_through():
+        return _set_count(log_type, target)
+
+def _set_count(log_type, target):
     today = get_today()
     sheet = get_sheet(f'{log_type}_log')
-    data = sheet.get_all_values()
+    data = read_sheet_values(f'{log_type}_log')
     
     today_rows = []
     for i, row in enumerate(data):
@@ -819,23 +1949,27 @@ def set_count(log_type, target):
             today_rows.append(i + 1)
     
     current = len(today_rows)
+    emit_event(events.new_event('CountCorrected', get_now(), {'log': log_type, 'date': today, 'count': target}))
     
     if target > current:
-        now = get_now()
-        for _ in range(target - current):
-            sheet.append_row([now])
+        sheet.append_rows([[get_now()]] * (target - current))
     elif target < current:
         for row_num in sorted(today_rows[target:], reverse=True):
             try:
                 sheet.delete_rows(row_num)
             except:
                 pass
+    reset_tap_state(log_type)
     return target
 
 def delete_last_exercise():
+    with write_through():
+        return _delete_last_exercise()
+
+def _delete_last_exercise():
     today = get_today()
     sheet = get_sheet('exercise_log')
-    data = sheet.get_all_values()
+    data = read_sheet_values('exercise_log')
     
     last_row, last_info = None, None
     for i, row in enumerate(data):
@@ -846,14 +1980,21 @@ def delete_last_exercise():
             last_info = row
     
     if last_row:
+        emit_event(events.new_event('ExerciseDeleted', get_now(), {'date': today, 'at': last_info[0]}))
         sheet.delete_rows(last_row)
+        clear_cache()
+        reset_energy()
         return last_info
     return None
 
 def clear_today_exercise():
+    with write_through():
+        return _clear_today_exercise()
+
+def _clear_today_exercise():
     today = get_today()
     sheet = get_sheet('exercise_log')
-    data = sheet.get_all_values()
+    data = read_sheet_values('exercise_log')
     
     today_rows = []
     for i, row in enumerate(data):
@@ -863,13 +2004,413 @@ def clear_today_exercise():
             today_rows.append(i + 1)
     
     count = len(today_rows)
+    if count or projection_day(today)['exercises']:
+        emit_event(events.new_event('ExercisesCleared', get_now(), {'date': today}))
     for row_num in sorted(today_rows, reverse=True):
         try:
             sheet.delete_rows(row_num)
         except:
             pass
+    if count:
+        clear_cache()
+        reset_energy()
     return count
 
+# ===== 紀錄封存 =====
+# 超過保留天數的事件列搬到每月封存表（archive_YYYY-MM），並留下每日彙總（daily_agg）
+ARCHIVE_RETENTION_DAYS = int(os.environ.get('ARCHIVE_RETENTION_DAYS', 35))
+ARCHIVE_LOGS = ['water', 'stand', 'exercise', 'eye']
+ARCHIVE_HEADERS = ['log', '時間', '欄位2', '欄位3', '欄位4']
+DAILY_AGG_HEADERS = SHEET_HEADERS['daily_agg']
+
+def read_daily_agg():
+    """讀取每日彙總 {日期: {water, stand, ...}}（同日期多列會相加）"""
+    def fetch():
+        try:
+            data = read_sheet_values('daily_agg')[1:]
+        except:
+            return {}
+        agg = {}
+        for r in data:
+            if not r or not r[0]:
+                continue
+            day = agg.setdefault(r[0], {k: 0 for k in DAILY_AGG_HEADERS[1:]})
+            for i, k in enumerate(DAILY_AGG_HEADERS[1:], start=1):
+                if len(r) > i and r[i].lstrip('-').isdigit():
+                    day[k] += int(r[i])
+        return agg
+    return get_cached('daily_agg', fetch)
+
+def _add_to_agg(agg, log_type, row):
+    """把一列事件加進每日彙總"""
+    day = agg.setdefault(row[0][:10], {k: 0 for k in DAILY_AGG_HEADERS[1:]})
+    if log_type in ('water', 'stand'):
+        day[log_type] += 1
+    elif log_type == 'exercise':
+        if len(row) > 2 and row[2].isdigit():
+            day['exercise_minutes'] += int(row[2])
+        if len(row) > 3 and row[3].isdigit():
+            day['exercise_calories'] += int(row[3])
+    elif log_type == 'eye' and len(row) > 1 and row[1] in ('completed', 'ignored'):
+        day[f'eye_{row[1]}'] += 1
+
+def _row_ranges(row_nums):
+    """把列號整理成連續區間（由下往上），減少 delete_rows 次數"""
+    ranges = []
+    for n in sorted(row_nums):
+        if ranges and n == ranges[-1][1] + 1:
+            ranges[-1][1] = n
+        else:
+            ranges.append([n, n])
+    return sorted(ranges, reverse=True)
+
+def archive_logs(retention_days=None):
+    """封存舊紀錄：寫入每月封存表 → 更新每日彙總 → 刪除即時表舊列；中途失敗重跑不會重複封存或重複彙總"""
+    retention_days = retention_days or ARCHIVE_RETENTION_DAYS
+    cutoff = (datetime.now(TZ) - timedelta(days=retention_days)).strftime('%Y-%m-%d')
+    old_rows = {}
+
+    for log_type in ARCHIVE_LOGS:
+        try:
+            sheet = get_sheet(f'{log_type}_log')
+        except:
+            continue
+        data = sheet.get_all_values()
+        rows = [(i + 1, r) for i, r in enumerate(data) if i > 0 and r and r[0] and r[0][:10] < cutoff]
+        if rows:
+            old_rows[log_type] = (sheet, rows)
+
+    if not old_rows:
+        return {'cutoff': cutoff, 'archived': 0, 'days': 0}
+
+    # 上次中途失敗時，部分列可能已在封存表、部分日期已有彙總
+    months = {r[0][:7] for _, rows in old_rows.values() for _, r in rows}
+    archived_before = Counter()
+    for month in months:
+        sheet = get_or_create_sheet(f'archive_{month}', ARCHIVE_HEADERS)
+        archived_before.update(tuple(r) for r in sheet.get_all_values()[1:])
+    agg_dates = {r[0] for r in get_or_create_sheet('daily_agg', DAILY_AGG_HEADERS).get_all_values()[1:] if r}
+
+    by_month, agg = {}, {}
+    for log_type, (_, rows) in old_rows.items():
+        for _, r in rows:
+            archive_row = ([log_type] + r + [''] * 4)[:len(ARCHIVE_HEADERS)]
+            key = tuple(str(v) for v in archive_row)
+            if archived_before[key]:
+                archived_before[key] -= 1
+                # 已封存且該日已有彙總：只差刪除
+                if r[0][:10] in agg_dates:
+                    continue
+            else:
+                by_month.setdefault(r[0][:7], []).append(archive_row)
+            _add_to_agg(agg, log_type, r)
+
+    # 1. 先寫封存表，確保刪除前資料已保存
+    for month, rows in sorted(by_month.items()):
+        get_or_create_sheet(f'archive_{month}', ARCHIVE_HEADERS).append_rows(rows, value_input_option='RAW')
+
+    # 2. 寫入每日彙總（在刪除之前，失敗時舊列仍在即時表）
+    agg_rows = [[d] + [v[k] for k in DAILY_AGG_HEADERS[1:]] for d, v in sorted(agg.items())]
+    if agg_rows:
+        get_or_create_sheet('daily_agg', DAILY_AGG_HEADERS).append_rows(agg_rows, value_input_option='RAW')
+
+    # 3. 刪除即時表的舊列
+    archived = {}
+    for log_type, (sheet, rows) in old_rows.items():
+        for start, end in _row_ranges([n for n, _ in rows]):
+            sheet.delete_rows(start, end)
+        archived[log_type] = len(rows)
+
+    clear_cache()
+    print(f"[Archive] 封存 {archived}，cutoff={cutoff}，{len(agg_rows)} 天")
+    return {'cutoff': cutoff, 'archived': sum(archived.values()), 'by_log': archived, 'days': len(agg_rows)}
+
+# ===== 匯出 =====
+# 逐段讀取（每次 EXPORT_CHUNK_ROWS 列）、邊讀邊輸出，記憶體用量和歷史長短無關；
+# 每種紀錄先輸出封存表（依月份）再輸出即時表，順序即時間順序
+EXPORT_LOGS = [name[:-4] for name in SHEET_HEADERS if name.endswith('_log')]
+EXPORT_FORMATS = ('csv', 'ndjson')
+EXPORT_CHUNK_ROWS = 1000
+EXPORT_COLUMNS = ['log', '時間', '欄位2', '欄位3', '欄位4', '欄位5']
+
+def iter_sheet_rows(sheet, first_row=2, width=6):
+    """分段讀取工作表，一次 yield 一段（list of rows）；快取的工作表物件 row_count 不會跟著
+    其他 worker 的 append 更新，先重新取得一次（同 count_event_rows）才不會少讀尾端"""
+    sheet = sheet.spreadsheet.worksheet(sheet.title)
+    last_col = chr(ord('A') + width - 1)
+    start = first_row
+    while start <= sheet.row_count:
+        end = start + EXPORT_CHUNK_ROWS - 1
+        chunk = sheet.get(f'A{start}:{last_col}{end}')
+        if not chunk:
+            break
+        yield chunk
+        start = end + 1
+
+def iter_export_rows(logs, start_date, end_date):
+    """依序 yield (log, row)，只包含日期區間內的列"""
+    registry = load_sheet_registry()
+    months = sorted(name for name in registry if name.startswith('archive_') and start_date[:7] <= name[8:] <= end_date[:7])
+    for log_type in logs:
+        sources = [(registry[m], 1) for m in months] if log_type in ARCHIVE_LOGS else []
+        if f'{log_type}_log' in registry:
+            sources.append((registry[f'{log_type}_log'], 0))
+        for sheet, skip in sources:
+            for chunk in iter_sheet_rows(sheet):
+                for r in chunk:
+                    # 封存表第一欄是紀錄種類
+                    if skip and (not r or r[0] != log_type):
+                        continue
+                    row = r[skip:]
+                    if row and start_date <= row[0][:10] <= end_date:
+                        yield log_type, row
+
+def export_stream(logs, fmt, start_date, end_date, gzip_out=False):
+    """產生匯出內容（CSV 或 NDJSON，可選擇即時 gzip）"""
+    single = logs[0] if len(logs) == 1 else None
+    headers = ['log'] + SHEET_HEADERS[f'{single}_log'] if single else EXPORT_COLUMNS
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip_out else None
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+
+    def flush():
+        data = buf.getvalue().encode('utf-8')
+        buf.seek(0)
+        buf.truncate()
+        return compressor.compress(data) if compressor else data
+
+    if fmt == 'csv':
+        buf.write('\ufeff')  # 讓 Excel 正確辨識 UTF-8
+        writer.writerow(headers)
+    count = 0
+    for log_type, row in iter_export_rows(logs, start_date, end_date):
+        if fmt == 'csv':
+            writer.writerow([log_type] + row[:len(headers) - 1])
+        else:
+            keys = SHEET_HEADERS[f'{log_type}_log']
+            buf.write(json.dumps({'log': log_type, **dict(zip(keys, row))}, ensure_ascii=False) + '\n')
+        count += 1
+        if count % EXPORT_CHUNK_ROWS == 0:
+            out = flush()
+            if out:
+                yield out
+    out = flush()
+    if compressor:
+        out += compressor.flush()
+    if out:
+        yield out
+    print(f"[Export] {','.join(logs)} {start_date}~{end_date} {fmt}，{count} 列")
+
+# ===== 長期歷史 =====
+# metric: (資料來源, 欄位, 彙總方式)
+HISTORY_METRICS = {
+    'water': ('activity', 'water', 'sum'),
+    'stand': ('activity', 'stand', 'sum'),
+    'exercise': ('activity', 'exercise_minutes', 'sum'),
+    'calories': ('activity', 'exercise_calories', 'sum'),
+    'intake': ('meal', 'calories', 'sum'),
+    'weight': ('weight', 'weight', 'mean'),
+    'sleep': ('sleep', 'hours', 'mean'),
+    'sleep_quality': ('sleep', 'quality', 'mean'),
+    'mood': ('mood', 'score', 'mean'),
+}
+MAX_HISTORY_POINTS = 400
+
+def _read_series_source(source):
+    """讀取整段歷史為欄位式資料 {'dates': [...], 欄位: [...]}"""
+    if source == 'activity':
+        totals = read_daily_totals('0000-01-01', get_today())
+        dates = sorted(totals)
+        return {'dates': dates, **{k: [totals[d][k] for d in dates]
+                for k in ('water', 'stand', 'exercise_minutes', 'exercise_calories')}}
+    if source == 'weight':
+        rows = read_weight_history(None)
+        return {'dates': [r['date'] for r in rows], 'weight': [r['weight'] for r in rows]}
+    if source == 'sleep':
+        rows = read_sleep_history(None)
+        return {'dates': [r['date'] for r in rows], 'hours': [r['hours'] for r in rows], 'quality': [r['quality'] for r in rows]}
+    if source == 'mood':
+        rows = read_mood_history(None)
+        return {'dates': [r['time'][:10] for r in rows], 'score': [r['score'] for r in rows]}
+    if source == 'meal':
+        try:
+            cols = get_log_columns('meal_log')
+        except:
+            return {'dates': [], 'calories': []}
+        rows = cols.span(*logstore.day_bounds('0000-01-01', get_today()))
+        return {'dates': [logstore.day_text(cols.ts[i] // logstore.DAY) for i in rows],
+                'calories': cols.values('calories', rows)}
+    raise ValueError(f'unknown source: {source}')
+
+def read_history(metric, start, end, bucket='day'):
+    """取得任意區間的分桶序列（欄位式：t / v / n 平行陣列）"""
+    source, field, how = HISTORY_METRICS[metric]
+    series = get_cached(f'series:{source}', lambda: _read_series_source(source))
+
+    bucket = analytics.coarsen_bucket(start, end, bucket, MAX_HISTORY_POINTS)
+    days = analytics.to_days(series['dates'])
+    values = analytics.np.asarray(series[field], dtype=float)
+    mask = (days >= analytics.np.datetime64(start)) & (days <= analytics.np.datetime64(end))
+    keys, v, n = analytics.bucket_series(days[mask], values[mask], bucket, how)
+
+    return {
+        'metric': metric, 'bucket': bucket, 'agg': how, 'from': start, 'to': end,
+        't': [str(k) for k in keys[-MAX_HISTORY_POINTS:]],
+        'v': [round(float(x), 2) for x in v[-MAX_HISTORY_POINTS:]],
+        'n': [int(x) for x in n[-MAX_HISTORY_POINTS:]],
+    }
+
+# ===== 關聯分析 =====
+# 各指標對齊到同一條每日索引後用 NumPy 算相關係數、滾動相關與星期分布；結果依資料版本快取，
+# 沒有新寫入時重複查詢只是查表。睡眠紀錄的日期是起床那天，所以「運動 → 當晚睡眠」是 lag 1
+CORRELATION_PAIRS = (
+    ('sleep', 'mood', 0, '睡眠時數 → 當天心情'),
+    ('sleep', 'mood', 1, '睡眠時數 → 隔天心情'),
+    ('sleep_quality', 'mood', 0, '睡眠品質 → 當天心情'),
+    ('exercise', 'sleep_quality', 1, '運動 → 當晚睡眠品質'),
+    ('exercise', 'sleep', 1, '運動 → 當晚睡眠時數'),
+    ('exercise', 'mood', 0, '運動 → 當天心情'),
+    ('water', 'mood', 0, '喝水 → 當天心情'),
+)
+WEEKDAY_METRICS = ('mood', 'sleep', 'exercise', 'water')
+CORRELATION_DAYS = 365     # 預設分析最近一年
+CORRELATION_WINDOW = 30    # 滾動相關的視窗（天）
+CORRELATION_POINTS = 180   # 滾動相關最多回傳最近 180 天
+CORRELATION_MAX_AGE = 3600 # 資料版本沒變也最多沿用 1 小時（防止有人直接改試算表）
+_correlations = {}
+_correlations_lock = new_lock()
+
+def metric_grid(metric, start, end):
+    """某指標在 start..end 的每日數值（沿用 /api/history 的整段歷史快取）"""
+    source, field, how = HISTORY_METRICS[metric]
+    series = get_cached(f'series:{source}', lambda: _read_series_source(source))
+    return analytics.daily_grid(analytics.to_days(series['dates']), series[field], start, end, how)
+
+def _round_or_none(v, digits=3):
+    return None if v is None or v != v else round(float(v), digits)
+
+def compute_correlations(start, end):
+    grids = {}
+    for m in sorted({m for p in CORRELATION_PAIRS for m in p[:2]} | set(WEEKDAY_METRICS)):
+        index, grids[m] = metric_grid(m, start, end)
+
+    pairs = []
+    for x, y, lag, label in CORRELATION_PAIRS:
+        a, b = analytics.shift_pair(grids[x], grids[y], lag)
+        r, n = analytics.pearson(a, b)
+        rolling = analytics.rolling_corr(a, b, CORRELATION_WINDOW)[-CORRELATION_POINTS:]
+        pairs.append({
+            'x': x, 'y': y, 'lag': lag, 'label': label, 'r': _round_or_none(r), 'n': n,
+            'strength': analytics.strength(r),
+            'rolling': {'t': [str(d) for d in index[:a.size][-CORRELATION_POINTS:]], 'r': [_round_or_none(v) for v in rolling]},
+        })
+    weekday = {m: [_round_or_none(v, 2) for v in analytics.weekday_profile(index, grids[m])] for m in WEEKDAY_METRICS}
+    return {'from': start, 'to': end, 'days': int(index.size), 'window': CORRELATION_WINDOW, 'pairs': pairs, 'weekday': weekday}
+
+def get_correlations(start=None, end=None):
+    """關聯分析結果；同一資料版本與區間只算一次"""
+    end = end or get_today()
+    start = start or (datetime.strptime(end, '%Y-%m-%d') - timedelta(days=CORRELATION_DAYS - 1)).strftime('%Y-%m-%d')
+    version, key = _data_version, (start, end)
+    with _correlations_lock:
+        cached = _correlations.get(key)
+        if cached and cached['version'] == version and time.time() - cached['built'] < CORRELATION_MAX_AGE:
+            return cached['result']
+    result = compute_correlations(start, end)
+    with _correlations_lock:
+        for k in [k for k, v in _correlations.items() if v['version'] != version]:
+            del _correlations[k]
+        _correlations[key] = {'version': version, 'built': time.time(), 'result': result}
+    return result
+
+def correlation_text(result):
+    """關聯分析的文字摘要（依相關強度排序）"""
+    found = sorted((p for p in result['pairs'] if p['r'] is not None), key=lambda p: -abs(p['r']))
+    if not found:
+        return f"🔗 關聯分析\n\n資料還不夠，每組指標至少要有 {analytics.CORR_MIN_PAIRS} 天同時有紀錄\n持續記錄睡眠、心情、運動與喝水就能看到結果！"
+    lines = [f"• {p['label']}：r={p['r']:+.2f}（{p['strength']}，{p['n']} 天）" for p in found[:5]]
+    text = f"🔗 關聯分析（{result['from']} ~ {result['to']}）\n\n" + '\n'.join(lines)
+    mood = [(v, i) for i, v in enumerate(result['weekday']['mood']) if v is not None]
+    if mood:
+        best, worst = max(mood), min(mood)
+        text += f"\n\n📅 心情最好是週{analytics.WEEKDAYS[best[1]]}（{best[0]:.1f}），最低是週{analytics.WEEKDAYS[worst[1]]}（{worst[0]:.1f}）"
+    return text + "\n\n💡 r 介於 -1 到 1，越接近 ±1 關聯越強；相關不代表因果"
+
+# ===== 本機洞察 =====
+# 從給 AI 的同一份數據摘要字串解析數字，和目標比對後套規則與模板產生繁體中文回饋；
+# 純字串運算、結果固定，幾毫秒內完成，跟著第一則回覆送出，AI 分析之後才當作加碼推送
+INSIGHT_FIELDS = {
+    'water': r'喝水(\d+)杯', 'stand': r'起身(\d+)次', 'exercise': r'運動(\d+)分鐘',
+    'calories': r'消耗(\d+)卡', 'streak': r'連續達標(\d+)天', 'days_ok': r'(?<!連續)達標(\d+)天',
+}
+INSIGHT_METRICS = (('water', '喝水', '杯', '💧'), ('stand', '起身', '次', '🧍'), ('exercise', '運動', '分鐘', '🏃'))
+INSIGHT_TIPS = {
+    'water': '把水杯放在視線範圍內，每次起身順手喝幾口',
+    'stand': '設定每小時起來走動 3 分鐘，伸展肩頸與下背',
+    'exercise': '先從飯後快走 15 分鐘開始，比一次練很久更容易持續',
+}
+
+def parse_summary(summary):
+    """數據摘要字串 → {欄位: 數字}，沒出現的欄位不放"""
+    out = {}
+    for k, pattern in INSIGHT_FIELDS.items():
+        m = re.search(pattern, summary or '')
+        if m:
+            out[k] = int(m.group(1))
+    return out
+
+def local_insight(kind, summary, goals):
+    """依規則產生洞察文字（kind 為 daily / weekly）；週報以每日平均和目標比較"""
+    v = parse_summary(summary)
+    days = 7 if kind == 'weekly' else 1
+    ratios = {k: v.get(k, 0) / days / max(goals.get(k) or 1, 1) for k, *_ in INSIGHT_METRICS}
+    met = [k for k in ratios if ratios[k] >= 1]
+    label = '本週' if kind == 'weekly' else '今天'
+
+    if len(met) == len(ratios):
+        lines = [f"🎉 {label}三項目標全部達成，表現滿分！"]
+    elif met:
+        lines = [f"👍 {label}達成 {len(met)}/3 項目標，再補一點就全滿了"]
+    else:
+        lines = [f"🌱 {label}還沒有項目達標，從最容易的一項開始吧"]
+
+    for k, name, unit, emoji in INSIGHT_METRICS:
+        value, goal, r = v.get(k, 0), goals.get(k) or 0, ratios[k]
+        if kind == 'weekly':
+            avg = v.get(k, 0) / days
+            lines.append(f"{emoji} {name}每日平均 {avg:.1f}{unit}（目標 {goal}{unit}，{min(r, 9.99):.0%}）")
+        elif r >= 1:
+            lines.append(f"{emoji} {name} {value}{unit}，已達標" + ("，超出不少！" if r >= 1.5 else ""))
+        else:
+            lines.append(f"{emoji} {name} {value}{unit}，還差 {max(goal - value, 0)}{unit}")
+
+    if kind == 'weekly' and 'days_ok' in v:
+        lines.append(f"📅 本週有 {v['days_ok']} 天三項全達標" + ("，非常穩定！" if v['days_ok'] >= 5 else ""))
+    streak = v.get('streak', 0)
+    if streak >= 7:
+        lines.append(f"🔥 已連續達標 {streak} 天，習慣已經養成了！")
+    elif streak >= 2:
+        lines.append(f"🔥 已連續達標 {streak} 天，再撐幾天就滿一週")
+    if kind == 'daily' and v.get('calories', 0) >= 300:
+        lines.append(f"⚡ 運動消耗約 {v['calories']} 卡，記得補充水分與蛋白質")
+
+    weakest = min(ratios, key=ratios.get)
+    if ratios[weakest] < 1:
+        lines.append(f"\n💡 {'下週' if kind == 'weekly' else '明天'}建議：{INSIGHT_TIPS[weakest]}")
+    else:
+        lines.append(f"\n💡 維持目前的節奏，{'下週' if kind == 'weekly' else '明天'}繼續保持！")
+    return '\n'.join(lines)
+
+def flex_insight(title, text):
+    """本機洞察 Flex（樣式與 AI 分析輪播一致）"""
+    return {"type": "bubble", "size": "mega", "styles": {"body": {"backgroundColor": COLORS['bg_light']}},
+        "body": {"type": "box", "layout": "vertical", "contents": [
+            {"type": "box", "layout": "horizontal", "contents": [
+                {"type": "text", "text": "📊", "size": "xl", "flex": 0},
+                {"type": "text", "text": title, "size": "lg", "weight": "bold", "color": COLORS['cyan'], "margin": "sm"}]},
+            {"type": "separator", "margin": "md", "color": COLORS['cyan']},
+            {"type": "text", "text": text, "size": "sm", "color": COLORS['white'], "margin": "lg", "wrap": True}]}}
+
 # ===== AI 分析 =====
 def get_gemini(action, count, extra=""):
     if not GEMINI_API_KEY:
@@ -954,7 +2495,7 @@ def send_ai_analysis_async(user_id, action, count, extra=""):
             
             af = flex_ai(gemini, openai)
             if af and user_id:
-                with ApiClient(configuration) as api:
+                with ApiClient(line_configuration()) as api:
                     MessagingApi(api).push_message(PushMessageRequest(
                         to=user_id,
                         messages=[FlexMessage(alt_text='🤖 AI 分析', contents=FlexContainer.from_dict(af))]
@@ -963,8 +2504,310 @@ def send_ai_analysis_async(user_id, action, count, extra=""):
         except Exception as e:
             print(f"[AI] Error: {e}")
     
-    thread = threading.Thread(target=task)
-    thread.start()
+    spawn_background(task, daemon=False)
+
+# ===== 報表推播 =====
+# 報表內容每個收件人都一樣，只算一次，再依 multicast 上限分批（每批最多 500 人），
+# 每送完一批就把進度寫進 job 檔；當機重啟後從沒送的那批接著送，
+# 每批固定一個 X-Line-Retry-Key 且送出前已存檔，就算送出後才當機，LINE 也不會重複發送；
+# 接手過期 job 前要先搶到認領檔，多個 worker 同時發現也只有一個會接手
+REPORT_RECIPIENTS = [u.strip() for u in os.environ.get('REPORT_RECIPIENTS', LINE_USER_ID or '').split(',') if u.strip()]
+REPORT_JOBS_DIR = os.environ.get('REPORT_JOBS_DIR', 'data/jobs')
+REPORT_STALE_SECONDS = 120  # 執行中的 job 超過這麼久沒更新，視為 worker 已掛掉
+LINE_MULTICAST_LIMIT = 500
+LINE_PUSH_PER_SEC = float(os.environ.get('LINE_PUSH_PER_SEC', 100))  # LINE multicast 上限 200 次/秒，留一半
+LINE_MAX_RETRIES = 5
+_line_bucket = TokenBucket(LINE_PUSH_PER_SEC * 60)
+_line_bucket_lock = new_lock()
+
+def _ai_key(action, extra):
+    return f"ai:{action}:{hashlib.sha1(extra.encode('utf-8')).hexdigest()[:12]}"
+
+def peek_ai_pair(action, extra):
+    """不呼叫 API，只看 AI_MEMO_TTL 內是否已有同一份摘要的結果"""
+    memo = _ai_memo.get(_ai_key(action, extra))
+    return memo[1] if memo and time.time() - memo[0] < AI_MEMO_TTL else None
+
+def get_ai_pair(action, extra):
+    """Gemini 與 OpenAI 同時呼叫；同樣的數據摘要在 AI_MEMO_TTL 內只呼叫一次"""
+    key = _ai_key(action, extra)
+    with _inflight_lock:
+        key_lock = _inflight.setdefault(key, threading.Lock())
+    with key_lock:
+        memo = _ai_memo.get(key)
+        if memo and time.time() - memo[0] < AI_MEMO_TTL:
+            return memo[1]
+        with ThreadPoolExecutor(2) as pool:
+            gemini = pool.submit(get_gemini, action, 0, extra)
+            openai = pool.submit(get_openai, action, 0, extra)
+            pair = (gemini.result(), openai.result())
+        if any(pair):
+            _ai_memo[key] = (time.time(), pair)
+        return pair
+
+# ===== 報表預先計算 =====
+# 白天有寫入就把報表標成過期，REPORT_REFRESH_DELAY 秒後在背景重算底稿（統計 + Flex）；
+# 排程前呼叫 /api/daily-report/prepare 先把 AI 分析也算好，推播時只剩送出
+REPORT_REFRESH_DELAY = 300
+REPORT_PREPARED_MAX_AGE = 900  # 底稿最多沿用 15 分鐘（防止有人直接改試算表）
+REPORT_AUTO_REFRESH = ('daily',)
+AI_MEMO_TTL = 3 * 3600
+_ai_memo = {}
+_prepared_reports = {}
+_data_version = 0
+_refresh_pending = False
+
+def mark_reports_dirty():
+    global _data_version, _refresh_pending
+    _data_version += 1
+    if not _refresh_pending:
+        _refresh_pending = True
+        spawn_background(_refresh_reports_later)
+
+def _refresh_reports_later():
+    global _refresh_pending
+    time.sleep(REPORT_REFRESH_DELAY)
+    _refresh_pending = False
+    for kind in REPORT_AUTO_REFRESH:
+        try:
+            get_report_base(kind)
+        except Exception as e:
+            print(f"[Report] 預先計算 {kind} 失敗: {e}")
+
+def build_daily_base():
+    """每日總結底稿：(給 AI 的數據摘要, 訊息)；訊息以 dict 表示，才能寫進 job 檔"""
+    d = prefetch(('today', 'streak'))
+    stats, streak = d['today'], d['streak']
+    summary = f"喝水{stats['water_count']}杯、起身{stats['stand_count']}次、運動{stats['exercise_minutes']}分鐘、消耗{stats['exercise_calories']}卡、連續達標{streak}天"
+    if stats.get('exercise_details'):
+        summary += f"，項目：{', '.join(stats['exercise_details'])}"
+    return summary, [{'alt_text': '🌙每日總結', 'contents': flex_daily_report(stats)}]
+
+def build_weekly_base():
+    """週報底稿"""
+    d = prefetch(('week_summary', 'streak', 'goals'))
+    summary, streak = d['week_summary'], d['streak']
+    summary_text = f"本週喝水{summary['total_water']}杯、起身{summary['total_stand']}次、運動{summary['total_exercise']}分鐘、消耗{summary['total_calories']}卡、達標{summary['days_all_ok']}天、連續達標{streak}天"
+    return summary_text, [{'alt_text': '📅 週報', 'contents': flex_week_report(summary, d['goals'])}]
+
+REPORT_BASES = {'daily': (build_daily_base, 'AI每日分析', '今日洞察'), 'weekly': (build_weekly_base, 'AI週報分析', '本週洞察')}
+
+def _fresh_report_base(kind):
+    prepared = _prepared_reports.get(kind)
+    if prepared and prepared['version'] == _data_version and time.time() - prepared['built'] < REPORT_PREPARED_MAX_AGE:
+        return prepared['summary'], prepared['msgs']
+    return None
+
+def get_report_base(kind):
+    """取得報表底稿；資料沒變動且還不舊就沿用預先算好的（同一種報表同時只算一次）"""
+    base = _fresh_report_base(kind)
+    if base:
+        return base
+    with _inflight_lock:
+        key_lock = _inflight.setdefault(f'report:{kind}', threading.Lock())
+    with key_lock:
+        base = _fresh_report_base(kind)
+        if base:
+            return base
+        version = _data_version
+        summary, msgs = REPORT_BASES[kind][0]()
+        _prepared_reports[kind] = {'version': version, 'built': time.time(), 'summary': summary, 'msgs': msgs}
+        return summary, msgs
+
+def insight_message(kind, summary):
+    """本機洞察訊息（dict 形式）"""
+    title = REPORT_BASES[kind][2]
+    return {'alt_text': f'📊 {title}', 'contents': flex_insight(title, local_insight(kind, summary, get_goals()))}
+
+def ai_message(kind, pair):
+    """AI 分析輪播訊息；兩家都沒有結果時回傳 None"""
+    af = flex_ai(*pair) if pair else None
+    return {'alt_text': REPORT_BASES[kind][1], 'contents': af} if af else None
+
+def build_report(kind):
+    """完整報表訊息：底稿 + 本機洞察，AI 分析已預先算好才一起帶上（不等 API）"""
+    summary, msgs = get_report_base(kind)
+    msgs = list(msgs) + [insight_message(kind, summary)]
+    ai = ai_message(kind, peek_ai_pair(kind, summary))
+    if ai:
+        msgs.append(ai)
+    return msgs
+
+def build_ai_upgrade(kind):
+    """報表送出後在背景補算 AI 分析，回傳要追加推送的訊息（或 None）"""
+    summary, _ = get_report_base(kind)
+    return ai_message(kind, get_ai_pair(kind, summary))
+
+def push_ai_upgrade(user_id, kind, summary):
+    """背景呼叫 AI，算得出來才推送輪播；失敗就只留本機洞察"""
+    def task():
+        try:
+            ai = ai_message(kind, get_ai_pair(kind, summary))
+            if ai and user_id:
+                with ApiClient(line_configuration()) as api:
+                    MessagingApi(api).push_message(PushMessageRequest(
+                        to=user_id, messages=[FlexMessage(alt_text=ai['alt_text'], contents=FlexContainer.from_dict(ai['contents']))]))
+                print(f"[AI] ✅ {kind} 分析已推送")
+        except Exception as e:
+            print(f"[AI] {kind} 分析推送失敗: {e}")
+    spawn_background(task, daemon=False)
+
+def prepare_report(kind):
+    """排程前先跑一次：底稿與 AI 分析都放進快取"""
+    start = time.perf_counter()
+    summary, _ = get_report_base(kind)
+    get_ai_pair(kind, summary)
+    print(f"[Report] {kind} 預先計算完成，{(time.perf_counter() - start) * 1000:.0f}ms")
+
+def _job_path(job_id):
+    return os.path.join(REPORT_JOBS_DIR, f'{job_id}.json')
+
+def save_report_job(job):
+    """寫入 job 檔（先寫暫存檔再換名，當機時不會留下寫一半的檔案）"""
+    job['updated'] = time.time()
+    os.makedirs(REPORT_JOBS_DIR, exist_ok=True)
+    tmp = _job_path(job['id']) + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(job, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, _job_path(job['id']))
+
+def load_report_job(job_id):
+    if not re.fullmatch(r'[0-9a-f]{12}', job_id or ''):
+        return None
+    try:
+        with open(_job_path(job_id), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def create_report_job(kind, recipients=None):
+    """建立推播工作並在背景執行"""
+    resume_report_jobs()
+    job = {'id': uuid.uuid4().hex[:12], 'kind': kind, 'status': 'queued', 'created': get_now(),
+           'recipients': list(recipients if recipients is not None else REPORT_RECIPIENTS),
+           'payloads': {}, 'batches': [], 'sent': 0, 'ai': None, 'error': None}
+    save_report_job(job)
+    spawn_background(run_report_job, job['id'], daemon=False)
+    return job
+
+def run_report_job(job_id):
+    job = load_report_job(job_id)
+    if not job or job['status'] == 'done':
+        return
+    job['status'] = 'running'
+    save_report_job(job)
+    try:
+        if not job['batches']:
+            msgs = build_report(job['kind'])
+            key = hashlib.sha1(json.dumps(msgs, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()[:12]
+            job['payloads'][key] = msgs
+            job['batches'] = _report_batches({key: job['recipients']})
+            job['ai'] = 'included' if msgs[-1]['alt_text'] == REPORT_BASES[job['kind']][1] else 'pending'
+            save_report_job(job)  # 檢查點：訊息內容、分批與 retry key 存檔後才開始送
+
+        _send_report_batches(job)
+        if job.get('ai') == 'pending':
+            # 報表已送達，AI 分析沒預先算好就在這裡補算，算得出來再追加一則輪播
+            ai = build_ai_upgrade(job['kind'])
+            if ai:
+                job['payloads']['ai'] = [ai]
+                job['batches'] += _report_batches({'ai': job['recipients']})
+            job['ai'] = 'upgraded' if ai else 'unavailable'
+            save_report_job(job)
+            _send_report_batches(job)
+        job['status'] = 'done'
+    except Exception as e:
+        print(f"[Report] job {job_id} 失敗: {e}")
+        job['status'] = 'failed'
+        job['error'] = str(e)
+    job['finished'] = get_now()
+    save_report_job(job)
+    drop_report_claims(job_id)
+    print(f"[Report] job {job_id} {job['status']}，已送 {job['sent']}/{len(job['recipients'])} 人")
+
+def _report_batches(groups):
+    """{payload key: 收件人} → 每批最多 LINE_MULTICAST_LIMIT 人的分批，各帶固定的 retry key"""
+    return [{'payload': key, 'to': to[i:i + LINE_MULTICAST_LIMIT], 'retry_key': str(uuid.uuid4()), 'sent': False}
+            for key, to in groups.items() for i in range(0, len(to), LINE_MULTICAST_LIMIT)]
+
+def _send_report_batches(job):
+    """送出還沒送的批次，每批送完就存檔；追加的 AI 輪播不重複計入已送人數"""
+    for batch in job['batches']:
+        if batch['sent']:
+            continue
+        send_multicast(batch['to'], job['payloads'][batch['payload']], batch['retry_key'])
+        batch['sent'] = True
+        if batch['payload'] != 'ai':
+            job['sent'] += len(batch['to'])
+        save_report_job(job)
+
+def _take_line_token():
+    while True:
+        with _line_bucket_lock:
+            if _line_bucket.try_take(time.monotonic()):
+                return
+            wait = _line_bucket.wait_time()
+        time.sleep(wait)
+
+def send_multicast(to, msgs, retry_key):
+    """送一批 multicast；429/5xx 退避重試，409 代表同一個 retry key 已經送過"""
+    messages = [FlexMessage(alt_text=m['alt_text'], contents=FlexContainer.from_dict(m['contents'])) for m in msgs]
+    for attempt in range(LINE_MAX_RETRIES):
+        _take_line_token()
+        try:
+            with ApiClient(line_configuration()) as api:
+                MessagingApi(api).multicast(MulticastRequest(to=to, messages=messages), x_line_retry_key=retry_key)
+            return
+        except Exception as e:
+            status = getattr(e, 'status', None)
+            if status == 409:
+                return
+            if not (status == 429 or (status or 0) >= 500) or attempt == LINE_MAX_RETRIES - 1:
+                raise
+            time.sleep(2 ** attempt + random.random())
+
+def claim_report_job(job):
+    """以 job 最後更新時間命名認領檔並用 O_EXCL 建立：看到同一個過期狀態的 worker 只有一個會成功"""
+    path = os.path.join(REPORT_JOBS_DIR, f"{job['id']}.{job.get('updated', 0):.6f}.claim")
+    try:
+        os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return True
+    except FileExistsError:
+        return False
+
+def drop_report_claims(job_id):
+    """job 結束後清掉它的認領檔"""
+    try:
+        names = os.listdir(REPORT_JOBS_DIR)
+    except OSError:
+        return
+    for name in names:
+        if name.startswith(f'{job_id}.') and name.endswith('.claim'):
+            try:
+                os.remove(os.path.join(REPORT_JOBS_DIR, name))
+            except OSError:
+                pass
+
+def resume_report_jobs():
+    """接手上次沒跑完（worker 當掉或重啟）的推播工作"""
+    try:
+        names = os.listdir(REPORT_JOBS_DIR)
+    except OSError:
+        return 0
+    resumed = 0
+    for name in names:
+        job = load_report_job(name[:-5]) if name.endswith('.json') else None
+        if job and job['status'] in ('queued', 'running') and time.time() - job.get('updated', 0) > REPORT_STALE_SECONDS:
+            if not claim_report_job(job):
+                continue  # 其他 worker 已經接手
+            save_report_job(job)  # 更新時間，之後再看到的 worker 不會把它當成過期
+            spawn_background(run_report_job, job['id'], daemon=False)
+            resumed += 1
+    if resumed:
+        print(f"[Report] 接手 {resumed} 個未完成的推播工作")
+    return resumed
 
 # ===== Quick Reply =====
 def qr(items):
@@ -981,6 +2824,162 @@ QR_STATS = [{'label': '📊 今日', 'text': '今日統計'}, {'label': '📅 
 QR_WEIGHT = [{'label': '⚖️ 記錄體重', 'text': '記錄體重'}, {'label': '📊 體重紀錄', 'text': '體重紀錄'}, {'label': '↩️ 返回', 'text': '選單'}]
 QR_EYE = [{'label': '👁️ 已護眼', 'text': '護眼完成'}, {'label': '📊 護眼統計', 'text': '護眼統計'}, {'label': '📊 今日統計', 'text': '今日統計'}]
 
+# ===== 資料預取 =====
+# 每個指令先宣告需要哪些資料（COMMAND_DEPS），在有上限的執行緒池同時載入，
+# 再交給不碰 Sheets 的 flex_* 純函式產生訊息；回覆延遲是最慢的來源，而不是全部相加
+PREFETCH_WORKERS = 4
+
+DATA_SOURCES = {
+    'today': lambda: get_cached('today', read_today_stats),
+    'goals': get_goals,
+    'eye': get_eye_stats,
+    'streak': lambda: get_cached('streak', calculate_streak),
+    'week_summary': lambda: get_cached('week_summary', read_week_summary),
+    'weight_stats': lambda: get_cached('weight_stats', get_weight_stats),
+    'settings': read_settings,
+    'achievements': lambda: get_cached('achievements', get_achievements),
+}
+
+COMMAND_DEPS = {
+    '今日統計': ('today', 'goals', 'eye'),
+    '週報': ('week_summary', 'goals'),
+    '本週統計': ('week_summary', 'goals'),
+    '連續達標': ('streak',),
+    '體重紀錄': ('weight_stats',),
+    '體重記錄': ('weight_stats',),
+    '設定': ('settings',),
+    '成就': ('achievements',),
+    '徽章': ('achievements',),
+}
+
+_prefetch_pool = None
+
+def get_prefetch_pool():
+    global _prefetch_pool
+    if _prefetch_pool is None:
+        _prefetch_pool = ThreadPoolExecutor(PREFETCH_WORKERS, thread_name_prefix='prefetch')
+    return _prefetch_pool
+
+def prefetch(names):
+    """同時載入多個資料來源，回傳 {名稱: 資料}；沿用目前請求的 Sheets 優先順序，任一來源離線也會標記"""
+    names = list(dict.fromkeys(names))
+    if len(names) <= 1:
+        return {n: DATA_SOURCES[n]() for n in names}
+    contexts = {n: contextvars.copy_context() for n in names}
+    futures = {n: get_prefetch_pool().submit(contexts[n].run, DATA_SOURCES[n]) for n in names}
+    data = {n: f.result() for n, f in futures.items()}
+    if any(ctx.get(_offline) for ctx in contexts.values()):
+        mark_offline()
+    return data
+
+# ===== 回覆延遲預算 =====
+# 較重的指令在預算內算不完時，先用最近一次快取或快照的結果回覆並標示資料時間，
+# 背景算完後結果有變才 push 最新版；命中與否依指令統計，可在 /health 查看
+COMMAND_BUDGETS = {'週報': 1.5, '本週統計': 1.5, '連續達標': 1.0, '成就': 1.5, '徽章': 1.5}
+
+# 來源對應的快取 key（查得到舊資料）；MEMORY_SOURCES 本來就在記憶體，直接讀
+SOURCE_CACHE_KEYS = {'today': 'today', 'streak': 'streak', 'week_summary': 'week_summary',
+                     'weight_stats': 'weight_stats', 'achievements': 'achievements'}
+MEMORY_SOURCES = ('goals', 'settings')
+
+budget_stats = {}
+_budget_lock = new_lock()
+
+def record_budget(command, outcome):
+    """outcome：hit（預算內算完）、stale（先回舊資料）、cold（沒有舊資料只好等）、pushed（事後推送新版）"""
+    with _budget_lock:
+        counts = budget_stats.setdefault(command, {'hit': 0, 'stale': 0, 'cold': 0, 'pushed': 0})
+        counts[outcome] += 1
+
+def peek_cached(key):
+    """不管是否過期，取最近一次的資料與時間（記憶體快取優先，其次快照）"""
+    if key in _data_cache:
+        return _data_cache[key], _cache_time.get(key, 0)
+    snap = load_snapshot().get(key)
+    if snap is not None:
+        return snap['data'], snap['time']
+    return None, None
+
+def stale_view(names):
+    """各來源最近一次的資料與其中最舊的時間；有來源從沒算過就回傳 (None, None)"""
+    data, oldest = {}, time.time()
+    for n in names:
+        if n in MEMORY_SOURCES:
+            data[n] = DATA_SOURCES[n]()
+            continue
+        value, at = peek_cached(SOURCE_CACHE_KEYS.get(n, ''))
+        if value is None:
+            return None, None
+        data[n], oldest = value, min(oldest, at)
+    return data, oldest
+
+def reply_within_budget(command, user_id, render):
+    """在 COMMAND_BUDGETS 內回傳最新結果，逾時改回最近一次的結果並在背景補推"""
+    names = COMMAND_DEPS[command]
+    done, ctx = Future(), contextvars.copy_context()
+
+    def compute():
+        try:
+            done.set_result(ctx.run(prefetch, names))
+        except Exception as e:
+            done.set_exception(e)
+
+    spawn_background(compute)
+    try:
+        data = done.result(timeout=COMMAND_BUDGETS[command])
+        record_budget(command, 'hit')
+        if ctx.get(_offline):
+            mark_offline()
+        return render(data)
+    except FutureTimeout:
+        pass
+
+    stale, at = stale_view(names)
+    if stale is None:
+        record_budget(command, 'cold')
+        data = done.result()
+        if ctx.get(_offline):
+            mark_offline()
+        return render(data)
+    record_budget(command, 'stale')
+    spawn_background(push_if_changed, command, user_id, render, stale, done, daemon=False)
+    age = max(int(time.time() - at) // 60, 0)
+    note = f"⏳ 以上是 {age} 分鐘前的資料，最新結果算好後若有變動會再推送" if age else "⏳ 以上是剛剛的資料，最新結果算好後若有變動會再推送"
+    return render(stale) + [TextMessage(text=note)]
+
+def push_if_changed(command, user_id, render, stale, done):
+    """等背景計算完成，結果與先前回覆的不同才推送"""
+    try:
+        fresh = done.result()
+    except Exception as e:
+        print(f"[Budget] {command} 背景計算失敗: {e}")
+        return
+    if json.dumps(fresh, sort_keys=True, default=str) == json.dumps(stale, sort_keys=True, default=str):
+        return
+    if not user_id:
+        return
+    try:
+        with ApiClient(line_configuration()) as api:
+            MessagingApi(api).push_message(PushMessageRequest(to=user_id, messages=render(fresh)))
+        record_budget(command, 'pushed')
+    except Exception as e:
+        print(f"[Budget] {command} 推送失敗: {e}")
+
+def render_week_report(d):
+    return [FlexMessage(alt_text='📅 週報', contents=FlexContainer.from_dict(flex_week_report(d['week_summary'], d['goals'])), quick_reply=qr(QR_STATS))]
+
+def render_streak(d):
+    streak = d['streak']
+    return [FlexMessage(alt_text=f'🔥 連續{streak}天', contents=FlexContainer.from_dict(flex_streak(streak)), quick_reply=qr(QR_STATS))]
+
+def render_achievements(d):
+    ach = d['achievements']
+    totals = f"📊 累計統計：\n💧 喝水 {ach['stats']['total_water']} 杯\n🧍 起身 {ach['stats']['total_stand']} 次\n🏃 運動 {ach['stats']['total_exercise']} 分鐘"
+    if ach['unlocked']:
+        badges = '\n'.join([f"{a['name']} - {a['desc']}" for a in ach['unlocked']])
+        return [TextMessage(text=f"🏆 已解鎖成就 ({ach['unlocked_count']}/{ach['total']})\n\n{badges}\n\n{totals}", quick_reply=qr(QR_MAIN))]
+    return [TextMessage(text=f"🏆 成就系統\n\n尚未解鎖任何成就\n繼續努力！\n\n{totals}", quick_reply=qr(QR_MAIN))]
+
 # ===== Flex Message =====
 def flex_water(c):
     p = min(c * 12.5, 100)
@@ -1056,18 +3055,13 @@ def flex_modify_exercise(stats):
             {"type": "separator", "margin": "lg", "color": "#333355"},
             {"type": "text", "text": "選擇：刪除最後 / 清空全部", "color": COLORS['gray'], "size": "xs", "margin": "md"}]}}
 
-def flex_stats(s, streak=0, goals=None):
-    if goals is None:
-        goals = get_goals()
-    
+def flex_stats(s, goals, eye_stats, streak=0):
     water_count = s.get('water_count', 0) or 0
     stand_count = s.get('stand_count', 0) or 0
     exercise_minutes = s.get('exercise_minutes', 0) or 0
     exercise_calories = s.get('exercise_calories', 0) or 0
     date_str = s.get('date', '今日') or '今日'
     
-    # 取得護眼統計
-    eye_stats = get_eye_stats()
     eye_completed = eye_stats.get('completed', 0)
     eye_ignored = eye_stats.get('ignored', 0)
     
@@ -1111,11 +3105,8 @@ def flex_stats(s, streak=0, goals=None):
                 {"type": "text", "text": "👁️ 護眼", "color": COLORS['purple']},
                 {"type": "text", "text": f"✅{eye_completed} ❌{eye_ignored}", "color": COLORS['white'], "align": "end"}]}]}}
 
-def flex_week_report(summary, goals=None):
+def flex_week_report(summary, goals):
     """週報 Flex"""
-    if goals is None:
-        goals = get_goals()
-    
     daily = summary.get('daily_stats', [])
     
     # 建立每日進度條
@@ -1232,6 +3223,18 @@ def flex_weight(stats):
     week_color = COLORS['red'] if stats.get('week_change') and stats['week_change'] > 0 else COLORS['green'] if stats.get('week_change') and stats['week_change'] < 0 else COLORS['gray']
     month_color = COLORS['red'] if stats.get('month_change') and stats['month_change'] > 0 else COLORS['green'] if stats.get('month_change') and stats['month_change'] < 0 else COLORS['gray']
     
+    # 趨勢與目標（7 天斜率優先，資料不足時用 30 天）
+    slope = stats.get('slope_7d') if stats.get('slope_7d') is not None else stats.get('slope_30d')
+    slope_text = f"{slope:+.2f} kg/週" if slope is not None else "-"
+    goal_rows = []
+    if stats.get('goal'):
+        eta = stats.get('goal_date')
+        eta_text = "已達標 🎉" if eta == 'reached' else f"預計 {eta}" if eta else "趨勢未朝目標"
+        goal_rows.append({"type": "box", "layout": "horizontal", "margin": "sm", "contents": [
+            {"type": "text", "text": f"🎯 目標 {stats['goal']} kg", "size": "sm", "color": COLORS['gold'], "flex": 2},
+            {"type": "text", "text": eta_text, "size": "sm", "color": COLORS['white'], "align": "end", "flex": 2}
+        ]})
+    
     return {"type": "bubble", "size": "kilo", "styles": {"body": {"backgroundColor": COLORS['bg']}},
         "body": {"type": "box", "layout": "vertical", "contents": [
             {"type": "text", "text": "⚖️ 體重紀錄", "weight": "bold", "size": "xl", "color": COLORS['blue']},
@@ -1255,24 +3258,34 @@ def flex_weight(stats):
                 ], "flex": 1}
             ]},
             {"type": "separator", "margin": "md", "color": "#333355"},
+            {"type": "box", "layout": "horizontal", "margin": "md", "contents": [
+                {"type": "text", "text": "📈 趨勢體重", "size": "sm", "color": COLORS['gray'], "flex": 2},
+                {"type": "text", "text": f"{stats.get('trend', stats['current'])} kg", "size": "sm", "weight": "bold", "color": COLORS['cyan'], "align": "end", "flex": 2}
+            ]},
+            {"type": "box", "layout": "horizontal", "margin": "sm", "contents": [
+                {"type": "text", "text": "📉 每週速度", "size": "sm", "color": COLORS['gray'], "flex": 2},
+                {"type": "text", "text": slope_text, "size": "sm", "color": COLORS['white'], "align": "end", "flex": 2}
+            ]},
+            *goal_rows,
             {"type": "text", "text": f"30天範圍：{stats['min']} ~ {stats['max']} kg", "size": "xs", "color": COLORS['gray'], "align": "center", "margin": "md"}
         ]}}
 
 def flex_weight_logged(weight, stats):
     """體重記錄成功 Flex"""
     change_text = ""
-    if stats and stats.get('records_count', 0) > 1:
+    if stats and stats.get('latest_outlier'):
+        change_text = "⚠️ 和近期差異很大，是否輸入錯誤？"
+    elif stats and stats.get('previous') is not None:
         # 和上一筆比較
-        history = read_weight_history(30)
-        if len(history) >= 2:
-            prev = history[-2]['weight']
-            diff = round(weight - prev, 1)
-            if diff > 0:
-                change_text = f"比上次 +{diff} kg"
-            elif diff < 0:
-                change_text = f"比上次 {diff} kg"
-            else:
-                change_text = "和上次相同"
+        diff = round(weight - stats['previous'], 1)
+        if diff > 0:
+            change_text = f"比上次 +{diff} kg"
+        elif diff < 0:
+            change_text = f"比上次 {diff} kg"
+        else:
+            change_text = "和上次相同"
+        if stats.get('trend') is not None:
+            change_text += f"｜趨勢 {stats['trend']} kg"
     
     return {"type": "bubble", "size": "kilo", "styles": {"body": {"backgroundColor": COLORS['bg']}},
         "body": {"type": "box", "layout": "vertical", "contents": [
@@ -1351,552 +3364,761 @@ def flex_ex_prompt():
             {"type": "text", "text": "請輸入：運動類型 分鐘數", "color": COLORS['gray'], "margin": "lg", "size": "sm"},
             {"type": "text", "text": "📝 範例：跑步 30、游泳 45", "color": COLORS['cyan'], "size": "sm", "margin": "md"}]}}
 
+# ===== 請求優先順序 =====
+BACKGROUND_PATHS = ('/api/daily-report', '/api/weekly-report', '/api/archive', '/api/export')
+
+@app.before_request
+def assign_sheets_priority():
+    """依路徑決定這個請求的 Sheets 配額優先順序"""
+    path = request.path
+    if path == '/callback':
+        set_sheets_priority(PRIORITY_INTERACTIVE)
+    elif path.startswith(BACKGROUND_PATHS):
+        set_sheets_priority(PRIORITY_BACKGROUND)
+    elif request.method == 'POST':
+        set_sheets_priority(PRIORITY_PWA_WRITE)
+    else:
+        set_sheets_priority(PRIORITY_DASHBOARD)
+
+@app.before_request
+def reset_offline_flag():
+    _offline.set(False)
+
+@app.after_request
+def add_offline_header(response):
+    """回應用到離線資料時加上標頭，讓前端顯示提示"""
+    if is_offline():
+        response.headers['X-Data-Offline'] = '1'
+    return response
+
+# ===== 請求准入控制 =====
+# /api/* 與 /callback 進來先過准入控制，避免單一失控的分頁或程式迴圈把 Sheets 配額用光：
+# 每個 client（簽章正確的 LINE webhook 算同一個，沒簽章的依來源 IP）各有 token bucket；較重的端點另有同時執行上限，
+# 滿了就排進有上限的等待佇列，佇列也滿或等太久就立刻回 429（附 Retry-After），不拖垮其他請求。
+# 限制以 worker 行程為單位，計數可在 /health 的 admission 查看。
+# 來源 IP 只採信 TRUSTED_PROXIES 層代理附加在 X-Forwarded-For 最右邊的值，client 自己帶的會被忽略
+ADMISSION_PER_MIN = int(os.environ.get('ADMISSION_PER_MIN', 120))           # 每個 client 每分鐘請求數
+ADMISSION_CALLBACK_PER_MIN = int(os.environ.get('ADMISSION_CALLBACK_PER_MIN', 600))
+ADMISSION_MAX_CLIENTS = 1000  # 記住最近這麼多個 client 的 bucket，較久沒來的丟掉
+EXPENSIVE_PATHS = ('/api/achievements', '/api/week', '/api/correlations', '/api/daily-report', '/api/weekly-report')
+EXPENSIVE_CONCURRENCY = int(os.environ.get('EXPENSIVE_CONCURRENCY', 4))
+EXPENSIVE_QUEUE = 8        # 等待佇列上限
+EXPENSIVE_WAIT = 2.0       # 排隊最多等幾秒
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 1))  # 前面有幾層反向代理（Railway 為 1）
+
+if TRUSTED_PROXIES:
+    from werkzeug.middleware.proxy_fix import ProxyFix
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+
+_admission_slot = contextvars.ContextVar('admission_slot', default=False)
+
+class ConcurrencyGate:
+    """同時執行上限 + 有上限的等待佇列；enter 回傳是否取得名額"""
+
+    def __init__(self, limit, queue, wait):
+        self.limit, self.queue, self.wait = limit, queue, wait
+        self.active = self.waiting = 0
+        self._cond = new_lock(threading.Condition)
+
+    def enter(self):
+        with self._cond:
+            if self.active < self.limit and not self.waiting:
+                self.active += 1
+                return 'admitted'
+            if self.waiting >= self.queue:
+                return 'queue_full'
+            self.waiting += 1
+            admission_stats['queued_peak'] = max(admission_stats['queued_peak'], self.waiting)
+            deadline = time.monotonic() + self.wait
+            try:
+                while self.active >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return 'wait_timeout'
+                    self._cond.wait(remaining)
+                self.active += 1
+                return 'admitted'
+            finally:
+                self.waiting -= 1
+
+    def leave(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+class ClientBuckets:
+    """每個 client 一個 TokenBucket，依最近使用順序保留 ADMISSION_MAX_CLIENTS 個"""
+
+    def __init__(self, max_clients):
+        self.max_clients = max_clients
+        self._buckets = {}
+        self._lock = new_lock()
+
+    def take(self, client, per_minute):
+        """取一個 token；不夠時回傳需要等待的秒數，夠就回傳 0"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.pop(client, None) or TokenBucket(per_minute)
+            self._buckets[client] = bucket
+            if len(self._buckets) > self.max_clients:
+                del self._buckets[next(iter(self._buckets))]
+            if bucket.try_take(now):
+                return 0
+            return bucket.wait_time()
+
+    def __len__(self):
+        return len(self._buckets)
+
+admission_stats = {'admitted': 0, 'rate_limited': 0, 'queue_full': 0, 'wait_timeout': 0, 'queued_peak': 0}
+_admission_lock = new_lock()
+client_buckets = ClientBuckets(ADMISSION_MAX_CLIENTS)
+expensive_gate = ConcurrencyGate(EXPENSIVE_CONCURRENCY, EXPENSIVE_QUEUE, EXPENSIVE_WAIT)
+
+def client_key():
+    """簽章正確的 LINE webhook 算同一個 client；其他（含沒簽章的 /callback）依來源 IP（ProxyFix 已換成最近一層代理看到的位址）"""
+    if request.path == '/callback' and callback_signed():
+        return 'line'
+    return request.remote_addr or 'unknown'
+
+def callback_signed():
+    """先驗 X-Line-Signature（只是一次 HMAC），偽造的請求不會用掉 LINE 共用的額度"""
+    sig = request.headers.get('X-Line-Signature', '')
+    return bool(sig) and get_handler().signature_validator.validate(request.get_data(as_text=True), sig)
+
+def count_admission(outcome):
+    with _admission_lock:
+        admission_stats[outcome] += 1
+
+def reject(reason, retry_after):
+    count_admission(reason)
+    resp = jsonify({'error': 'too many requests', 'reason': reason})
+    resp.headers['Retry-After'] = str(max(int(retry_after + 0.999), 1))
+    return resp, 429
+
+@app.before_request
+def admit_request():
+    """速率限制與重端點的同時執行上限；被拒絕時直接回 429，不會碰到 Sheets"""
+    path = request.path
+    if not (path.startswith('/api/') or path == '/callback'):
+        return None
+    client = client_key()
+    per_minute = ADMISSION_CALLBACK_PER_MIN if client == 'line' else ADMISSION_PER_MIN
+    wait = client_buckets.take(client, per_minute)
+    if wait:
+        return reject('rate_limited', wait)
+    if path.startswith(EXPENSIVE_PATHS):
+        outcome = expensive_gate.enter()
+        if outcome != 'admitted':
+            return reject(outcome, EXPENSIVE_WAIT)
+        _admission_slot.set(True)
+    count_admission('admitted')
+    return None
+
+@app.teardown_request
+def release_admission(exc=None):
+    if _admission_slot.get():
+        _admission_slot.set(False)
+        expensive_gate.leave()
+
+def admission_snapshot():
+    return {**admission_stats, 'clients': len(client_buckets),
+            'expensive': {'active': expensive_gate.active, 'waiting': expensive_gate.waiting, 'limit': expensive_gate.limit}}
+
 # ===== Webhook =====
+# 一次 webhook 可能帶多個事件（連按幾次已喝水、訊息加上後續訊息）：同一位使用者的事件照順序處理、
+# 共用一個 ApiClient，讀取來自記憶體中的投影與快取，前面事件的寫入後面的事件都看得到；
+# 寫入在整批處理完後合併送出（見批次寫入），確定寫進去才回覆
 @app.route('/callback', methods=['POST'])
 def callback():
     sig = request.headers.get('X-Line-Signature', '')
     body = request.get_data(as_text=True)
+    from linebot.v3.exceptions import InvalidSignatureError
+    from linebot.v3.webhooks import MessageEvent, TextMessageContent
     try:
-        handler.handle(body, sig)
+        payload = get_handler().parse(body, sig, as_payload=True)
     except InvalidSignatureError:
         abort(400)
+    items = [e for e in payload.events if isinstance(e, MessageEvent) and isinstance(e.message, TextMessageContent)]
+    if items:
+        handle_webhook_events(items)
     return 'OK'
 
-@handler.add(MessageEvent, message=TextMessageContent)
-def handle_message(event):
+def build_reply(event):
+    """一個文字訊息事件要回覆的訊息（不送出）；出錯時回「系統忙碌」"""
     text = event.message.text.strip()
     user_id = event.source.user_id
+    msgs = []
     
-    with ApiClient(configuration) as api:
-        bot = MessagingApi(api)
-        msgs = []
+    try:
+        # ===== 已喝水 =====
+        if text == '已喝水':
+            c = write_water()
+            msgs.append(FlexMessage(alt_text=f'💧 第{c}杯', contents=FlexContainer.from_dict(flex_water(c)), quick_reply=qr(QR_WATER)))
         
-        try:
-            # ===== 已喝水 =====
-            if text == '已喝水':
-                c = write_water()
-                msgs.append(FlexMessage(alt_text=f'💧 第{c}杯', contents=FlexContainer.from_dict(flex_water(c)), quick_reply=qr(QR_WATER)))
-            
-            # ===== 已起身 =====
-            elif text == '已起身':
-                c = write_stand()
-                msgs.append(FlexMessage(alt_text=f'🧍 第{c}次', contents=FlexContainer.from_dict(flex_stand(c)), quick_reply=qr(QR_STAND)))
-            
-            # ===== 記錄運動 =====
-            elif text == '記錄運動':
-                msgs.append(FlexMessage(alt_text='記錄運動', contents=FlexContainer.from_dict(flex_ex_prompt()), quick_reply=qr(QR_EX_TYPE)))
-            
-            # ===== 今日統計 =====
-            elif text == '今日統計':
-                stats = read_today_stats()
-                msgs.append(FlexMessage(alt_text='今日統計', contents=FlexContainer.from_dict(flex_stats(stats, 0)), quick_reply=qr(QR_STATS)))
-            
-            # ===== 週報 =====
-            elif text == '週報' or text == '本週統計':
-                summary = read_week_summary()
-                msgs.append(FlexMessage(alt_text='📅 週報', contents=FlexContainer.from_dict(flex_week_report(summary)), quick_reply=qr(QR_STATS)))
-            
-            # ===== 連續達標 =====
-            elif text == '連續達標':
-                streak = calculate_streak()
-                msgs.append(FlexMessage(alt_text=f'🔥 連續{streak}天', contents=FlexContainer.from_dict(flex_streak(streak)), quick_reply=qr(QR_STATS)))
-            
-            # ===== 體重紀錄 =====
-            elif text == '體重紀錄' or text == '體重記錄':
+        # ===== 已起身 =====
+        elif text == '已起身':
+            c = write_stand()
+            msgs.append(FlexMessage(alt_text=f'🧍 第{c}次', contents=FlexContainer.from_dict(flex_stand(c)), quick_reply=qr(QR_STAND)))
+        
+        # ===== 記錄運動 =====
+        elif text == '記錄運動':
+            msgs.append(FlexMessage(alt_text='記錄運動', contents=FlexContainer.from_dict(flex_ex_prompt()), quick_reply=qr(QR_EX_TYPE)))
+        
+        # ===== 今日統計 =====
+        elif text == '今日統計':
+            d = prefetch(COMMAND_DEPS[text])
+            msgs.append(FlexMessage(alt_text='今日統計', contents=FlexContainer.from_dict(flex_stats(d['today'], d['goals'], d['eye'])), quick_reply=qr(QR_STATS)))
+        
+        # ===== 週報 =====
+        elif text == '週報' or text == '本週統計':
+            msgs.extend(reply_within_budget(text, user_id, render_week_report))
+        
+        # ===== 連續達標 =====
+        elif text == '連續達標':
+            msgs.extend(reply_within_budget(text, user_id, render_streak))
+        
+        # ===== 體重紀錄 =====
+        elif text == '體重紀錄' or text == '體重記錄':
+            stats = prefetch(COMMAND_DEPS[text])['weight_stats']
+            msgs.append(FlexMessage(alt_text='⚖️ 體重紀錄', contents=FlexContainer.from_dict(flex_weight(stats)), quick_reply=qr(QR_WEIGHT)))
+        
+        # ===== 記錄體重提示 =====
+        elif text == '記錄體重':
+            msgs.append(TextMessage(text="請輸入體重數字\n例如：體重 65 或 體重 65.5", quick_reply=qr(QR_MAIN)))
+        
+        # ===== 體重 XX =====
+        elif text.startswith('體重'):
+            parts = text.split()
+            if len(parts) >= 2:
+                try:
+                    weight = float(parts[-1])
+                    if 20 <= weight <= 300:  # 合理範圍
+                        write_weight(weight)
+                        stats = get_weight_stats()
+                        msgs.append(FlexMessage(alt_text=f'⚖️ {weight}kg', contents=FlexContainer.from_dict(flex_weight_logged(weight, stats)), quick_reply=qr(QR_WEIGHT)))
+                    else:
+                        msgs.append(TextMessage(text="體重數值似乎不太對，請輸入合理範圍（20-300 kg）", quick_reply=qr(QR_MAIN)))
+                except ValueError:
+                    msgs.append(TextMessage(text="請輸入正確的數字\n例如：體重 65", quick_reply=qr(QR_MAIN)))
+            else:
                 stats = get_weight_stats()
                 msgs.append(FlexMessage(alt_text='⚖️ 體重紀錄', contents=FlexContainer.from_dict(flex_weight(stats)), quick_reply=qr(QR_WEIGHT)))
-            
-            # ===== 記錄體重提示 =====
-            elif text == '記錄體重':
-                msgs.append(TextMessage(text="請輸入體重數字\n例如：體重 65 或 體重 65.5", quick_reply=qr(QR_MAIN)))
-            
-            # ===== 體重 XX =====
-            elif text.startswith('體重'):
-                parts = text.split()
-                if len(parts) >= 2:
-                    try:
-                        weight = float(parts[-1])
-                        if 20 <= weight <= 300:  # 合理範圍
-                            write_weight(weight)
-                            stats = get_weight_stats()
-                            msgs.append(FlexMessage(alt_text=f'⚖️ {weight}kg', contents=FlexContainer.from_dict(flex_weight_logged(weight, stats)), quick_reply=qr(QR_WEIGHT)))
-                        else:
-                            msgs.append(TextMessage(text="體重數值似乎不太對，請輸入合理範圍（20-300 kg）", quick_reply=qr(QR_MAIN)))
-                    except ValueError:
-                        msgs.append(TextMessage(text="請輸入正確的數字\n例如：體重 65", quick_reply=qr(QR_MAIN)))
-                else:
-                    stats = get_weight_stats()
-                    msgs.append(FlexMessage(alt_text='⚖️ 體重紀錄', contents=FlexContainer.from_dict(flex_weight(stats)), quick_reply=qr(QR_WEIGHT)))
-            
-            # ===== 修改選單 =====
-            elif text == '修改' or text == '選單':
-                msgs.append(FlexMessage(alt_text='修改選單', contents=FlexContainer.from_dict(flex_modify_menu()), quick_reply=qr(QR_MOD)))
-            
-            # ===== 修改喝水 =====
-            elif text == '修改喝水':
+        
+        # ===== 修改選單 =====
+        elif text == '修改' or text == '選單':
+            msgs.append(FlexMessage(alt_text='修改選單', contents=FlexContainer.from_dict(flex_modify_menu()), quick_reply=qr(QR_MOD)))
+        
+        # ===== 修改喝水 =====
+        elif text == '修改喝水':
+            cur = read_today_count('water')
+            msgs.append(FlexMessage(alt_text='修改喝水', contents=FlexContainer.from_dict(flex_modify_prompt('water', cur)), quick_reply=qr(QR_MAIN)))
+        
+        # ===== 修改起身 =====
+        elif text == '修改起身':
+            cur = read_today_count('stand')
+            msgs.append(FlexMessage(alt_text='修改起身', contents=FlexContainer.from_dict(flex_modify_prompt('stand', cur)), quick_reply=qr(QR_MAIN)))
+        
+        # ===== 修改運動 =====
+        elif text == '修改運動':
+            stats = read_today_stats()
+            msgs.append(FlexMessage(alt_text='修改運動', contents=FlexContainer.from_dict(flex_modify_exercise(stats)), quick_reply=qr(QR_MOD_EX)))
+        
+        # ===== 刪除運動 =====
+        elif text == '刪除運動':
+            deleted = delete_last_exercise()
+            if deleted:
+                msgs.append(TextMessage(text=f"✅ 已刪除：{deleted[1]} {deleted[2]}分鐘", quick_reply=qr(QR_MAIN)))
+            else:
+                msgs.append(TextMessage(text="⚠️ 今日沒有運動紀錄", quick_reply=qr(QR_MAIN)))
+        
+        # ===== 清空運動 =====
+        elif text == '清空運動':
+            count = clear_today_exercise()
+            msgs.append(TextMessage(text=f"✅ 已清空今日 {count} 筆運動紀錄", quick_reply=qr(QR_MAIN)))
+        
+        # ===== 修改喝水 N =====
+        elif text.startswith('修改喝水'):
+            parts = text.split()
+            if len(parts) >= 2 and parts[-1].isdigit():
+                t = int(parts[-1])
+                set_count('water', t)
+                msgs.append(FlexMessage(alt_text=f'已改為{t}杯', contents=FlexContainer.from_dict(flex_water(t)), quick_reply=qr(QR_MAIN)))
+            else:
                 cur = read_today_count('water')
                 msgs.append(FlexMessage(alt_text='修改喝水', contents=FlexContainer.from_dict(flex_modify_prompt('water', cur)), quick_reply=qr(QR_MAIN)))
-            
-            # ===== 修改起身 =====
-            elif text == '修改起身':
+        
+        # ===== 修改起身 N =====
+        elif text.startswith('修改起身'):
+            parts = text.split()
+            if len(parts) >= 2 and parts[-1].isdigit():
+                t = int(parts[-1])
+                set_count('stand', t)
+                msgs.append(FlexMessage(alt_text=f'已改為{t}次', contents=FlexContainer.from_dict(flex_stand(t)), quick_reply=qr(QR_MAIN)))
+            else:
                 cur = read_today_count('stand')
                 msgs.append(FlexMessage(alt_text='修改起身', contents=FlexContainer.from_dict(flex_modify_prompt('stand', cur)), quick_reply=qr(QR_MAIN)))
-            
-            # ===== 修改運動 =====
-            elif text == '修改運動':
-                stats = read_today_stats()
-                msgs.append(FlexMessage(alt_text='修改運動', contents=FlexContainer.from_dict(flex_modify_exercise(stats)), quick_reply=qr(QR_MOD_EX)))
-            
-            # ===== 刪除運動 =====
-            elif text == '刪除運動':
-                deleted = delete_last_exercise()
-                if deleted:
-                    msgs.append(TextMessage(text=f"✅ 已刪除：{deleted[1]} {deleted[2]}分鐘", quick_reply=qr(QR_MAIN)))
-                else:
-                    msgs.append(TextMessage(text="⚠️ 今日沒有運動紀錄", quick_reply=qr(QR_MAIN)))
-            
-            # ===== 清空運動 =====
-            elif text == '清空運動':
-                count = clear_today_exercise()
-                msgs.append(TextMessage(text=f"✅ 已清空今日 {count} 筆運動紀錄", quick_reply=qr(QR_MAIN)))
-            
-            # ===== 修改喝水 N =====
-            elif text.startswith('修改喝水'):
-                parts = text.split()
-                if len(parts) >= 2 and parts[-1].isdigit():
-                    t = int(parts[-1])
-                    set_count('water', t)
-                    msgs.append(FlexMessage(alt_text=f'已改為{t}杯', contents=FlexContainer.from_dict(flex_water(t)), quick_reply=qr(QR_MAIN)))
-                else:
-                    cur = read_today_count('water')
-                    msgs.append(FlexMessage(alt_text='修改喝水', contents=FlexContainer.from_dict(flex_modify_prompt('water', cur)), quick_reply=qr(QR_MAIN)))
-            
-            # ===== 修改起身 N =====
-            elif text.startswith('修改起身'):
-                parts = text.split()
-                if len(parts) >= 2 and parts[-1].isdigit():
-                    t = int(parts[-1])
-                    set_count('stand', t)
-                    msgs.append(FlexMessage(alt_text=f'已改為{t}次', contents=FlexContainer.from_dict(flex_stand(t)), quick_reply=qr(QR_MAIN)))
-                else:
-                    cur = read_today_count('stand')
-                    msgs.append(FlexMessage(alt_text='修改起身', contents=FlexContainer.from_dict(flex_modify_prompt('stand', cur)), quick_reply=qr(QR_MAIN)))
-            
-            # ===== 運動類型 =====
-            elif text in EXERCISE_TYPES:
-                msgs.append(TextMessage(text=f"請輸入 {text} 的時間\n例如：{text} 30", quick_reply=qr(QR_MAIN)))
-            
-            # ===== 運動輸入 =====
-            elif any(text.startswith(e) for e in EXERCISE_TYPES):
-                parts = text.split()
-                if len(parts) >= 2 and parts[1].isdigit():
-                    et, dur = parts[0], int(parts[1])
-                    cal = write_exercise(et, dur)
-                    msgs.append(FlexMessage(alt_text=f'{et}{dur}分鐘', contents=FlexContainer.from_dict(flex_exercise(et, dur, cal)), quick_reply=qr(QR_EX)))
-                else:
-                    msgs.append(TextMessage(text=f"請輸入時間，例如：{parts[0]} 30", quick_reply=qr(QR_MAIN)))
-            
-            # ===== 設定 =====
-            elif text == '設定':
-                msgs.append(FlexMessage(alt_text='設定', contents=FlexContainer.from_dict(flex_settings(read_settings())), quick_reply=qr(QR_MAIN)))
-            
-            # ===== 修改設定 =====
-            elif text.startswith('喝水間隔'):
-                p = text.split()
-                if len(p) >= 2 and p[1].isdigit():
-                    write_setting('water_interval', int(p[1]))
-                    msgs.append(TextMessage(text=f"✅ 喝水間隔設為 {p[1]} 分鐘", quick_reply=qr(QR_MAIN)))
-                else:
-                    msgs.append(TextMessage(text="格式：喝水間隔 數字", quick_reply=qr(QR_MAIN)))
-            
-            elif text.startswith('起身間隔') or text.startswith('久坐間隔'):
-                p = text.split()
-                if len(p) >= 2 and p[1].isdigit():
-                    write_setting('stand_interval', int(p[1]))
-                    msgs.append(TextMessage(text=f"✅ 起身間隔設為 {p[1]} 分鐘", quick_reply=qr(QR_MAIN)))
-                else:
-                    msgs.append(TextMessage(text="格式：起身間隔 數字\n例如：起身間隔 45", quick_reply=qr(QR_MAIN)))
-            
-            elif text.startswith('勿擾'):
-                # 用正則提取時間 (支援 6:00 或 06:00 格式)
-                times = re.findall(r'(\d{1,2}:\d{2})', text)
-                if len(times) == 2:
-                    # 正規化為 HH:mm 格式
-                    def normalize_time(t):
-                        h, m = t.split(':')
-                        return f"{int(h):02d}:{m}"
-                    start = normalize_time(times[0])
-                    end = normalize_time(times[1])
-                    write_setting('dnd_start', start)
-                    write_setting('dnd_end', end)
-                    msgs.append(TextMessage(text=f"✅ 勿擾：{start}-{end}", quick_reply=qr(QR_MAIN)))
-                else:
-                    msgs.append(TextMessage(text="格式：勿擾 22:00-08:00", quick_reply=qr(QR_MAIN)))
-            
-            elif text == '開啟提醒':
-                write_setting('enabled', 'TRUE')
-                msgs.append(TextMessage(text="✅ 提醒已開啟", quick_reply=qr(QR_MAIN)))
-            
-            elif text == '關閉提醒':
-                write_setting('enabled', 'FALSE')
-                msgs.append(TextMessage(text="✅ 提醒已關閉", quick_reply=qr(QR_MAIN)))
-            
-            # ===== 稍後提醒 =====
-            elif text == '稍後提醒喝水':
-                # 記錄延後時間（10分鐘後）
-                delay_time = (datetime.now(TZ) + timedelta(minutes=10)).strftime('%Y-%m-%d %H:%M:%S')
-                write_setting('water_snooze', delay_time)
-                msgs.append(TextMessage(text="⏰ 好的，10 分鐘後再提醒你喝水！", quick_reply=qr(QR_MAIN)))
-            
-            elif text == '稍後提醒起身':
-                delay_time = (datetime.now(TZ) + timedelta(minutes=10)).strftime('%Y-%m-%d %H:%M:%S')
-                write_setting('stand_snooze', delay_time)
-                msgs.append(TextMessage(text="⏰ 好的，10 分鐘後再提醒你起身！", quick_reply=qr(QR_MAIN)))
-            
-            # ===== 今日不提醒 =====
-            elif text == '今日不提醒喝水':
-                today_end = datetime.now(TZ).strftime('%Y-%m-%d') + ' 23:59:59'
-                write_setting('water_snooze', today_end)
-                msgs.append(TextMessage(text="🔕 今日不再提醒喝水\n明天會恢復提醒", quick_reply=qr(QR_MAIN)))
-            
-            elif text == '今日不提醒起身':
-                today_end = datetime.now(TZ).strftime('%Y-%m-%d') + ' 23:59:59'
-                write_setting('stand_snooze', today_end)
-                msgs.append(TextMessage(text="🔕 今日不再提醒起身\n明天會恢復提醒", quick_reply=qr(QR_MAIN)))
-            
-            elif text == '今日不運動':
-                today = datetime.now(TZ).strftime('%Y-%m-%d')
-                write_setting('exercise_skip', today)
-                msgs.append(TextMessage(text="😴 好的，今天好好休息！\n記得明天要動起來喔", quick_reply=qr(QR_MAIN)))
-            
-            # ===== 護眼記錄 =====
-            elif text == '護眼完成' or text == '已護眼':
-                write_eye('completed')
-                eye_stats = get_eye_stats()
-                msgs.append(TextMessage(text=f"👁️ 護眼完成！做得好！\n\n今日統計：\n✅ 已護眼：{eye_stats['completed']} 次\n❌ 忽略：{eye_stats['ignored']} 次\n\n繼續保持 20-20-20 護眼習慣！", quick_reply=qr(QR_EYE)))
-            
-            elif text == '護眼忽略':
-                write_eye('ignored')
-                eye_stats = get_eye_stats()
-                msgs.append(TextMessage(text=f"👁️ 已記錄忽略\n\n今日統計：\n✅ 已護眼：{eye_stats['completed']} 次\n❌ 忽略：{eye_stats['ignored']} 次\n\n記得要讓眼睛休息喔！", quick_reply=qr(QR_EYE)))
-            
-            elif text == '護眼統計':
-                eye_stats = get_eye_stats()
-                msgs.append(TextMessage(text=f"👁️ 今日護眼統計\n\n✅ 已護眼：{eye_stats['completed']} 次\n❌ 忽略：{eye_stats['ignored']} 次\n📊 總提醒：{eye_stats['total']} 次\n\n20-20-20 法則：\n每 20 分鐘看向 20 英尺（6公尺）遠處 20 秒", quick_reply=qr(QR_EYE)))
-            
-            # ===== 手動 AI 分析 =====
-            elif text == 'AI分析' or text == 'ai分析':
-                stats = read_today_stats()
-                summary = f"喝水{stats['water_count']}杯、起身{stats['stand_count']}次、運動{stats['exercise_minutes']}分鐘"
-                msgs.append(TextMessage(text="🤖 正在分析今日數據...\n請稍候，AI 分析結果將在幾秒後推送", quick_reply=qr(QR_MAIN)))
-                # 強制觸發 AI 分析
-                def force_ai():
-                    try:
-                        import time
-                        time.sleep(1)
-                        gemini = get_gemini('daily', 0, summary)
-                        openai = get_openai('daily', 0, summary)
-                        af = flex_ai(gemini, openai)
-                        if af:
-                            with ApiClient(configuration) as api:
-                                MessagingApi(api).push_message(PushMessageRequest(
-                                    to=user_id,
-                                    messages=[FlexMessage(alt_text='🤖 AI 分析', contents=FlexContainer.from_dict(af))]
-                                ))
-                    except Exception as e:
-                        print(f"[AI] Force analysis error: {e}")
-                thread = threading.Thread(target=force_ai)
-                thread.start()
-            
-            # ===== 目標設定 =====
-            elif text.startswith('喝水目標'):
-                p = text.split()
-                if len(p) >= 2 and p[-1].isdigit():
-                    val = int(p[-1])
-                    if 1 <= val <= 20:
-                        write_setting('water_goal', val)
-                        msgs.append(TextMessage(text=f"✅ 喝水目標設為 {val} 杯/天", quick_reply=qr(QR_MAIN)))
-                    else:
-                        msgs.append(TextMessage(text="⚠️ 請輸入 1-20 之間的數字", quick_reply=qr(QR_MAIN)))
-                else:
-                    goals = get_goals()
-                    msgs.append(TextMessage(text=f"目前喝水目標：{goals['water']} 杯\n\n格式：喝水目標 數字\n例如：喝水目標 10", quick_reply=qr(QR_MAIN)))
-            
-            elif text.startswith('起身目標'):
-                p = text.split()
-                if len(p) >= 2 and p[-1].isdigit():
-                    val = int(p[-1])
-                    if 1 <= val <= 20:
-                        write_setting('stand_goal', val)
-                        msgs.append(TextMessage(text=f"✅ 起身目標設為 {val} 次/天", quick_reply=qr(QR_MAIN)))
-                    else:
-                        msgs.append(TextMessage(text="⚠️ 請輸入 1-20 之間的數字", quick_reply=qr(QR_MAIN)))
-                else:
-                    goals = get_goals()
-                    msgs.append(TextMessage(text=f"目前起身目標：{goals['stand']} 次\n\n格式：起身目標 數字\n例如：起身目標 8", quick_reply=qr(QR_MAIN)))
-            
-            elif text.startswith('運動目標'):
-                p = text.split()
-                if len(p) >= 2 and p[-1].isdigit():
-                    val = int(p[-1])
-                    if 1 <= val <= 180:
-                        write_setting('exercise_goal', val)
-                        msgs.append(TextMessage(text=f"✅ 運動目標設為 {val} 分鐘/天", quick_reply=qr(QR_MAIN)))
-                    else:
-                        msgs.append(TextMessage(text="⚠️ 請輸入 1-180 之間的數字", quick_reply=qr(QR_MAIN)))
+        
+        # ===== 運動類型 =====
+        elif text in EXERCISE_TYPES:
+            msgs.append(TextMessage(text=f"請輸入 {text} 的時間\n例如：{text} 30", quick_reply=qr(QR_MAIN)))
+        
+        # ===== 運動輸入 =====
+        elif any(text.startswith(e) for e in EXERCISE_TYPES):
+            parts = text.split()
+            if len(parts) >= 2 and parts[1].isdigit():
+                et, dur = parts[0], int(parts[1])
+                cal = write_exercise(et, dur)
+                msgs.append(FlexMessage(alt_text=f'{et}{dur}分鐘', contents=FlexContainer.from_dict(flex_exercise(et, dur, cal)), quick_reply=qr(QR_EX)))
+            else:
+                msgs.append(TextMessage(text=f"請輸入時間，例如：{parts[0]} 30", quick_reply=qr(QR_MAIN)))
+        
+        # ===== 設定 =====
+        elif text == '設定':
+            msgs.append(FlexMessage(alt_text='設定', contents=FlexContainer.from_dict(flex_settings(prefetch(COMMAND_DEPS[text])['settings'])), quick_reply=qr(QR_MAIN)))
+        
+        # ===== 修改設定 =====
+        elif text.startswith('喝水間隔'):
+            p = text.split()
+            if len(p) >= 2 and p[1].isdigit() and write_setting('water_interval', int(p[1])):
+                msgs.append(TextMessage(text=f"✅ 喝水間隔設為 {p[1]} 分鐘", quick_reply=qr(QR_MAIN)))
+            else:
+                msgs.append(TextMessage(text="格式：喝水間隔 數字（10-180）", quick_reply=qr(QR_MAIN)))
+        
+        elif text.startswith('起身間隔') or text.startswith('久坐間隔'):
+            p = text.split()
+            if len(p) >= 2 and p[1].isdigit() and write_setting('stand_interval', int(p[1])):
+                msgs.append(TextMessage(text=f"✅ 起身間隔設為 {p[1]} 分鐘", quick_reply=qr(QR_MAIN)))
+            else:
+                msgs.append(TextMessage(text="格式：起身間隔 數字（10-120）\n例如：起身間隔 45", quick_reply=qr(QR_MAIN)))
+        
+        elif text.startswith('勿擾'):
+            # 用正則提取時間 (支援 6:00 或 06:00 格式)
+            times = re.findall(r'(\d{1,2}:\d{2})', text)
+            if len(times) == 2:
+                # 正規化為 HH:mm 格式
+                def normalize_time(t):
+                    h, m = t.split(':')
+                    return f"{int(h):02d}:{m}"
+                start = normalize_time(times[0])
+                end = normalize_time(times[1])
+                update_settings({'dnd_start': start, 'dnd_end': end})
+                msgs.append(TextMessage(text=f"✅ 勿擾：{start}-{end}", quick_reply=qr(QR_MAIN)))
+            else:
+                msgs.append(TextMessage(text="格式：勿擾 22:00-08:00", quick_reply=qr(QR_MAIN)))
+        
+        elif text == '開啟提醒':
+            write_setting('enabled', 'TRUE')
+            msgs.append(TextMessage(text="✅ 提醒已開啟", quick_reply=qr(QR_MAIN)))
+        
+        elif text == '關閉提醒':
+            write_setting('enabled', 'FALSE')
+            msgs.append(TextMessage(text="✅ 提醒已關閉", quick_reply=qr(QR_MAIN)))
+        
+        # ===== 稍後提醒 =====
+        elif text == '稍後提醒喝水':
+            # 記錄延後時間（10分鐘後）
+            delay_time = (datetime.now(TZ) + timedelta(minutes=10)).strftime('%Y-%m-%d %H:%M:%S')
+            write_setting('water_snooze', delay_time)
+            msgs.append(TextMessage(text="⏰ 好的，10 分鐘後再提醒你喝水！", quick_reply=qr(QR_MAIN)))
+        
+        elif text == '稍後提醒起身':
+            delay_time = (datetime.now(TZ) + timedelta(minutes=10)).strftime('%Y-%m-%d %H:%M:%S')
+            write_setting('stand_snooze', delay_time)
+            msgs.append(TextMessage(text="⏰ 好的，10 分鐘後再提醒你起身！", quick_reply=qr(QR_MAIN)))
+        
+        # ===== 今日不提醒 =====
+        elif text == '今日不提醒喝水':
+            today_end = datetime.now(TZ).strftime('%Y-%m-%d') + ' 23:59:59'
+            write_setting('water_snooze', today_end)
+            msgs.append(TextMessage(text="🔕 今日不再提醒喝水\n明天會恢復提醒", quick_reply=qr(QR_MAIN)))
+        
+        elif text == '今日不提醒起身':
+            today_end = datetime.now(TZ).strftime('%Y-%m-%d') + ' 23:59:59'
+            write_setting('stand_snooze', today_end)
+            msgs.append(TextMessage(text="🔕 今日不再提醒起身\n明天會恢復提醒", quick_reply=qr(QR_MAIN)))
+        
+        elif text == '今日不運動':
+            today = datetime.now(TZ).strftime('%Y-%m-%d')
+            write_setting('exercise_skip', today)
+            msgs.append(TextMessage(text="😴 好的，今天好好休息！\n記得明天要動起來喔", quick_reply=qr(QR_MAIN)))
+        
+        # ===== 護眼記錄 =====
+        elif text == '護眼完成' or text == '已護眼':
+            write_eye('completed')
+            eye_stats = get_eye_stats()
+            msgs.append(TextMessage(text=f"👁️ 護眼完成！做得好！\n\n今日統計：\n✅ 已護眼：{eye_stats['completed']} 次\n❌ 忽略：{eye_stats['ignored']} 次\n\n繼續保持 20-20-20 護眼習慣！", quick_reply=qr(QR_EYE)))
+        
+        elif text == '護眼忽略':
+            write_eye('ignored')
+            eye_stats = get_eye_stats()
+            msgs.append(TextMessage(text=f"👁️ 已記錄忽略\n\n今日統計：\n✅ 已護眼：{eye_stats['completed']} 次\n❌ 忽略：{eye_stats['ignored']} 次\n\n記得要讓眼睛休息喔！", quick_reply=qr(QR_EYE)))
+        
+        elif text == '護眼統計':
+            eye_stats = get_eye_stats()
+            msgs.append(TextMessage(text=f"👁️ 今日護眼統計\n\n✅ 已護眼：{eye_stats['completed']} 次\n❌ 忽略：{eye_stats['ignored']} 次\n📊 總提醒：{eye_stats['total']} 次\n\n20-20-20 法則：\n每 20 分鐘看向 20 英尺（6公尺）遠處 20 秒", quick_reply=qr(QR_EYE)))
+        
+        # ===== 手動 AI 分析 =====
+        elif text == 'AI分析' or text == 'ai分析':
+            # 先回本機洞察，AI 分析在背景跑，有結果再推送
+            summary, _ = get_report_base('daily')
+            insight = insight_message('daily', summary)
+            msgs.append(FlexMessage(alt_text=insight['alt_text'], contents=FlexContainer.from_dict(insight['contents']), quick_reply=qr(QR_MAIN)))
+            ai = ai_message('daily', peek_ai_pair('daily', summary))
+            if ai:
+                msgs.insert(0, FlexMessage(alt_text=ai['alt_text'], contents=FlexContainer.from_dict(ai['contents'])))
+            else:
+                push_ai_upgrade(user_id, 'daily', summary)
+        
+        # ===== 目標設定 =====
+        elif text.startswith('喝水目標'):
+            p = text.split()
+            if len(p) >= 2 and p[-1].isdigit():
+                val = int(p[-1])
+                if 1 <= val <= 20:
+                    write_setting('water_goal', val)
+                    msgs.append(TextMessage(text=f"✅ 喝水目標設為 {val} 杯/天", quick_reply=qr(QR_MAIN)))
                 else:
-                    goals = get_goals()
-                    msgs.append(TextMessage(text=f"目前運動目標：{goals['exercise']} 分鐘\n\n格式：運動目標 數字\n例如：運動目標 45", quick_reply=qr(QR_MAIN)))
-            
-            elif text == '目標設定' or text == '設定目標':
+                    msgs.append(TextMessage(text="⚠️ 請輸入 1-20 之間的數字", quick_reply=qr(QR_MAIN)))
+            else:
                 goals = get_goals()
-                msgs.append(TextMessage(text=f"📊 目前每日目標\n\n💧 喝水：{goals['water']} 杯\n🧍 起身：{goals['stand']} 次\n🏃 運動：{goals['exercise']} 分鐘\n\n修改方式：\n• 喝水目標 10\n• 起身目標 8\n• 運動目標 45", quick_reply=qr(QR_MAIN)))
-            
-            # ===== V11 新功能 =====
-            
-            # 睡眠記錄
-            elif text == '記錄睡眠' or text == '睡眠':
-                msgs.append(TextMessage(text="😴 記錄睡眠\n\n格式：睡眠 時數 品質(1-5)\n例如：睡眠 7.5 4\n\n品質說明：\n5=很好 4=好 3=普通 2=差 1=很差", quick_reply=qr(QR_MAIN)))
-            
-            elif text.startswith('睡眠 ') or text.startswith('睡眠記錄 '):
-                parts = text.split()
-                if len(parts) >= 3:
-                    try:
-                        hours = float(parts[1])
-                        quality = int(parts[2])
-                        note = ' '.join(parts[3:]) if len(parts) > 3 else ''
-                        if 0 < hours <= 24 and 1 <= quality <= 5:
-                            write_sleep(hours, quality, note)
-                            q_text = ['', '😫很差', '😔差', '😐普通', '🙂好', '😴很好'][quality]
-                            msgs.append(TextMessage(text=f"✅ 睡眠記錄成功！\n\n⏰ 時數：{hours} 小時\n😴 品質：{q_text}\n📝 備註：{note if note else '無'}", quick_reply=qr(QR_MAIN)))
-                        else:
-                            msgs.append(TextMessage(text="⚠️ 時數需在0-24，品質需在1-5", quick_reply=qr(QR_MAIN)))
-                    except:
-                        msgs.append(TextMessage(text="格式錯誤，例如：睡眠 7.5 4", quick_reply=qr(QR_MAIN)))
+                msgs.append(TextMessage(text=f"目前喝水目標：{goals['water']} 杯\n\n格式：喝水目標 數字\n例如：喝水目標 10", quick_reply=qr(QR_MAIN)))
+        
+        elif text.startswith('起身目標'):
+            p = text.split()
+            if len(p) >= 2 and p[-1].isdigit():
+                val = int(p[-1])
+                if 1 <= val <= 20:
+                    write_setting('stand_goal', val)
+                    msgs.append(TextMessage(text=f"✅ 起身目標設為 {val} 次/天", quick_reply=qr(QR_MAIN)))
                 else:
-                    msgs.append(TextMessage(text="格式：睡眠 時數 品質\n例如：睡眠 7.5 4", quick_reply=qr(QR_MAIN)))
-            
-            elif text == '睡眠統計':
-                stats = get_sleep_stats()
-                if stats:
-                    msgs.append(TextMessage(text=f"😴 睡眠統計（近30天）\n\n⏰ 平均時數：{stats['avg_hours']} 小時\n⭐ 平均品質：{stats['avg_quality']}/5\n📊 記錄次數：{stats['records']} 次", quick_reply=qr(QR_MAIN)))
+                    msgs.append(TextMessage(text="⚠️ 請輸入 1-20 之間的數字", quick_reply=qr(QR_MAIN)))
+            else:
+                goals = get_goals()
+                msgs.append(TextMessage(text=f"目前起身目標：{goals['stand']} 次\n\n格式：起身目標 數字\n例如：起身目標 8", quick_reply=qr(QR_MAIN)))
+        
+        elif text.startswith('運動目標'):
+            p = text.split()
+            if len(p) >= 2 and p[-1].isdigit():
+                val = int(p[-1])
+                if 1 <= val <= 180:
+                    write_setting('exercise_goal', val)
+                    msgs.append(TextMessage(text=f"✅ 運動目標設為 {val} 分鐘/天", quick_reply=qr(QR_MAIN)))
                 else:
-                    msgs.append(TextMessage(text="還沒有睡眠記錄\n\n輸入「記錄睡眠」開始記錄", quick_reply=qr(QR_MAIN)))
-            
-            # 飲食記錄
-            elif text == '記錄飲食' or text == '飲食':
-                msgs.append(TextMessage(text="🍎 記錄飲食\n\n格式：餐別 食物\n例如：早餐 吐司、豆漿\n\n餐別：早餐/午餐/晚餐/點心\n\n或輸入熱量：\n午餐 便當 700卡", quick_reply=qr(QR_MAIN)))
-            
-            elif any(text.startswith(m) for m in ['早餐', '午餐', '晚餐', '點心']):
-                parts = text.split(maxsplit=1)
-                if len(parts) >= 2:
-                    meal_type = parts[0]
-                    rest = parts[1]
-                    
-                    # 檢查是否有自訂熱量
-                    cal_match = re.search(r'(\d+)\s*[卡kcal]', rest)
-                    if cal_match:
-                        calories = int(cal_match.group(1))
-                        foods = re.sub(r'\d+\s*[卡kcal]', '', rest).strip()
+                    msgs.append(TextMessage(text="⚠️ 請輸入 1-180 之間的數字", quick_reply=qr(QR_MAIN)))
+            else:
+                goals = get_goals()
+                msgs.append(TextMessage(text=f"目前運動目標：{goals['exercise']} 分鐘\n\n格式：運動目標 數字\n例如：運動目標 45", quick_reply=qr(QR_MAIN)))
+        
+        elif text.startswith('目標體重'):
+            p = text.split()
+            try:
+                val = float(p[-1]) if len(p) >= 2 else 0
+            except ValueError:
+                val = 0
+            if 20 <= val <= 300:
+                write_setting('weight_goal', val)
+                msgs.append(TextMessage(text=f"✅ 目標體重設為 {val} kg", quick_reply=qr(QR_WEIGHT)))
+            else:
+                msgs.append(TextMessage(text="格式：目標體重 數字\n例如：目標體重 60", quick_reply=qr(QR_WEIGHT)))
+        
+        elif text == '目標設定' or text == '設定目標':
+            goals = get_goals()
+            msgs.append(TextMessage(text=f"📊 目前每日目標\n\n💧 喝水：{goals['water']} 杯\n🧍 起身：{goals['stand']} 次\n🏃 運動：{goals['exercise']} 分鐘\n\n修改方式：\n• 喝水目標 10\n• 起身目標 8\n• 運動目標 45", quick_reply=qr(QR_MAIN)))
+        
+        # ===== V11 新功能 =====
+        
+        # 睡眠記錄
+        elif text == '記錄睡眠' or text == '睡眠':
+            msgs.append(TextMessage(text="😴 記錄睡眠\n\n格式：睡眠 時數 品質(1-5)\n例如：睡眠 7.5 4\n\n品質說明：\n5=很好 4=好 3=普通 2=差 1=很差", quick_reply=qr(QR_MAIN)))
+        
+        elif text.startswith('睡眠 ') or text.startswith('睡眠記錄 '):
+            parts = text.split()
+            if len(parts) >= 3:
+                try:
+                    hours = float(parts[1])
+                    quality = int(parts[2])
+                    note = ' '.join(parts[3:]) if len(parts) > 3 else ''
+                    if 0 < hours <= 24 and 1 <= quality <= 5:
+                        write_sleep(hours, quality, note)
+                        q_text = ['', '😫很差', '😔差', '😐普通', '🙂好', '😴很好'][quality]
+                        msgs.append(TextMessage(text=f"✅ 睡眠記錄成功！\n\n⏰ 時數：{hours} 小時\n😴 品質：{q_text}\n📝 備註：{note if note else '無'}", quick_reply=qr(QR_MAIN)))
                     else:
-                        calories = 0
-                        foods = rest
-                    
-                    cal = write_meal(meal_type, foods, calories)
-                    
-                    # 顯示個別食物熱量
-                    food_details = []
-                    food_list = re.split(r'[、，,\s]+', foods)
-                    for food in food_list:
-                        food = food.strip()
-                        if not food:
-                            continue
-                        food_cal = FOOD_CALORIES.get(food, 0)
-                        if food_cal == 0:
-                            for key, val in FOOD_CALORIES.items():
-                                if key in food or food in key:
-                                    food_cal = val
-                                    break
-                        if food_cal > 0:
-                            food_details.append(f"{food}({food_cal}卡)")
-                        else:
-                            food_details.append(food)
-                    
-                    food_str = '、'.join(food_details)
-                    msgs.append(TextMessage(text=f"✅ {meal_type}記錄成功！\n\n🍽️ 食物：{food_str}\n🔥 總熱量：約 {cal} 大卡", quick_reply=qr(QR_MAIN)))
-                else:
-                    msgs.append(TextMessage(text=f"請輸入食物內容\n例如：{parts[0]} 便當", quick_reply=qr(QR_MAIN)))
-            
-            elif text == '今日飲食' or text == '飲食統計':
-                stats = get_meal_stats()
-                if stats['meals']:
-                    # 分類顯示
-                    by_type = {'早餐': [], '午餐': [], '晚餐': [], '點心': []}
-                    for m in stats['meals']:
-                        t = m['type'] if m['type'] in by_type else '點心'
-                        by_type[t].append(m)
-                    
-                    meal_text = ''
-                    for meal_type in ['早餐', '午餐', '晚餐', '點心']:
-                        items = by_type[meal_type]
-                        if items:
-                            # 解析每個食物並顯示獨立熱量
-                            all_foods = []
-                            for m in items:
-                                food_list = re.split(r'[、，,\s]+', m['foods'])
-                                for food in food_list:
-                                    food = food.strip()
-                                    if not food:
-                                        continue
-                                    # 查詢熱量
-                                    cal = FOOD_CALORIES.get(food, 0)
-                                    if cal == 0:
-                                        for key, val in FOOD_CALORIES.items():
-                                            if key in food or food in key:
-                                                cal = val
-                                                break
-                                    if cal > 0:
-                                        all_foods.append(f"{food}({cal}卡)")
-                                    else:
-                                        all_foods.append(food)
-                            
-                            cal_sum = sum(m['calories'] for m in items)
-                            meal_text += f"🍽️ {meal_type}：{'、'.join(all_foods)} = {cal_sum}卡\n"
-                    
-                    msgs.append(TextMessage(text=f"🍎 今日飲食\n\n{meal_text.strip()}\n\n📊 總熱量：{stats['total_calories']} 大卡", quick_reply=qr(QR_MAIN)))
-                else:
-                    msgs.append(TextMessage(text="今天還沒有飲食記錄\n\n輸入「記錄飲食」開始記錄", quick_reply=qr(QR_MAIN)))
-            
-            # 心情記錄
-            elif text == '記錄心情' or text == '心情':
-                msgs.append(TextMessage(text="😊 記錄心情\n\n輸入表情或文字：\n😄 或「開心」\n🙂 或「普通」\n😐 或「平靜」\n😔 或「低落」\n😢 或「難過」\n😡 或「生氣」\n😰 或「焦慮」\n😴 或「疲憊」\n\n可加備註：開心 今天很棒", quick_reply=qr(QR_MAIN)))
-            
-            elif len(text) > 0 and text[0] in MOOD_OPTIONS:
-                emoji = text[0]
-                note = text[1:].strip()
-                write_mood(emoji, note)
-                score = MOOD_OPTIONS[emoji]
-                msgs.append(TextMessage(text=f"✅ 心情記錄成功！\n\n{emoji} 分數：{score}/5\n📝 備註：{note if note else '無'}", quick_reply=qr(QR_MAIN)))
-            
-            # 心情文字輸入
-            elif text.startswith('開心') or text.startswith('很開心'):
-                note = text.replace('開心', '').replace('很', '').strip()
-                write_mood('😄', note)
-                msgs.append(TextMessage(text=f"✅ 心情記錄成功！\n\n😄 分數：5/5\n📝 備註：{note if note else '無'}", quick_reply=qr(QR_MAIN)))
-            
-            elif text.startswith('普通'):
-                note = text.replace('普通', '').strip()
-                write_mood('🙂', note)
-                msgs.append(TextMessage(text=f"✅ 心情記錄成功！\n\n🙂 分數：4/5\n📝 備註：{note if note else '無'}", quick_reply=qr(QR_MAIN)))
-            
-            elif text.startswith('平靜'):
-                note = text.replace('平靜', '').strip()
-                write_mood('😐', note)
-                msgs.append(TextMessage(text=f"✅ 心情記錄成功！\n\n😐 分數：3/5\n📝 備註：{note if note else '無'}", quick_reply=qr(QR_MAIN)))
-            
-            elif text.startswith('低落') or text.startswith('不開心'):
-                note = text.replace('低落', '').replace('不開心', '').strip()
-                write_mood('😔', note)
-                msgs.append(TextMessage(text=f"✅ 心情記錄成功！\n\n😔 分數：2/5\n📝 備註：{note if note else '無'}", quick_reply=qr(QR_MAIN)))
-            
-            elif text.startswith('難過') or text.startswith('傷心'):
-                note = text.replace('難過', '').replace('傷心', '').strip()
-                write_mood('😢', note)
-                msgs.append(TextMessage(text=f"✅ 心情記錄成功！\n\n😢 分數：1/5\n📝 備註：{note if note else '無'}", quick_reply=qr(QR_MAIN)))
-            
-            elif text.startswith('生氣') or text.startswith('憤怒'):
-                note = text.replace('生氣', '').replace('憤怒', '').strip()
-                write_mood('😡', note)
-                msgs.append(TextMessage(text=f"✅ 心情記錄成功！\n\n😡 分數：1/5\n📝 備註：{note if note else '無'}", quick_reply=qr(QR_MAIN)))
-            
-            elif text.startswith('焦慮') or text.startswith('緊張'):
-                note = text.replace('焦慮', '').replace('緊張', '').strip()
-                write_mood('😰', note)
-                msgs.append(TextMessage(text=f"✅ 心情記錄成功！\n\n😰 分數：2/5\n📝 備註：{note if note else '無'}", quick_reply=qr(QR_MAIN)))
-            
-            elif text.startswith('疲憊') or text.startswith('累') or text.startswith('好累'):
-                note = text.replace('疲憊', '').replace('累', '').replace('好', '').strip()
-                write_mood('😴', note)
-                msgs.append(TextMessage(text=f"✅ 心情記錄成功！\n\n😴 分數：2/5\n📝 備註：{note if note else '無'}", quick_reply=qr(QR_MAIN)))
-            
-            elif text == '心情統計':
-                stats = get_mood_stats()
-                if stats:
-                    dist = ' '.join([f"{e}{c}次" for e, c in stats['distribution'].items()])
-                    msgs.append(TextMessage(text=f"😊 心情統計（近30天）\n\n⭐ 平均分數：{stats['avg_score']}/5\n📊 記錄次數：{stats['records']} 次\n\n分布：{dist}", quick_reply=qr(QR_MAIN)))
-                else:
-                    msgs.append(TextMessage(text="還沒有心情記錄\n\n輸入「記錄心情」開始記錄", quick_reply=qr(QR_MAIN)))
-            
-            # 成就系統
-            elif text == '成就' or text == '徽章':
-                ach = get_achievements()
-                if ach['unlocked']:
-                    badges = '\n'.join([f"{a['name']} - {a['desc']}" for a in ach['unlocked']])
-                    msgs.append(TextMessage(text=f"🏆 已解鎖成就 ({ach['unlocked_count']}/{ach['total']})\n\n{badges}\n\n📊 累計統計：\n💧 喝水 {ach['stats']['total_water']} 杯\n🧍 起身 {ach['stats']['total_stand']} 次\n🏃 運動 {ach['stats']['total_exercise']} 分鐘", quick_reply=qr(QR_MAIN)))
+                        msgs.append(TextMessage(text="⚠️ 時數需在0-24，品質需在1-5", quick_reply=qr(QR_MAIN)))
+                except:
+                    msgs.append(TextMessage(text="格式錯誤，例如：睡眠 7.5 4", quick_reply=qr(QR_MAIN)))
+            else:
+                msgs.append(TextMessage(text="格式：睡眠 時數 品質\n例如：睡眠 7.5 4", quick_reply=qr(QR_MAIN)))
+        
+        elif text == '睡眠統計':
+            stats = get_sleep_stats()
+            if stats:
+                msgs.append(TextMessage(text=f"😴 睡眠統計（近30天）\n\n⏰ 平均時數：{stats['avg_hours']} 小時\n⭐ 平均品質：{stats['avg_quality']}/5\n📊 記錄次數：{stats['records']} 次", quick_reply=qr(QR_MAIN)))
+            else:
+                msgs.append(TextMessage(text="還沒有睡眠記錄\n\n輸入「記錄睡眠」開始記錄", quick_reply=qr(QR_MAIN)))
+        
+        # 飲食記錄
+        elif text == '記錄飲食' or text == '飲食':
+            msgs.append(TextMessage(text="🍎 記錄飲食\n\n格式：餐別 食物\n例如：早餐 吐司、豆漿\n\n餐別：早餐/午餐/晚餐/點心\n\n或輸入熱量：\n午餐 便當 700卡", quick_reply=qr(QR_MAIN)))
+        
+        elif any(text.startswith(m) for m in ['早餐', '午餐', '晚餐', '點心']):
+            parts = text.split(maxsplit=1)
+            if len(parts) >= 2:
+                meal_type = parts[0]
+                rest = parts[1]
+                
+                # 檢查是否有自訂熱量
+                cal_match = re.search(r'(\d+)\s*[卡kcal]', rest)
+                if cal_match:
+                    calories = int(cal_match.group(1))
+                    foods = re.sub(r'\d+\s*[卡kcal]', '', rest).strip()
                 else:
-                    msgs.append(TextMessage(text=f"🏆 成就系統\n\n尚未解鎖任何成就\n繼續努力！\n\n📊 累計統計：\n💧 喝水 {ach['stats']['total_water']} 杯\n🧍 起身 {ach['stats']['total_stand']} 次\n🏃 運動 {ach['stats']['total_exercise']} 分鐘", quick_reply=qr(QR_MAIN)))
-            
+                    calories = 0
+                    foods = rest
+                
+                cal = write_meal(meal_type, foods, calories)
+                
+                # 顯示個別食物熱量
+                food_details = []
+                food_list = re.split(r'[、，,\s]+', foods)
+                for food in food_list:
+                    food = food.strip()
+                    if not food:
+                        continue
+                    food_cal = FOOD_CALORIES.get(food, 0)
+                    if food_cal == 0:
+                        for key, val in FOOD_CALORIES.items():
+                            if key in food or food in key:
+                                food_cal = val
+                                break
+                    if food_cal > 0:
+                        food_details.append(f"{food}({food_cal}卡)")
+                    else:
+                        food_details.append(food)
+                
+                food_str = '、'.join(food_details)
+                msgs.append(TextMessage(text=f"✅ {meal_type}記錄成功！\n\n🍽️ 食物：{food_str}\n🔥 總熱量：約 {cal} 大卡", quick_reply=qr(QR_MAIN)))
             else:
-                msgs.append(TextMessage(text="🤖 請使用下方按鈕", quick_reply=qr(QR_MAIN)))
-            
-            if msgs:
-                bot.reply_message(ReplyMessageRequest(reply_token=event.reply_token, messages=msgs))
+                msgs.append(TextMessage(text=f"請輸入食物內容\n例如：{parts[0]} 便當", quick_reply=qr(QR_MAIN)))
         
-        except Exception as e:
-            print(f"Error: {e}")
+        elif text == '關聯分析':
+            msgs.append(TextMessage(text=correlation_text(get_correlations()), quick_reply=qr(QR_STATS)))
+        
+        elif text == '今日飲食' or text == '飲食統計':
+            stats = get_meal_stats()
+            if stats['meals']:
+                # 分類顯示
+                by_type = {'早餐': [], '午餐': [], '晚餐': [], '點心': []}
+                for m in stats['meals']:
+                    t = m['type'] if m['type'] in by_type else '點心'
+                    by_type[t].append(m)
+                
+                meal_text = ''
+                for meal_type in ['早餐', '午餐', '晚餐', '點心']:
+                    items = by_type[meal_type]
+                    if items:
+                        # 解析每個食物並顯示獨立熱量
+                        all_foods = []
+                        for m in items:
+                            food_list = re.split(r'[、，,\s]+', m['foods'])
+                            for food in food_list:
+                                food = food.strip()
+                                if not food:
+                                    continue
+                                # 查詢熱量
+                                cal = FOOD_CALORIES.get(food, 0)
+                                if cal == 0:
+                                    for key, val in FOOD_CALORIES.items():
+                                        if key in food or food in key:
+                                            cal = val
+                                            break
+                                if cal > 0:
+                                    all_foods.append(f"{food}({cal}卡)")
+                                else:
+                                    all_foods.append(food)
+                        
+                        cal_sum = sum(m['calories'] for m in items)
+                        meal_text += f"🍽️ {meal_type}：{'、'.join(all_foods)} = {cal_sum}卡\n"
+                
+                today = get_today()
+                day, week = energy_balance(today), energy_balance(week_start(today), today)
+                balance = f"⚖️ 熱量收支：攝取 {day['intake']} − 運動 {day['burn']} = {day['net']:+} 大卡\n📅 本週淨值：{week['net']:+} 大卡"
+                msgs.append(TextMessage(text=f"🍎 今日飲食\n\n{meal_text.strip()}\n\n📊 總熱量：{stats['total_calories']} 大卡\n{balance}", quick_reply=qr(QR_MAIN)))
+            else:
+                msgs.append(TextMessage(text="今天還沒有飲食記錄\n\n輸入「記錄飲食」開始記錄", quick_reply=qr(QR_MAIN)))
+        
+        # 心情記錄
+        elif text == '記錄心情' or text == '心情':
+            msgs.append(TextMessage(text="😊 記錄心情\n\n輸入表情或文字：\n😄 或「開心」\n🙂 或「普通」\n😐 或「平靜」\n😔 或「低落」\n😢 或「難過」\n😡 或「生氣」\n😰 或「焦慮」\n😴 或「疲憊」\n\n可加備註：開心 今天很棒", quick_reply=qr(QR_MAIN)))
+        
+        elif len(text) > 0 and text[0] in MOOD_OPTIONS:
+            emoji = text[0]
+            note = text[1:].strip()
+            write_mood(emoji, note)
+            score = MOOD_OPTIONS[emoji]
+            msgs.append(TextMessage(text=f"✅ 心情記錄成功！\n\n{emoji} 分數：{score}/5\n📝 備註：{note if note else '無'}", quick_reply=qr(QR_MAIN)))
+        
+        # 心情文字輸入
+        elif text.startswith('開心') or text.startswith('很開心'):
+            note = text.replace('開心', '').replace('很', '').strip()
+            write_mood('😄', note)
+            msgs.append(TextMessage(text=f"✅ 心情記錄成功！\n\n😄 分數：5/5\n📝 備註：{note if note else '無'}", quick_reply=qr(QR_MAIN)))
+        
+        elif text.startswith('普通'):
+            note = text.replace('普通', '').strip()
+            write_mood('🙂', note)
+            msgs.append(TextMessage(text=f"✅ 心情記錄成功！\n\n🙂 分數：4/5\n📝 備註：{note if note else '無'}", quick_reply=qr(QR_MAIN)))
+        
+        elif text.startswith('平靜'):
+            note = text.replace('平靜', '').strip()
+            write_mood('😐', note)
+            msgs.append(TextMessage(text=f"✅ 心情記錄成功！\n\n😐 分數：3/5\n📝 備註：{note if note else '無'}", quick_reply=qr(QR_MAIN)))
+        
+        elif text.startswith('低落') or text.startswith('不開心'):
+            note = text.replace('低落', '').replace('不開心', '').strip()
+            write_mood('😔', note)
+            msgs.append(TextMessage(text=f"✅ 心情記錄成功！\n\n😔 分數：2/5\n📝 備註：{note if note else '無'}", quick_reply=qr(QR_MAIN)))
+        
+        elif text.startswith('難過') or text.startswith('傷心'):
+            note = text.replace('難過', '').replace('傷心', '').strip()
+            write_mood('😢', note)
+            msgs.append(TextMessage(text=f"✅ 心情記錄成功！\n\n😢 分數：1/5\n📝 備註：{note if note else '無'}", quick_reply=qr(QR_MAIN)))
+        
+        elif text.startswith('生氣') or text.startswith('憤怒'):
+            note = text.replace('生氣', '').replace('憤怒', '').strip()
+            write_mood('😡', note)
+            msgs.append(TextMessage(text=f"✅ 心情記錄成功！\n\n😡 分數：1/5\n📝 備註：{note if note else '無'}", quick_reply=qr(QR_MAIN)))
+        
+        elif text.startswith('焦慮') or text.startswith('緊張'):
+            note = text.replace('焦慮', '').replace('緊張', '').strip()
+            write_mood('😰', note)
+            msgs.append(TextMessage(text=f"✅ 心情記錄成功！\n\n😰 分數：2/5\n📝 備註：{note if note else '無'}", quick_reply=qr(QR_MAIN)))
+        
+        elif text.startswith('疲憊') or text.startswith('累') or text.startswith('好累'):
+            note = text.replace('疲憊', '').replace('累', '').replace('好', '').strip()
+            write_mood('😴', note)
+            msgs.append(TextMessage(text=f"✅ 心情記錄成功！\n\n😴 分數：2/5\n📝 備註：{note if note else '無'}", quick_reply=qr(QR_MAIN)))
+        
+        elif text == '心情統計':
+            stats = get_mood_stats()
+            if stats:
+                dist = ' '.join([f"{e}{c}次" for e, c in stats['distribution'].items()])
+                msgs.append(TextMessage(text=f"😊 心情統計（近30天）\n\n⭐ 平均分數：{stats['avg_score']}/5\n📊 記錄次數：{stats['records']} 次\n\n分布：{dist}", quick_reply=qr(QR_MAIN)))
+            else:
+                msgs.append(TextMessage(text="還沒有心情記錄\n\n輸入「記錄心情」開始記錄", quick_reply=qr(QR_MAIN)))
+        
+        # 成就系統
+        elif text == '成就' or text == '徽章':
+            msgs.extend(reply_within_budget(text, user_id, render_achievements))
+        
+        else:
+            msgs.append(TextMessage(text="🤖 請使用下方按鈕", quick_reply=qr(QR_MAIN)))
+        
+        if msgs and is_offline() and len(msgs) < 5:
+            msgs.append(TextMessage(text="📴 目前連不上 Google Sheets，以上為離線資料，新紀錄會在恢復後自動補寫", quick_reply=qr(QR_MAIN)))
+    
+    except Exception as e:
+        print(f"Error: {e}")
+        msgs = [busy_reply()]
+    return msgs
+
+def busy_reply():
+    return TextMessage(text="⚠️ 系統忙碌", quick_reply=qr(QR_MAIN))
+
+def handle_webhook_events(items):
+    """同一次 webhook 的文字訊息事件：依使用者分組照順序處理，寫入合併成每張表一次 append_rows，寫完才逐一回覆"""
+    groups = {}
+    for ev in items:
+        groups.setdefault(ev.source.user_id, []).append(ev)
+    batch = WriteBatch()
+    snapshot_saved = _projection_state['saved']
+    token = _write_batch.set(batch)
+    replies = []
+    try:
+        for user_events in groups.values():
+            for ev in user_events:
+                batch.owner = len(replies)
+                replies.append((ev, build_reply(ev)))
+    finally:
+        _write_batch.reset(token)
+    try:
+        batch.flush()
+    except Exception:
+        pass  # 錯誤已記在 batch.error（處理途中寫出失敗的也算）
+    if batch.error:
+        print(f"[Webhook] 批次寫入失敗: {batch.error}")
+        # 投影、點擊計數與熱量累計都已算進沒寫成功的紀錄，全部丟掉重新載入；
+        # 這段期間存過的投影快照也含有這些事件，一併刪除改由紀錄表重建
+        reset_projection(drop_snapshot=_projection_state['saved'] != snapshot_saved)
+        reset_tap_state()
+        reset_energy()
+        clear_cache()
+        # 之前的 flush 已寫入的事件照常回覆，只有列被作廢的事件回忙碌
+        replies = [(ev, [busy_reply()] if i in batch.dropped else msgs) for i, (ev, msgs) in enumerate(replies)]
+    if len(items) > 1:
+        print(f"[Webhook] {len(items)} 個事件（{len(groups)} 位使用者），合併寫入 {batch.written} 列")
+
+    with ApiClient(line_configuration()) as api:
+        bot = MessagingApi(api)
+        for ev, msgs in replies:
+            if not msgs:
+                continue
             try:
-                bot.reply_message(ReplyMessageRequest(reply_token=event.reply_token, messages=[TextMessage(text="⚠️ 系統忙碌", quick_reply=qr(QR_MAIN))]))
-            except:
-                pass
+                bot.reply_message(ReplyMessageRequest(reply_token=ev.reply_token, messages=msgs))
+            except Exception as e:
+                print(f"[Webhook] 回覆失敗: {e}")
+
+def handle_message(event):
+    """處理單一事件（壓測與本機測試用）"""
+    handle_webhook_events([event])
 
 # ===== API =====
 @app.route('/api/daily-report', methods=['POST'])
 def api_daily_report():
+    """每日總結推播（給 GAS 呼叫），立即回傳 job_id，計算與推播在背景進行"""
     try:
-        stats = read_today_stats()
-        streak = calculate_streak()
-        summary = f"喝水{stats['water_count']}杯、起身{stats['stand_count']}次、運動{stats['exercise_minutes']}分鐘、消耗{stats['exercise_calories']}卡、連續達標{streak}天"
-        if stats.get('exercise_details'):
-            summary += f"，項目：{', '.join(stats['exercise_details'])}"
-        
-        gemini = get_gemini('daily', 0, summary)
-        openai = get_openai('daily', 0, summary)
-        
-        msgs = [FlexMessage(alt_text='🌙每日總結', contents=FlexContainer.from_dict(flex_daily_report(stats)))]
-        af = flex_ai(gemini, openai)
-        if af:
-            msgs.append(FlexMessage(alt_text='AI每日分析', contents=FlexContainer.from_dict(af)))
-        
-        if LINE_USER_ID and msgs:
-            with ApiClient(configuration) as api:
-                MessagingApi(api).push_message(PushMessageRequest(to=LINE_USER_ID, messages=msgs))
-        
-        return jsonify({'status': 'ok', 'stats': stats, 'streak': streak})
+        job = create_report_job('daily')
+        return jsonify({'status': 'accepted', 'job_id': job['id'], 'recipients': len(job['recipients'])}), 202
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 @app.route('/api/weekly-report', methods=['POST'])
 def api_weekly_report():
-    """週報 API（給 GAS 週日呼叫）"""
+    """週報推播 API（給 GAS 週日呼叫），立即回傳 job_id"""
     try:
-        summary = read_week_summary()
-        streak = calculate_streak()
-        
-        summary_text = f"本週喝水{summary['total_water']}杯、起身{summary['total_stand']}次、運動{summary['total_exercise']}分鐘、消耗{summary['total_calories']}卡、達標{summary['days_all_ok']}天、連續達標{streak}天"
-        
-        gemini = get_gemini('weekly', 0, summary_text)
-        openai = get_openai('weekly', 0, summary_text)
-        
-        msgs = [FlexMessage(alt_text='📅 週報', contents=FlexContainer.from_dict(flex_week_report(summary)))]
-        af = flex_ai(gemini, openai)
-        if af:
-            msgs.append(FlexMessage(alt_text='AI週報分析', contents=FlexContainer.from_dict(af)))
-        
-        if LINE_USER_ID and msgs:
-            with ApiClient(configuration) as api:
-                MessagingApi(api).push_message(PushMessageRequest(to=LINE_USER_ID, messages=msgs))
-        
-        return jsonify({'status': 'ok', 'summary': summary, 'streak': streak})
+        job = create_report_job('weekly')
+        return jsonify({'status': 'accepted', 'job_id': job['id'], 'recipients': len(job['recipients'])}), 202
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/api/daily-report/prepare', methods=['POST'])
+def api_prepare_daily_report():
+    """預先計算每日總結（GAS 在推播前約 15 分鐘呼叫）"""
+    spawn_background(prepare_report, 'daily')
+    return jsonify({'status': 'accepted'}), 202
+
+@app.route('/api/weekly-report/prepare', methods=['POST'])
+def api_prepare_weekly_report():
+    """預先計算週報"""
+    spawn_background(prepare_report, 'weekly')
+    return jsonify({'status': 'accepted'}), 202
+
+@app.route('/api/report-jobs/<job_id>')
+def api_report_job(job_id):
+    """推播工作進度"""
+    job = load_report_job(job_id)
+    if not job:
+        return jsonify({'status': 'error', 'message': 'job not found'}), 404
+    return jsonify({k: v for k, v in job.items() if k not in ('payloads', 'recipients')} | {
+        'recipients': len(job['recipients']),
+        'batches': [{'size': len(b['to']), 'sent': b['sent']} for b in job['batches']]})
+
+@app.route('/api/archive', methods=['POST'])
+def api_archive():
+    """封存舊紀錄 API（給 GAS 每日呼叫）"""
+    try:
+        data = request.get_json(silent=True) or {}
+        days = int(data.get('retention_days', 0)) or None
+        return jsonify({'status': 'ok', **archive_logs(days)})
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
@@ -1917,17 +4139,110 @@ def api_week():
 @app.route('/api/settings')
 def api_settings():
     try:
-        return jsonify(get_cached('settings', read_settings))
+        resp = jsonify(read_settings())
+        resp.headers['X-Settings-Version'] = str(settings_store.version)
+        return resp
     except:
         return jsonify({'water_interval': 60, 'stand_interval': 45, 'enabled': True, 'water_goal': 8, 'stand_goal': 6, 'exercise_goal': 30})
 
 @app.route('/api/goals')
 def api_goals():
     try:
-        return jsonify(get_cached('goals', get_goals))
+        return jsonify(get_goals())
     except:
         return jsonify({'water': 8, 'stand': 6, 'exercise': 30})
 
+def date_range_args(days_back):
+    """查詢參數 from/to（YYYY-MM-DD，to 預設今天、from 預設 to 往前 days_back 天）；格式或日期不合法、from > to 時回 None"""
+    start, end = request.args.get('from'), request.args.get('to')
+    for d in (start, end):
+        if not d:
+            continue
+        if not re.fullmatch(r'\d{4}-\d{2}-\d{2}', d):
+            return None
+        try:
+            datetime.strptime(d, '%Y-%m-%d')
+        except ValueError:
+            return None
+    end = end or get_today()
+    start = start or (datetime.strptime(end, '%Y-%m-%d') - timedelta(days=days_back)).strftime('%Y-%m-%d')
+    return (start, end) if start <= end else None
+
+@app.route('/api/history')
+def api_history():
+    """長期歷史 API：/api/history?metric=water&from=2024-01-01&to=2024-12-31&bucket=week"""
+    metric = request.args.get('metric', 'water')
+    bucket = request.args.get('bucket', 'day')
+    if metric not in HISTORY_METRICS:
+        return jsonify({'error': f'metric 需為 {", ".join(HISTORY_METRICS)}'}), 400
+    if bucket not in analytics.BUCKETS:
+        return jsonify({'error': 'bucket 需為 day / week / month'}), 400
+    dates = date_range_args(90)
+    if dates is None:
+        return jsonify({'error': '日期格式需為 YYYY-MM-DD，且 from <= to'}), 400
+    start, end = dates
+    try:
+        return jsonify(read_history(metric, start, end, bucket))
+    except Exception as e:
+        print(f"[History] Error: {e}")
+        return jsonify({'metric': metric, 'bucket': bucket, 't': [], 'v': [], 'n': []})
+
+@app.route('/api/correlations')
+def api_correlations():
+    """關聯分析 API：/api/correlations?from=2024-01-01&to=2024-12-31（預設最近一年）"""
+    dates = date_range_args(CORRELATION_DAYS - 1)
+    if dates is None:
+        return jsonify({'error': '日期格式需為 YYYY-MM-DD，且 from <= to'}), 400
+    start, end = dates
+    try:
+        return jsonify(get_correlations(start, end))
+    except Exception as e:
+        print(f"[Correlations] Error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/energy')
+def api_energy():
+    """熱量收支 API：/api/energy?from=2024-01-01&to=2024-12-31&bucket=week"""
+    bucket = request.args.get('bucket', 'day')
+    if bucket not in analytics.BUCKETS:
+        return jsonify({'error': 'bucket 需為 day / week / month'}), 400
+    dates = date_range_args(29)
+    if dates is None:
+        return jsonify({'error': '日期格式需為 YYYY-MM-DD，且 from <= to'}), 400
+    start, end = dates
+    try:
+        today = get_today()
+        return jsonify({'today': energy_balance(today), 'week': energy_balance(week_start(today), today),
+                        'bucket': bucket, 'series': energy_rollup(start, end, bucket)})
+    except Exception as e:
+        print(f"[Energy] Error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/export')
+def api_export():
+    """匯出紀錄：/api/export?logs=water,exercise&format=csv&from=2024-01-01&to=2024-12-31（gzip=1 下載 .gz）"""
+    logs = [l.strip() for l in request.args.get('logs', ','.join(EXPORT_LOGS)).split(',') if l.strip()]
+    fmt = request.args.get('format', 'csv')
+    start = request.args.get('from') or '0000-01-01'
+    end = request.args.get('to') or '9999-12-31'
+    if not logs or any(l not in EXPORT_LOGS for l in logs):
+        return jsonify({'error': f'logs 需為 {", ".join(EXPORT_LOGS)}'}), 400
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': 'format 需為 csv / ndjson'}), 400
+    if not re.fullmatch(r'\d{4}-\d{2}-\d{2}', start) or not re.fullmatch(r'\d{4}-\d{2}-\d{2}', end) or start > end:
+        return jsonify({'error': '日期格式需為 YYYY-MM-DD，且 from <= to'}), 400
+
+    as_file = request.args.get('gzip') == '1'
+    negotiated = not as_file and 'gzip' in request.headers.get('Accept-Encoding', '')
+    filename = f"neon-pulse-{get_today()}.{fmt}" + ('.gz' if as_file else '')
+    resp = Response(stream_with_context(export_stream(logs, fmt, start, end, as_file or negotiated)),
+                    mimetype='application/gzip' if as_file else ('text/csv' if fmt == 'csv' else 'application/x-ndjson'))
+    resp.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    if negotiated:
+        resp.headers['Content-Encoding'] = 'gzip'
+        resp.headers['Vary'] = 'Accept-Encoding'
+    return resp
+
 @app.route('/api/streak')
 def api_streak():
     try:
@@ -1938,7 +4253,7 @@ def api_streak():
 @app.route('/api/weight')
 def api_weight():
     try:
-        return jsonify(get_cached('weight', get_weight_stats))
+        return jsonify(get_cached('weight_stats', get_weight_stats))
     except:
         return jsonify({'current': None, 'week_change': None, 'month_change': None})
 
@@ -2056,71 +4371,54 @@ def api_log_weight():
         if weight <= 0:
             return jsonify({'success': False, 'error': '請輸入有效體重'}), 400
         
-        sheet = get_sheet('weight_log')
-        sheet.append_row([get_now(), weight])
+        write_weight(weight)
         return jsonify({'success': True, 'weight': weight, 'message': f'已記錄體重 {weight} kg'})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/update/goals', methods=['POST'])
 def api_update_goals():
-    """PWA 更新目標"""
+    """PWA 更新目標（一次批次寫入）"""
     try:
         data = request.get_json() or {}
-        updated = []
-        
-        if 'water' in data:
-            val = int(data['water'])
-            if 1 <= val <= 20:
-                write_setting('water_goal', val)
-                updated.append(f'喝水 {val} 杯')
-        
-        if 'stand' in data:
-            val = int(data['stand'])
-            if 1 <= val <= 20:
-                write_setting('stand_goal', val)
-                updated.append(f'起身 {val} 次')
-        
-        if 'exercise' in data:
-            val = int(data['exercise'])
-            if 1 <= val <= 180:
-                write_setting('exercise_goal', val)
-                updated.append(f'運動 {val} 分鐘')
-        
+        labels = {'water': '喝水 {} 杯', 'stand': '起身 {} 次', 'exercise': '運動 {} 分鐘'}
+        keys = [k for k in labels if k in data]
+        update_settings({f'{k}_goal': data[k] for k in keys})
+        updated = [labels[k].format(int(float(data[k]))) for k in keys]
         return jsonify({'success': True, 'updated': updated, 'message': '目標已更新：' + '、'.join(updated)})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/update/settings', methods=['POST'])
 def api_update_settings():
-    """PWA 更新設定"""
+    """PWA 更新設定（一次批次寫入）"""
     try:
         data = request.get_json() or {}
-        updated = []
+        changes, updated = {}, []
         
         if 'water_interval' in data:
-            val = int(data['water_interval'])
-            if 10 <= val <= 180:
-                write_setting('water_interval', val)
-                updated.append(f'喝水間隔 {val} 分鐘')
+            changes['water_interval'] = data['water_interval']
+            updated.append(f"喝水間隔 {data['water_interval']} 分鐘")
         
         if 'stand_interval' in data:
-            val = int(data['stand_interval'])
-            if 10 <= val <= 120:
-                write_setting('stand_interval', val)
-                updated.append(f'起身間隔 {val} 分鐘')
+            changes['stand_interval'] = data['stand_interval']
+            updated.append(f"起身間隔 {data['stand_interval']} 分鐘")
         
         if 'enabled' in data:
-            val = 'TRUE' if data['enabled'] else 'FALSE'
-            write_setting('enabled', val)
+            changes['enabled'] = bool(data['enabled'])
             updated.append('提醒 ' + ('開啟' if data['enabled'] else '關閉'))
         
         if 'dnd_start' in data and 'dnd_end' in data:
-            write_setting('dnd_start', data['dnd_start'])
-            write_setting('dnd_end', data['dnd_end'])
+            changes['dnd_start'] = data['dnd_start']
+            changes['dnd_end'] = data['dnd_end']
             updated.append(f"勿擾 {data['dnd_start']}-{data['dnd_end']}")
         
+        update_settings(changes)
         return jsonify({'success': True, 'updated': updated, 'message': '設定已更新'})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -2152,25 +4450,198 @@ def api_modify_stand():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# ===== 靜態資源 =====
+# 儀表板第一次用到時 render 一次，和 manifest、sw.js 一起預先壓好 gzip / brotli 並附強 ETag（沒變就回 304）；
+# 圖示依內容雜湊改名（/assets/icon-192.<hash>.png），可以 immutable 長期快取，內容一變網址就跟著變。
+# /api 的 JSON 超過 API_COMPRESS_MIN_BYTES 時依 Accept-Encoding 即時壓縮
+STATIC_IMMUTABLE = 'public, max-age=31536000, immutable'
+STATIC_REVALIDATE = 'no-cache'  # 每次都帶 ETag 回來確認
+FINGERPRINT_EXTS = ('.png',)
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/manifest+json')
+API_COMPRESS_MIN_BYTES = 1024
+API_GZIP_LEVEL = 6
+API_BROTLI_QUALITY = 5  # 即時壓縮用較快的等級，預先壓縮的靜態資源用最高等級
+_assets = {}
+_asset_urls = {}
+_assets_lock = new_lock()
+
+def gzip_bytes(data, level=9):
+    c = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return c.compress(data) + c.flush()
+
+class StaticAsset:
+    """一份靜態內容與預先壓縮好的版本（壓完沒變小的版本不留）"""
+
+    def __init__(self, body, mimetype, cache_control):
+        self.mimetype = mimetype
+        self.cache_control = cache_control
+        self.etag = hashlib.sha1(body).hexdigest()[:16]
+        self.variants = {'identity': body}
+        if mimetype.startswith(COMPRESSIBLE_TYPES):
+            packed = {'gzip': gzip_bytes(body)}
+            if brotli:
+                packed['br'] = brotli.compress(body, quality=11)
+            self.variants.update((k, v) for k, v in packed.items() if len(v) < len(body))
+
+def pick_encoding(available):
+    """依 Accept-Encoding 選 br > gzip > identity"""
+    for encoding in ('br', 'gzip'):
+        if encoding in available and request.accept_encodings[encoding] > 0:
+            return encoding
+    return 'identity'
+
+def asset_url(name):
+    """模板用：有指紋的網址（沒有的話退回原本的 /static 路徑）"""
+    return _asset_urls.get(name, f'/static/{name}')
+
+def load_assets():
+    """建立所有靜態資源（行程存活期間內容不變，改版要重新部署）"""
+    if _assets:
+        return _assets
+    with _assets_lock:
+        if _assets:
+            return _assets
+        built, static = {}, app.static_folder
+        for name in sorted(os.listdir(static)):
+            if name.endswith(FINGERPRINT_EXTS):
+                with open(os.path.join(static, name), 'rb') as f:
+                    asset = StaticAsset(f.read(), mimetypes.guess_type(name)[0] or 'application/octet-stream', STATIC_IMMUTABLE)
+                stem, ext = os.path.splitext(name)
+                hashed = f'{stem}.{asset.etag[:10]}{ext}'
+                built[hashed], _asset_urls[name] = asset, f'/assets/{hashed}'
+        for name, mimetype in (('manifest.json', 'application/manifest+json'), ('sw.js', 'application/javascript')):
+            with open(os.path.join(static, name), encoding='utf-8-sig') as f:
+                text = f.read()
+            for original, url in _asset_urls.items():
+                text = text.replace(f'/static/{original}', url)
+            built[name] = StaticAsset(text.encode('utf-8'), mimetype, STATIC_REVALIDATE)
+        with app.app_context():
+            html = render_template('dashboard.html', asset_url=asset_url)
+        built['dashboard'] = StaticAsset(html.encode('utf-8'), 'text/html', STATIC_REVALIDATE)
+        _assets.update(built)
+        sizes = {k: {e: len(v) for e, v in a.variants.items()} for k, a in built.items() if len(a.variants) > 1}
+        print(f"[Static] 預先壓縮完成 {sizes}")
+    return _assets
+
+def asset_response(asset):
+    """送出預先壓好的版本；If-None-Match 相符就只回 304"""
+    encoding = pick_encoding(asset.variants)
+    etag = asset.etag if encoding == 'identity' else f'{asset.etag}-{encoding}'
+    if request.if_none_match.contains_weak(etag):
+        resp = Response(status=304)
+    else:
+        resp = Response(asset.variants[encoding], mimetype=asset.mimetype)
+        if encoding != 'identity':
+            resp.headers['Content-Encoding'] = encoding
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = asset.cache_control
+    resp.vary.add('Accept-Encoding')
+    return resp
+
+@app.after_request
+def compress_api_response(response):
+    """較大的 /api JSON 回應即時壓縮（串流回應與已壓縮的不動）"""
+    if (not request.path.startswith('/api/') or response.is_streamed or response.direct_passthrough
+            or 'Content-Encoding' in response.headers or not response.mimetype.startswith(COMPRESSIBLE_TYPES)):
+        return response
+    body = response.get_data()
+    if len(body) < API_COMPRESS_MIN_BYTES:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = pick_encoding(('br', 'gzip') if brotli else ('gzip',))
+    if encoding == 'identity':
+        return response
+    response.set_data(brotli.compress(body, quality=API_BROTLI_QUALITY) if encoding == 'br' else gzip_bytes(body, API_GZIP_LEVEL))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
 @app.route('/dashboard')
 def dashboard():
-    return render_template('dashboard.html')
+    return asset_response(load_assets()['dashboard'])
 
 @app.route('/')
 def index():
-    return render_template('dashboard.html')
+    return asset_response(load_assets()['dashboard'])
 
 @app.route('/manifest.json')
 def manifest():
-    return app.send_static_file('manifest.json')
+    return asset_response(load_assets()['manifest.json'])
 
 @app.route('/sw.js')
 def service_worker():
-    return app.send_static_file('sw.js')
+    return asset_response(load_assets()['sw.js'])
+
+@app.route('/assets/<name>')
+def fingerprinted_asset(name):
+    """有指紋的靜態檔（內容變了網址就變，可永久快取）"""
+    asset = load_assets().get(name)
+    if asset is None or asset.cache_control != STATIC_IMMUTABLE:
+        abort(404)
+    return asset_response(asset)
+
+@app.route('/api/quota')
+def api_quota():
+    """Sheets 配額剩餘量與排隊狀況"""
+    return jsonify(sheets_governor.snapshot())
 
 @app.route('/health')
 def health():
-    return jsonify({'status': 'ok', 'service': 'neon-pulse-bot'})
+    return jsonify({'status': 'degraded' if sheets_breaker.is_open() else 'ok', 'service': 'neon-pulse-bot',
+                    'sheets': sheets_breaker.snapshot(), 'journal_pending': len(read_journal()),
+                    'startup': STARTUP_TIMINGS, 'budgets': budget_stats, 'projection': projection_status(),
+                    'admission': admission_snapshot()})
+
+# ===== 啟動 =====
+# WARMUP=1 時 worker 在開始接流量前先載入模組、授權、解析工作表並預熱快取（見 gunicorn.conf.py）
+STARTUP_TIMINGS = {'import_ms': 0, 'warmup_ms': {}, 'pid': os.getpid()}
+
+def warmup():
+    """預先付掉第一個請求的成本，每一步的耗時記在 STARTUP_TIMINGS"""
+    steps = (
+        ('imports', preload_imports),
+        ('authorize', get_gspread_client),
+        ('assets', load_assets),
+        ('worksheets', load_sheet_registry),
+        ('projection', get_projection),
+        ('cache_today', lambda: get_cached('today', read_today_stats)),
+        ('cache_week', lambda: get_cached('week', read_week_stats)),
+        ('cache_settings', read_settings),
+        ('report_jobs', resume_report_jobs),
+    )
+    timings = STARTUP_TIMINGS['warmup_ms']
+    set_sheets_priority(PRIORITY_INTERACTIVE)
+    for name, step in steps:
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            # warmup 失敗不影響啟動，第一個請求再重試
+            print(f"[Startup] warmup {name} 失敗: {e}")
+            timings[name] = None
+            continue
+        timings[name] = round((time.perf_counter() - start) * 1000, 1)
+    print(f"[Startup] import {STARTUP_TIMINGS['import_ms']}ms, warmup {timings}")
+    return timings
+
+def _reinit_after_fork():
+    """gunicorn --preload 時 worker 由 master fork 出來，連線與鎖不能跟 master 共用"""
+    global _gspread_client, _prefetch_pool, sheets_governor, _refresh_pending
+    for lock in _fork_locks:
+        lock._at_fork_reinit()  # 和標準庫 threading / logging 在 fork 後重設自己的鎖用的是同一個方法
+    _inflight.clear()
+    _fetch_seq.clear()
+    _refresh_pending = False  # master 的延遲重算執行緒不會跟著 fork 過來
+    sheets_governor = QuotaGovernor(SHEETS_READ_PER_MIN, SHEETS_WRITE_PER_MIN)  # 連同排隊狀態整個換新
+    _prefetch_pool = None  # master 的執行緒不會跟著 fork 過來
+    if _gspread_client is not None:
+        # 沿用憑證（含 token），但換一個新的 HTTP session，避免多個行程共用同一條連線
+        _gspread_client = _gspread_client.__class__(_gspread_client.auth)
+        _gspread_client.set_timeout(SHEETS_TIMEOUT)
+    reset_sheet_registry()
+    STARTUP_TIMINGS['pid'] = os.getpid()
+
+os.register_at_fork(after_in_child=_reinit_after_fork)
+STARTUP_TIMINGS['import_ms'] = round((time.perf_counter() - _IMPORT_START) * 1000, 1)
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5000)), debug=False)
@@ -0,0 +1,145 @@
+"""
+⚡ Neon Pulse 事件紀錄與投影
+寫入一律是 append 一筆領域事件（WaterLogged、CountCorrected、ExerciseDeleted…），不改舊資料；
+Projection 依序套用事件，維護每日統計與設定，可整份轉成 dict 存快照。純資料結構，不碰 Sheets
+"""
+
+import json
+import uuid
+
+# 各紀錄表對應的事件與欄位（第一欄固定是時間）
+LOG_EVENTS = {
+    'water_log': ('WaterLogged', ()),
+    'stand_log': ('StandLogged', ()),
+    'exercise_log': ('ExerciseLogged', ('type', 'minutes', 'calories')),
+    'eye_log': ('EyeLogged', ('status',)),
+    'weight_log': ('WeightLogged', ('weight',)),
+    'sleep_log': ('SleepLogged', ('hours', 'quality', 'note')),
+    'meal_log': ('MealLogged', ('meal', 'foods', 'calories', 'note')),
+    'mood_log': ('MoodLogged', ('mood', 'score', 'note')),
+}
+
+EVENT_HEADERS = ['時間', '類型', '資料', 'ID']
+
+
+def new_event(kind, time, data=None):
+    return {'id': uuid.uuid4().hex[:12], 'time': time, 'type': kind, 'data': data or {}}
+
+
+def from_log_row(sheet_name, row):
+    """紀錄表的一列 → 對應的事件"""
+    kind, fields = LOG_EVENTS[sheet_name]
+    return new_event(kind, str(row[0]), dict(zip(fields, row[1:])))
+
+
+def to_row(event):
+    return [event['time'], event['type'], json.dumps(event['data'], ensure_ascii=False), event['id']]
+
+
+def from_row(row):
+    """事件表的一列 → 事件；格式不對回傳 None"""
+    try:
+        return {'time': row[0], 'type': row[1], 'data': json.loads(row[2] or '{}'), 'id': row[3]}
+    except (IndexError, ValueError):
+        return None
+
+
+def _num(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def empty_day():
+    return {'water': 0, 'stand': 0, 'exercise_minutes': 0, 'exercise_calories': 0,
+            'exercises': [], 'eye_completed': 0, 'eye_ignored': 0}
+
+
+class Projection:
+    """每日統計（days）與設定的投影；offset 為已讀到的事件表列數，pending 為本機已套用、尚未在尾端讀到的事件 ID"""
+
+    def __init__(self, offset=0):
+        self.days = {}
+        self.settings = {}
+        self.offset = offset
+        self.pending = set()
+        self.applied = 0
+
+    def day(self, date):
+        return self.days.setdefault(date, empty_day())
+
+    def apply_rows(self, rows):
+        """依序套用事件表尾端的列，回傳實際套用的筆數"""
+        applied = 0
+        for row in rows:
+            self.offset += 1
+            event = from_row(row)
+            if event is None:
+                continue
+            if event['id'] in self.pending:
+                self.pending.discard(event['id'])
+                continue
+            self.apply(event)
+            applied += 1
+        return applied
+
+    def apply(self, event):
+        handler = getattr(self, f"_on_{event['type']}", None)
+        if handler:
+            handler(event['time'][:10], event['time'], event['data'])
+        self.applied += 1
+
+    def _on_WaterLogged(self, date, at, data):
+        self.day(date)['water'] += 1
+
+    def _on_StandLogged(self, date, at, data):
+        self.day(date)['stand'] += 1
+
+    def _on_CountCorrected(self, date, at, data):
+        self.day(data.get('date', date))[data['log']] = int(data['count'])
+
+    def _on_ExerciseLogged(self, date, at, data):
+        d = self.day(date)
+        minutes, calories = int(_num(data.get('minutes'))), int(_num(data.get('calories')))
+        d['exercises'].append([at, data.get('type', ''), minutes, calories])
+        d['exercise_minutes'] += minutes
+        d['exercise_calories'] += calories
+
+    def _remove_exercise(self, d, entry):
+        d['exercises'].remove(entry)
+        d['exercise_minutes'] -= entry[2]
+        d['exercise_calories'] -= entry[3]
+
+    def _on_ExerciseDeleted(self, date, at, data):
+        d = self.day(data.get('date', date))
+        matches = [e for e in d['exercises'] if e[0] == data.get('at')]
+        if not matches:
+            print(f"[Events] 找不到要刪除的運動 {data.get('date', date)} {data.get('at')}，略過")
+            return
+        self._remove_exercise(d, matches[-1])
+
+    def _on_ExercisesCleared(self, date, at, data):
+        d = self.day(data.get('date', date))
+        for entry in list(d['exercises']):
+            self._remove_exercise(d, entry)
+
+    def _on_EyeLogged(self, date, at, data):
+        if data.get('status') in ('completed', 'ignored'):
+            self.day(date)[f"eye_{data['status']}"] += 1
+
+    def _on_GoalChanged(self, date, at, data):
+        self.settings[data['key']] = data['value']
+
+    _on_SettingChanged = _on_GoalChanged
+
+    def to_dict(self):
+        return {'offset': self.offset, 'pending': sorted(self.pending), 'days': self.days, 'settings': self.settings}
+
+    @classmethod
+    def from_dict(cls, data):
+        p = cls(data['offset'])
+        p.pending = set(data.get('pending', ()))
+        p.days = data.get('days', {})
+        p.settings = data.get('settings', {})
+        return p
@@ -8,11 +8,15 @@
  *    - LINE_CHANNEL_ACCESS_TOKEN: LINE Bot 的 Channel Access Token
  *    - LINE_USER_ID: 你的 LINE User ID
  *    - SPREADSHEET_ID: Google Sheet 的 ID
+ *    - APP_URL: Railway 網址（選用，封存舊紀錄用，例如 https://xxx.railway.app）
  * 4. 設定觸發器 (觸發條件 > 新增觸發器):
  *    - 選擇函式: checkAndSendReminders
  *    - 選擇活動來源: 時間驅動
  *    - 選擇時間型觸發器類型: 分鐘計時器
  *    - 選擇間隔: 每 5 分鐘 或 每 10 分鐘
+ * 5. (選用) 新增觸發器: archiveOldLogs，時間驅動 > 日計時器 > 凌晨 3-4 點
+ * 6. (選用) 新增觸發器: prepareDailyReport，時間驅動 > 日計時器 > 每日總結推播前的那個小時
+ *    （例如 21-22 點預先計算，22 點後再呼叫 /api/daily-report，推播時就只剩送出）
  */
 
 // ===== 設定 =====
@@ -21,7 +25,8 @@ function getConfig() {
   return {
     LINE_TOKEN: props.getProperty('LINE_CHANNEL_ACCESS_TOKEN'),
     USER_ID: props.getProperty('LINE_USER_ID'),
-    SPREADSHEET_ID: props.getProperty('SPREADSHEET_ID')
+    SPREADSHEET_ID: props.getProperty('SPREADSHEET_ID'),
+    APP_URL: props.getProperty('APP_URL')
   };
 }
 
@@ -264,6 +269,48 @@ function sendLineMessage(token, userId, message) {
   }
 }
 
+// ===== 封存舊紀錄（每日一次）=====
+function archiveOldLogs() {
+  const config = getConfig();
+  if (!config.APP_URL) {
+    console.log('未設定 APP_URL，略過封存');
+    return;
+  }
+  
+  try {
+    const response = UrlFetchApp.fetch(config.APP_URL + '/api/archive', {
+      method: 'post',
+      contentType: 'application/json',
+      payload: '{}',
+      muteHttpExceptions: true
+    });
+    console.log('封存結果:', response.getResponseCode(), response.getContentText());
+  } catch (e) {
+    console.error('封存失敗:', e);
+  }
+}
+
+// ===== 預先計算報表（推播前呼叫）=====
+function prepareDailyReport() {
+  const config = getConfig();
+  if (!config.APP_URL) {
+    console.log('未設定 APP_URL，略過預先計算');
+    return;
+  }
+  
+  try {
+    const response = UrlFetchApp.fetch(config.APP_URL + '/api/daily-report/prepare', {
+      method: 'post',
+      contentType: 'application/json',
+      payload: '{}',
+      muteHttpExceptions: true
+    });
+    console.log('預先計算:', response.getResponseCode(), response.getContentText());
+  } catch (e) {
+    console.error('預先計算失敗:', e);
+  }
+}
+
 // ===== 測試函式 =====
 function testWaterReminder() {
   const config = getConfig();
@@ -0,0 +1,32 @@
+"""
+gunicorn 設定（gunicorn 啟動時會自動讀取目前目錄的 gunicorn.conf.py）
+
+PRELOAD=1             master 先載入 app 與延遲模組再 fork，worker 直接共用
+WARMUP=0              關閉 worker 接流量前的預熱（授權、解析工作表、預熱快取）
+WORKER_CLASS=gevent   改用 greenlet worker，一個 worker 可同時處理多個在等 Sheets / LINE / AI 的請求
+WORKER_CONNECTIONS    gevent 模式下每個 worker 的同時連線上限（預設 100）
+"""
+
+import os
+
+preload_app = os.environ.get('PRELOAD', '0') == '1'
+worker_class = os.environ.get('WORKER_CLASS', 'sync')
+
+if worker_class == 'gevent':
+    # 必須在 import app 之前 patch：模組層的鎖、requests 連線、背景執行緒才會是 greenlet 版本
+    from gevent import monkey
+    monkey.patch_all()
+    worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 100))
+
+
+def when_ready(server):
+    # preload 時 master 已載入 app，順便把 linebot / gspread / numpy 也載好，fork 後共用記憶體
+    if server.cfg.preload_app:
+        import app
+        app.preload_imports()
+
+
+def post_worker_init(worker):
+    if os.environ.get('WARMUP', '1') == '1':
+        import app
+        app.warmup()
@@ -0,0 +1,128 @@
+"""
+⚡ Neon Pulse 紀錄欄式儲存
+每種紀錄一份：時間為 array('q')（當地時間的 epoch 秒），數值欄為 array('d')，類別欄以 array('H') 編碼，
+自由文字欄（例如食物）為一般 list；依時間排序，日期區間用二分搜尋。純資料結構，不碰 Sheets
+"""
+
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+EPOCH = datetime(1970, 1, 1)
+DAY = 86400
+
+
+def to_ts(text):
+    """'YYYY-MM-DD[ HH:MM:SS]' → epoch 秒（牆上時間直接當 UTC 算，日界線與字串前綴比對一致）"""
+    return int((datetime.fromisoformat(text.strip()[:19]) - EPOCH).total_seconds())
+
+
+def to_text(ts):
+    """epoch 秒 → 'YYYY-MM-DD HH:MM:SS'"""
+    return (EPOCH + timedelta(seconds=ts)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def day_text(day):
+    """自 1970-01-01 起的天數 → 'YYYY-MM-DD'"""
+    return (EPOCH + timedelta(days=day)).strftime('%Y-%m-%d')
+
+
+def day_bounds(start_date, end_date=None):
+    """日期區間（含頭尾）→ [起始秒, 結束秒)；'0000-01-01' 之類的下限視為最早"""
+    return to_ts(max(start_date, '0001-01-01')), to_ts(end_date or start_date) + DAY
+
+
+class LogColumns:
+    """一種紀錄的欄式儲存；columns 為 {欄名: (原始欄位索引, 'num' / 'cat' / 'text', 預設值)}"""
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.ts = array('q')
+        self.nums = {k: array('d') for k, (_, kind, _) in columns.items() if kind == 'num'}
+        self.cats = {k: array('H') for k, (_, kind, _) in columns.items() if kind == 'cat'}
+        self.texts = {k: [] for k, (_, kind, _) in columns.items() if kind == 'text'}
+        self.vocab = {k: [] for k in self.cats}
+        self._codes = {k: {} for k in self.cats}
+        self._sorted = True
+
+    @classmethod
+    def from_rows(cls, rows, columns):
+        store = cls(columns)
+        for row in rows:
+            store.append(row)
+        return store
+
+    def __len__(self):
+        return len(self.ts)
+
+    def append(self, row):
+        """加入一列（get_all_values 的字串列），時間格式不對就略過，回傳是否加入"""
+        try:
+            ts = to_ts(row[0])
+        except (IndexError, ValueError):
+            return False
+        if self.ts and ts < self.ts[-1]:
+            self._sorted = False
+        self.ts.append(ts)
+        for k, (i, kind, default) in self.columns.items():
+            cell = row[i] if len(row) > i else ''
+            if kind == 'num':
+                try:
+                    self.nums[k].append(float(cell) if cell != '' else default)
+                except ValueError:
+                    self.nums[k].append(default)
+            elif kind == 'text':
+                self.texts[k].append(cell or default)
+            else:
+                codes = self._codes[k]
+                if cell not in codes:
+                    codes[cell] = len(self.vocab[k])
+                    self.vocab[k].append(cell)
+                self.cats[k].append(codes[cell])
+        return True
+
+    def _ensure_sorted(self):
+        # 匯入或手動補登的舊紀錄可能不在尾端，查詢前依時間重排一次
+        if self._sorted:
+            return
+        order = sorted(range(len(self.ts)), key=self.ts.__getitem__)
+        self.ts = array('q', (self.ts[i] for i in order))
+        for k, col in self.nums.items():
+            self.nums[k] = array('d', (col[i] for i in order))
+        for k, col in self.cats.items():
+            self.cats[k] = array('H', (col[i] for i in order))
+        for k, col in self.texts.items():
+            self.texts[k] = [col[i] for i in order]
+        self._sorted = True
+
+    def span(self, start, end):
+        """[start, end) 秒內的列索引範圍"""
+        self._ensure_sorted()
+        return range(bisect_left(self.ts, start), bisect_left(self.ts, end))
+
+    def count(self, start, end):
+        return len(self.span(start, end))
+
+    def values(self, name, rows):
+        """某欄在 rows 範圍的值（類別欄還原成字串）"""
+        if name in self.nums:
+            return self.nums[name][rows.start:rows.stop].tolist()
+        if name in self.texts:
+            return self.texts[name][rows.start:rows.stop]
+        vocab = self.vocab[name]
+        return [vocab[c] for c in self.cats[name][rows.start:rows.stop]]
+
+    def per_day(self, start, end, name=None):
+        """[start, end) 內每天的筆數（name 為數值欄時改為加總），key 為自 1970-01-01 起的天數"""
+        rows = self.span(start, end)
+        col = self.nums[name] if name else None
+        out = {}
+        for i in rows:
+            d = self.ts[i] // DAY
+            out[d] = out.get(d, 0) + (col[i] if col is not None else 1)
+        return out
+
+    def nbytes(self):
+        """欄位陣列佔用的位元組數（不含類別字典與文字欄）"""
+        arrays = [self.ts, *self.nums.values(), *self.cats.values()]
+        return sum(a.itemsize * len(a) for a in arrays)
@@ -0,0 +1,130 @@
+"""
+⚡ 並行吞吐 benchmark：sync worker vs gevent worker
+
+以 gunicorn 實際啟動 app（Sheets 以假物件取代，每次呼叫 sleep 模擬延遲、快取關閉），
+用多條連線同時打 dashboard API，比較不同 worker 的吞吐量與延遲。
+
+用法：
+    python tools/bench_concurrency.py --clients 32 --duration 10
+    python tools/bench_concurrency.py --modes sync,gevent --sheets-latency-ms 200
+"""
+
+import argparse
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+
+
+def build_app():
+    """gunicorn 入口：app 換上假 Sheets，並關閉資料快取讓每個請求都打到 Sheets"""
+    import app as bot
+    from fakes import build_spreadsheet, install
+    latency = float(os.environ.get('BENCH_SHEETS_LATENCY_MS', 100)) / 1000
+    install(bot, build_spreadsheet(history_days=30, latency=latency, tz=bot.TZ))
+    bot.DATA_CACHE_TTL = 0
+    return bot.app
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            conn.request('GET', '/health')
+            conn.getresponse().read()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(len(sorted_values) * p / 100), len(sorted_values) - 1)]
+
+
+def run_mode(mode, args):
+    port = free_port()
+    tmp = tempfile.mkdtemp()
+    env = dict(os.environ, WORKER_CLASS=mode, WARMUP='0', BENCH_SHEETS_LATENCY_MS=str(args.sheets_latency_ms),
+               LINE_CHANNEL_SECRET=os.environ.get('LINE_CHANNEL_SECRET', 'bench-secret'),
+               SNAPSHOT_PATH=os.path.join(tmp, 'snapshot.json'), JOURNAL_PATH=os.path.join(tmp, 'journal.jsonl'))
+    cmd = [sys.executable, '-m', 'gunicorn', 'bench_concurrency:build_app()', '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+           '--pythonpath', f'{ROOT},{TOOLS}', '--bind', f'127.0.0.1:{port}', '--workers', str(args.workers),
+           '--log-level', 'warning']
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_ready(port):
+            raise RuntimeError(f'{mode} worker 沒有在時間內啟動')
+        paths = [p.strip() for p in args.paths.split(',') if p.strip()]
+        latencies, errors = [], [0]
+        lock = threading.Lock()
+        stop = time.perf_counter() + args.duration
+
+        def client(i):
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            n = i
+            while time.perf_counter() < stop:
+                t0 = time.perf_counter()
+                try:
+                    conn.request('GET', paths[n % len(paths)])
+                    resp = conn.getresponse()
+                    resp.read()
+                    ok = resp.status == 200
+                except OSError:
+                    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+                    ok = False
+                with lock:
+                    latencies.append(time.perf_counter() - t0)
+                    if not ok:
+                        errors[0] += 1
+                n += 1
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall = time.perf_counter() - start
+        latencies.sort()
+        return {'requests': len(latencies), 'rps': len(latencies) / wall, 'errors': errors[0],
+                'p50': percentile(latencies, 50) * 1000, 'p95': percentile(latencies, 95) * 1000}
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def main():
+    p = argparse.ArgumentParser(description='sync / gevent worker 並行吞吐比較')
+    p.add_argument('--modes', default='sync,gevent', help='要比較的 worker class')
+    p.add_argument('--workers', type=int, default=1, help='gunicorn worker 數')
+    p.add_argument('--clients', type=int, default=16, help='同時連線數')
+    p.add_argument('--duration', type=float, default=5, help='每種模式持續秒數')
+    p.add_argument('--sheets-latency-ms', type=float, default=100, help='模擬每次 Sheets API 延遲')
+    p.add_argument('--paths', default='/api/today,/api/week,/api/settings', help='輪流打的路徑')
+    args = p.parse_args()
+
+    print(f"{'worker':<10}{'請求':>7}{'吞吐/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'錯誤':>6}")
+    for mode in args.modes.split(','):
+        r = run_mode(mode.strip(), args)
+        print(f"{mode:<10}{r['requests']:>7}{r['rps']:>9.1f}{r['p50']:>9.1f}{r['p95']:>9.1f}{r['errors']:>6}")
+
+
+if __name__ == '__main__':
+    main()
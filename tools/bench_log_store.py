@@ -0,0 +1,110 @@
+"""
+⚡ 紀錄欄式儲存 benchmark
+
+比較 get_all_values 的 list[list[str]] 與 logstore.LogColumns：
+  - 每 10 萬列的記憶體（tracemalloc）
+  - 轉換成欄式儲存的耗時
+  - 查詢耗時：今日筆數、今日運動加總、最近 30 天每日加總（字串前綴掃描 vs 二分搜尋）
+
+用法：
+    python tools/bench_log_store.py --rows 100000 --repeat 200
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logstore  # noqa: E402
+
+EXERCISE_COLUMNS = {'type': (1, 'cat', ''), 'minutes': (2, 'num', 0.0), 'calories': (3, 'num', 0.0)}
+TYPES = ['跑步', '走路', '游泳', '騎車', '重訓', '瑜伽']
+
+
+def make_rows(n, end):
+    """產生 n 列運動紀錄（每 15 分鐘一筆，最後一筆在 end）"""
+    start = end - timedelta(minutes=15 * (n - 1))
+    rows = []
+    for i in range(n):
+        t = start + timedelta(minutes=15 * i)
+        minutes = 10 + i % 50
+        rows.append([t.strftime('%Y-%m-%d %H:%M:%S'), TYPES[i % len(TYPES)], str(minutes), str(minutes * 8)])
+    return rows
+
+
+def measure(build):
+    """建立物件並回傳 (物件, 佔用位元組)"""
+    tracemalloc.start()
+    obj = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return obj, size
+
+
+def bench(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+def main():
+    p = argparse.ArgumentParser(description='紀錄欄式儲存 benchmark')
+    p.add_argument('--rows', type=int, default=100000, help='列數')
+    p.add_argument('--repeat', type=int, default=100, help='每個查詢重複次數（取平均）')
+    args = p.parse_args()
+
+    end = datetime(2025, 6, 30, 22, 0, 0)
+    today = end.strftime('%Y-%m-%d')
+    since = (end - timedelta(days=29)).strftime('%Y-%m-%d')
+
+    rows, list_bytes = measure(lambda: make_rows(args.rows, end))
+    cols, col_bytes = measure(lambda: logstore.LogColumns.from_rows(rows, EXERCISE_COLUMNS))
+    build_ms, _ = bench(lambda: logstore.LogColumns.from_rows(rows, EXERCISE_COLUMNS), 1)
+    per = 100000 / args.rows
+
+    print(f"列數 {args.rows:,}（運動紀錄 4 欄）")
+    print(f"{'表示法':<14}{'記憶體/10萬列':>14}")
+    print(f"{'list[list[str]]':<14}{list_bytes * per / 1e6:>12.1f}MB")
+    print(f"{'LogColumns':<14}{col_bytes * per / 1e6:>12.1f}MB   （陣列本身 {cols.nbytes() * per / 1e6:.1f}MB，轉換 {build_ms:.0f}ms）")
+
+    lo, hi = logstore.day_bounds(today)
+    range_lo, range_hi = logstore.day_bounds(since, today)
+
+    def list_today_count():
+        return sum(1 for r in rows if r and r[0].startswith(today))
+
+    def list_today_minutes():
+        return sum(int(r[2]) for r in rows if r and r[0].startswith(today) and r[2].isdigit())
+
+    def list_month_daily():
+        out, end_key = {}, today + ' 23:59:59'
+        for r in rows:
+            if r and since <= r[0] <= end_key and r[2].isdigit():
+                out[r[0][:10]] = out.get(r[0][:10], 0) + int(r[2])
+        return out
+
+    def col_month_daily():
+        return {logstore.day_text(d): int(v) for d, v in cols.per_day(range_lo, range_hi, 'minutes').items()}
+
+    queries = (
+        ('今日筆數', list_today_count, lambda: cols.count(lo, hi)),
+        ('今日運動分鐘', list_today_minutes, lambda: int(sum(cols.values('minutes', cols.span(lo, hi))))),
+        ('30 天每日加總', list_month_daily, col_month_daily),
+    )
+    print(f"\n{'查詢':<12}{'list ms':>10}{'columns ms':>12}{'加速':>8}")
+    for name, slow, fast in queries:
+        slow_ms, expected = bench(slow, args.repeat)
+        fast_ms, got = bench(fast, args.repeat)
+        if expected != got:
+            print(f"[BenchLogStore] {name} 結果不一致: {expected!r} != {got!r}")
+            sys.exit(1)
+        print(f"{name:<12}{slow_ms:>10.3f}{fast_ms:>12.4f}{slow_ms / max(fast_ms, 1e-9):>7.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+⚡ 冷啟動 benchmark
+
+每一輪都開新的 Python 行程，量測：
+  - import app 耗時（STARTUP_TIMINGS['import_ms']）與整個行程啟動耗時
+  - warmup 各步驟耗時（Sheets 以假物件取代，可設定模擬延遲）
+  - 第一個 /api/today 請求的延遲（有無 warmup）
+
+用法：
+    python tools/bench_startup.py --runs 5
+    python tools/bench_startup.py --importtime 15
+    python tools/bench_startup.py --max-import-ms 800   # 超過就以 exit code 1 結束，方便在 CI 抓退步
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r'''
+import json, os, sys, time
+t0 = time.perf_counter()
+sys.path.insert(0, {root!r}); sys.path.insert(0, os.path.join({root!r}, 'tools'))
+import app as bot
+from fakes import build_spreadsheet, install
+result = {{'import_ms': bot.STARTUP_TIMINGS['import_ms']}}
+install(bot, build_spreadsheet(history_days={history_days}, latency={latency}, tz=bot.TZ))
+if {warmup}:
+    start = time.perf_counter()
+    result['warmup'] = bot.warmup()
+    result['warmup_ms'] = (time.perf_counter() - start) * 1000
+start = time.perf_counter()
+bot.app.test_client().get('/api/today')
+result['first_request_ms'] = (time.perf_counter() - start) * 1000
+print(json.dumps(result))
+'''
+
+
+def run_child(warmup, args):
+    env = dict(os.environ, LINE_CHANNEL_SECRET=os.environ.get('LINE_CHANNEL_SECRET', 'bench-secret'))
+    code = CHILD.format(root=ROOT, history_days=args.history_days, latency=args.sheets_latency_ms / 1000, warmup=warmup)
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True).stdout
+    result = json.loads(out.strip().splitlines()[-1])
+    result['process_ms'] = (time.perf_counter() - start) * 1000
+    return result
+
+
+def print_importtime(top):
+    """用 python -X importtime 列出最慢的模組（累計時間）"""
+    env = dict(os.environ, LINE_CHANNEL_SECRET='bench-secret')
+    err = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=ROOT, env=env,
+                         capture_output=True, text=True).stderr
+    rows = []
+    for line in err.splitlines():
+        parts = line.replace('import time:', '').split('|')
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue
+        rows.append((int(parts[1]), parts[2].rstrip()))
+    rows.sort(reverse=True)
+    print(f"\n{'累計 ms':>9}  模組")
+    for cumulative, name in rows[:top]:
+        print(f"{cumulative / 1000:>9.1f}  {name}")
+
+
+def main():
+    p = argparse.ArgumentParser(description='冷啟動 benchmark')
+    p.add_argument('--runs', type=int, default=3, help='每種模式跑幾次（取中位數）')
+    p.add_argument('--sheets-latency-ms', type=float, default=50, help='模擬每次 Sheets API 延遲')
+    p.add_argument('--history-days', type=int, default=90, help='預先填入的歷史天數')
+    p.add_argument('--importtime', type=int, default=0, metavar='N', help='另外列出最慢的 N 個模組')
+    p.add_argument('--max-import-ms', type=float, default=0, help='import app 中位數超過此值時 exit 1')
+    args = p.parse_args()
+
+    modes = {'cold': [run_child(False, args) for _ in range(args.runs)],
+             'warmup': [run_child(True, args) for _ in range(args.runs)]}
+
+    def med(results, key):
+        values = [r[key] for r in results if r.get(key) is not None]
+        return statistics.median(values) if values else 0.0
+
+    print(f"{'模式':<8}{'import ms':>11}{'行程 ms':>10}{'warmup ms':>11}{'首個請求 ms':>13}")
+    for mode, results in modes.items():
+        print(f"{mode:<8}{med(results, 'import_ms'):>11.1f}{med(results, 'process_ms'):>10.1f}"
+              f"{med(results, 'warmup_ms'):>11.1f}{med(results, 'first_request_ms'):>13.1f}")
+    steps = modes['warmup'][-1].get('warmup') or {}
+    print('\nwarmup 各步驟 (ms): ' + ', '.join(f'{k}={v}' for k, v in steps.items()))
+
+    if args.importtime:
+        print_importtime(args.importtime)
+
+    import_ms = statistics.median(r['import_ms'] for r in modes['cold'])
+    if args.max_import_ms and import_ms > args.max_import_ms:
+        print(f"\n[BenchStartup] import app {import_ms:.1f}ms 超過上限 {args.max_import_ms}ms")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+⚡ 喝水 / 起身寫入路徑 benchmark
+
+比較「每次點擊先讀整張表再 append」的舊做法與記憶體狀態的新做法（write_water），
+在不同歷史長度下的單次點擊延遲與 Sheets 呼叫次數。假 Sheets 的讀取延遲會隨列數增加。
+
+用法：
+    python tools/bench_write_path.py
+    python tools/bench_write_path.py --history-days 30,365,1825 --taps 20 --row-latency-us 20
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('LINE_CHANNEL_SECRET', 'bench-secret')
+
+
+def legacy_write_water(bot):
+    """舊做法：讀整張表找今日筆數與最後時間，再 append"""
+    today = bot.get_today()
+    now = datetime.now(bot.TZ)
+    sheet = bot.get_sheet('water_log')
+    data = sheet.get_all_values()[1:]
+    today_records = [r for r in data if r and r[0].startswith(today)]
+    if today_records:
+        last = datetime.strptime(today_records[-1][0], '%Y-%m-%d %H:%M:%S').replace(tzinfo=bot.TZ)
+        if (now - last).total_seconds() < bot.TAP_DEDUP_SECONDS:
+            return len(today_records)
+    sheet.append_row([bot.get_now()])
+    bot.clear_cache()
+    return len(today_records) + 1
+
+
+def measure(ss, write, taps):
+    """連續點擊 taps 次，回傳每次延遲與平均每次的 Sheets 呼叫數"""
+    latencies = []
+    calls_before = ss.calls
+    for _ in range(taps):
+        t0 = time.perf_counter()
+        write()
+        latencies.append(time.perf_counter() - t0)
+    return latencies, (ss.calls - calls_before) / taps
+
+
+def main():
+    p = argparse.ArgumentParser(description='喝水 / 起身寫入路徑 benchmark')
+    p.add_argument('--history-days', default='30,365,1825', help='歷史天數（逗號分隔）')
+    p.add_argument('--taps', type=int, default=20, help='每種情境點擊次數')
+    p.add_argument('--sheets-latency-ms', type=float, default=50, help='每次 Sheets API 固定延遲')
+    p.add_argument('--row-latency-us', type=float, default=20, help='讀取時每列增加的延遲（微秒）')
+    args = p.parse_args()
+
+    import app as bot
+    from fakes import build_spreadsheet, install
+    bot.TAP_DEDUP_SECONDS = 0  # 連續點擊都要寫入
+
+    print(f"{'歷史天數':<10}{'列數':>8}{'舊 p50 ms':>11}{'新 p50 ms':>11}{'新 首次 ms':>12}{'舊 呼叫/次':>12}{'新 呼叫/次':>12}")
+    for days in [int(d) for d in args.history_days.split(',')]:
+        ss = build_spreadsheet(history_days=days, latency=args.sheets_latency_ms / 1000, tz=bot.TZ,
+                               row_latency=args.row_latency_us / 1e6)
+        install(bot, ss)
+        bot.reset_tap_state()
+        bot.get_sheet('water_log')  # 先載入工作表清單，不算在點擊裡
+        rows = len(ss.worksheet('water_log')._rows)
+
+        old, old_calls = measure(ss, lambda: legacy_write_water(bot), args.taps)
+        bot.reset_tap_state()
+        new, new_calls = measure(ss, bot.write_water, args.taps)
+        print(f"{days:<10}{rows:>8}{statistics.median(old) * 1000:>11.1f}{statistics.median(new[1:]) * 1000:>11.1f}"
+              f"{new[0] * 1000:>12.1f}{old_calls:>12.1f}{new_calls:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
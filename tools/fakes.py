@@ -0,0 +1,280 @@
+"""
+本機測試用的假 Google Sheets / LINE Messaging API
+讓壓測與 benchmark 可以在沒有網路、沒有憑證的情況下驅動 app.py
+"""
+
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+class FakeWorksheet:
+    """模擬 gspread.Worksheet（只實作 app.py 用到的方法）"""
+
+    def __init__(self, spreadsheet, title, rows=None):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.id = abs(hash(title)) % 100000
+        self._rows = [list(r) for r in (rows or [])]
+        self._lock = threading.Lock()
+
+    def _call(self, rows=0):
+        self.spreadsheet.calls += 1
+        delay = self.spreadsheet.latency + self.spreadsheet.row_latency * rows
+        if delay:
+            time.sleep(delay)
+
+    def get_all_values(self):
+        self._call(len(self._rows))
+        with self._lock:
+            return [list(r) for r in self._rows]
+
+    def get_all_records(self):
+        values = self.get_all_values()
+        if not values:
+            return []
+        headers = values[0]
+        return [{h: _coerce(v) for h, v in zip(headers, row)} for row in values[1:]]
+
+    def row_values(self, row):
+        self._call()
+        with self._lock:
+            return list(self._rows[row - 1]) if row <= len(self._rows) else []
+
+    def get(self, range_name=None):
+        """只支援 A{start}:{col}{end} 形式的列範圍"""
+        start, end = _parse_row_range(range_name)
+        self._call(max(min(end, len(self._rows)) - start + 1, 0))
+        with self._lock:
+            rows = [list(r) for r in self._rows[start - 1:end]]
+        while rows and not any(rows[-1]):  # 和 Sheets API 一樣不回傳尾端的空白列
+            rows.pop()
+        return rows
+
+    def col_values(self, col):
+        self._call(len(self._rows))
+        with self._lock:
+            values = [r[col - 1] if len(r) >= col else '' for r in self._rows]
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def append_row(self, values, **kwargs):
+        self._call()
+        with self._lock:
+            self._rows.append([str(v) for v in values])
+
+    def append_rows(self, values, **kwargs):
+        self._call()
+        with self._lock:
+            self._rows.extend([str(v) for v in row] for row in values)
+
+    def update_cell(self, row, col, value):
+        self._call()
+        with self._lock:
+            while len(self._rows) < row:
+                self._rows.append([])
+            r = self._rows[row - 1]
+            while len(r) < col:
+                r.append('')
+            r[col - 1] = str(value)
+
+    def update(self, range_name, values=None, **kwargs):
+        """只支援從 A1 開始的整塊覆寫"""
+        self._call()
+        with self._lock:
+            for i, row in enumerate(values or []):
+                while len(self._rows) <= i:
+                    self._rows.append([])
+                self._rows[i] = [str(v) for v in row] + self._rows[i][len(row):]
+
+    def batch_update(self, data, **kwargs):
+        """只支援單一儲存格的範圍（例如 B2）"""
+        self._call()
+        for item in data:
+            row, col = _parse_cell(item['range'])
+            with self._lock:
+                while len(self._rows) < row:
+                    self._rows.append([])
+                r = self._rows[row - 1]
+                while len(r) < col:
+                    r.append('')
+                r[col - 1] = str(item['values'][0][0])
+
+    def delete_rows(self, start_index, end_index=None):
+        self._call()
+        end_index = end_index or start_index
+        with self._lock:
+            del self._rows[start_index - 1:end_index]
+
+    @property
+    def row_count(self):
+        return len(self._rows)
+
+
+class FakeSpreadsheet:
+    """模擬 gspread.Spreadsheet，latency 為每次 API 呼叫的模擬延遲，row_latency 為讀取時每列再多的延遲（秒）"""
+
+    def __init__(self, latency=0.0, row_latency=0.0):
+        self.latency = latency
+        self.row_latency = row_latency
+        self.calls = 0
+        self._sheets = {}
+        self._lock = threading.Lock()
+
+    def worksheet(self, title):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            if title not in self._sheets:
+                import gspread
+                raise gspread.exceptions.WorksheetNotFound(title)
+            return self._sheets[title]
+
+    def worksheets(self):
+        self.calls += 1
+        with self._lock:
+            return list(self._sheets.values())
+
+    def add_worksheet(self, title, rows=1000, cols=26, index=None):
+        self.calls += 1
+        with self._lock:
+            ws = self._sheets.setdefault(title, FakeWorksheet(self, title))
+            return ws
+
+    def seed(self, title, rows):
+        with self._lock:
+            self._sheets[title] = FakeWorksheet(self, title, rows)
+        return self._sheets[title]
+
+
+class FakeClient:
+    """模擬 gspread.Client"""
+
+    def __init__(self, spreadsheet):
+        self.spreadsheet = spreadsheet
+
+    def open_by_key(self, key):
+        self.spreadsheet.calls += 1
+        if self.spreadsheet.latency:
+            time.sleep(self.spreadsheet.latency)
+        return self.spreadsheet
+
+
+class FakeMessagingApi:
+    """模擬 linebot MessagingApi，記錄所有 reply / push"""
+
+    replies = []
+    pushes = []
+    _lock = threading.Lock()
+
+    def __init__(self, api_client=None):
+        pass
+
+    def reply_message(self, req):
+        with FakeMessagingApi._lock:
+            FakeMessagingApi.replies.append(req)
+
+    def push_message(self, req, *args, **kwargs):
+        with FakeMessagingApi._lock:
+            FakeMessagingApi.pushes.append(req)
+
+    def multicast(self, req, *args, **kwargs):
+        with FakeMessagingApi._lock:
+            FakeMessagingApi.pushes.append(req)
+
+
+class FakeApiClient:
+    def __init__(self, configuration=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+SHEET_HEADERS = {
+    'water_log': ['時間'],
+    'stand_log': ['時間'],
+    'exercise_log': ['時間', '類型', '分鐘', '熱量'],
+    'eye_log': ['時間', '狀態'],
+    'weight_log': ['時間', '體重(kg)'],
+    'sleep_log': ['日期', '時數', '品質(1-5)', '備註'],
+    'meal_log': ['時間', '餐別', '食物', '熱量', '備註'],
+    'mood_log': ['時間', '心情', '分數', '備註'],
+}
+
+
+def build_spreadsheet(history_days=30, latency=0.0, tz=None, row_latency=0.0):
+    """建立帶有歷史資料的假試算表（每天約 8 杯水、6 次起身、1 筆運動）"""
+    ss = FakeSpreadsheet(latency=latency, row_latency=row_latency)
+    now = datetime.now(tz) if tz else datetime.now()
+    rows = {name: [headers] for name, headers in SHEET_HEADERS.items()}
+    for d in range(history_days, 0, -1):
+        day = (now - timedelta(days=d)).replace(hour=8, minute=0, second=0, microsecond=0)
+        date = day.strftime('%Y-%m-%d')
+        for i in range(8):
+            rows['water_log'].append([(day + timedelta(minutes=75 * i)).strftime('%Y-%m-%d %H:%M:%S')])
+        for i in range(6):
+            rows['stand_log'].append([(day + timedelta(minutes=90 * i + 5)).strftime('%Y-%m-%d %H:%M:%S')])
+        rows['exercise_log'].append([(day + timedelta(hours=10)).strftime('%Y-%m-%d %H:%M:%S'), '跑步', '30', '300'])
+        rows['eye_log'].append([(day + timedelta(hours=3)).strftime('%Y-%m-%d %H:%M:%S'), 'completed'])
+        rows['weight_log'].append([(day + timedelta(minutes=10)).strftime('%Y-%m-%d %H:%M:%S'), f'{65 + (d % 7) * 0.1:.1f}'])
+        rows['sleep_log'].append([date, '7', '4', ''])
+        rows['meal_log'].append([(day + timedelta(hours=4)).strftime('%Y-%m-%d %H:%M:%S'), '午餐', '便當', '700', ''])
+        rows['mood_log'].append([(day + timedelta(hours=12)).strftime('%Y-%m-%d %H:%M:%S'), '🙂', '4', ''])
+    for name, data in rows.items():
+        ss.seed(name, data)
+    ss.seed('settings', [
+        ['water_interval', 'stand_interval', 'dnd_start', 'dnd_end', 'enabled', 'water_goal', 'stand_goal', 'exercise_goal'],
+        ['60', '45', '22:00', '08:00', 'TRUE', '8', '6', '30'],
+    ])
+    return ss
+
+
+def install(app_module, spreadsheet):
+    """把 app.py 的 Sheets 與 LINE 存取換成假物件；快照、離線日誌與推播工作改寫到暫存目錄，不動真正的 data/"""
+    tmp = tempfile.mkdtemp(prefix='neonpulse-')
+    app_module.SNAPSHOT_PATH = os.path.join(tmp, 'snapshot.json')
+    app_module.JOURNAL_PATH = os.path.join(tmp, 'journal.jsonl')
+    app_module.EVENT_SNAPSHOT_PATH = os.path.join(tmp, 'projection.json')
+    app_module.REPORT_JOBS_DIR = os.path.join(tmp, 'jobs')
+    client = FakeClient(spreadsheet)
+    app_module.get_gspread_client = lambda: client
+    app_module.reset_sheet_registry()
+    app_module.reset_projection(drop_snapshot=True)
+    app_module.settings_store.values = app_module.settings_store.headers = None
+    app_module.MessagingApi = FakeMessagingApi
+    app_module.ApiClient = FakeApiClient
+    app_module.clear_cache()
+    return client
+
+
+def _coerce(v):
+    if isinstance(v, str) and v.lstrip('-').isdigit():
+        return int(v)
+    return v
+
+
+def _parse_row_range(range_name):
+    import re
+    m = re.match(r'[A-Z]+(\d+):[A-Z]+(\d+)', range_name or '')
+    if not m:
+        raise ValueError(f'unsupported range: {range_name}')
+    return int(m.group(1)), int(m.group(2))
+
+
+def _parse_cell(label):
+    import re
+    m = re.fullmatch(r'([A-Z]+)(\d+)', label)
+    if not m:
+        raise ValueError(f'unsupported range: {label}')
+    col = 0
+    for ch in m.group(1):
+        col = col * 26 + ord(ch) - ord('A') + 1
+    return int(m.group(2)), col
@@ -0,0 +1,342 @@
+"""
+⚡ 穿戴裝置資料匯入
+
+串流解析大型匯出檔（不整份載入記憶體），轉成 Neon Pulse 的紀錄後批次 append_rows：
+  - Apple Health：export.xml（iterparse）— 體能訓練 → exercise_log、體重 → weight_log、睡眠 → sleep_log
+  - Google Fit（Takeout）：
+      All Sessions/*.json          體能訓練 → exercise_log
+      All Data/*.json              體重（com.google.weight）、睡眠（com.google.sleep.segment），逐筆解析 "Data Points"
+      Daily activity metrics*.csv  每日平均體重、睡眠時間（每日總步行時間不是運動，不匯入）
+
+運動類型對應到 EXERCISE_TYPES，熱量用和 LINE 記錄相同的 exercise_calories() 計算；
+寫入前會和試算表既有的列（以及這次匯入的其他列）比對去重；每批同時寫一份事件到 events 表，執行中的 bot 會在下次補讀時套用。
+
+用法：
+    python tools/import_health.py export.xml
+    python tools/import_health.py "Takeout/Fit/All Sessions" "Takeout/Fit/All Data"
+    python tools/import_health.py export.xml --since 2023-01-01 --dry-run
+    python tools/import_health.py export.xml --fake-sheets    # 用假 Sheets 量測解析與寫入吞吐
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+SOURCE_NOTE = {'apple': '匯入:Apple Health', 'fit': '匯入:Google Fit'}
+DEFAULT_SLEEP_QUALITY = 3
+
+APPLE_WORKOUTS = {
+    'Running': '跑步', 'Walking': '走路', 'Hiking': '走路', 'Swimming': '游泳', 'Cycling': '騎車',
+    'TraditionalStrengthTraining': '重訓', 'FunctionalStrengthTraining': '重訓', 'Yoga': '瑜伽',
+    'JumpRope': '跳繩', 'Basketball': '籃球', 'Badminton': '羽球', 'TableTennis': '桌球',
+}
+FIT_WORKOUTS = {
+    'running': '跑步', 'walking': '走路', 'hiking': '走路', 'swimming': '游泳', 'biking': '騎車',
+    'strength_training': '重訓', 'weightlifting': '重訓', 'yoga': '瑜伽', 'jump_rope': '跳繩',
+    'basketball': '籃球', 'badminton': '羽球', 'table_tennis': '桌球', 'ping_pong': '桌球',
+}
+FIT_ASLEEP = {2, 4, 5, 6}  # sleep / light / deep / REM
+APPLE_ASLEEP_PREFIX = 'HKCategoryValueSleepAnalysisAsleep'
+APPLE_IN_BED = 'HKCategoryValueSleepAnalysisInBed'
+
+
+class SleepNights:
+    """把睡眠片段依起床日期累加；同一晚多個來源（手錶、手機）取最長的，避免重複計算"""
+
+    def __init__(self):
+        self.nights = {}
+
+    def add(self, end, minutes, source, asleep=True):
+        night = self.nights.setdefault(end.strftime('%Y-%m-%d'), {})
+        totals = night.setdefault(source, [0.0, 0.0])
+        totals[0 if asleep else 1] += minutes
+
+    def rows(self, note):
+        for date, sources in sorted(self.nights.items()):
+            minutes = max(asleep or in_bed for asleep, in_bed in sources.values())
+            if minutes >= 60:
+                yield 'sleep_log', [date, round(minutes / 60, 1), DEFAULT_SLEEP_QUALITY, note]
+
+
+def exercise_row(bot, start, ex_type, minutes, note):
+    minutes = int(round(minutes))
+    if minutes < 1:
+        return None
+    return 'exercise_log', [start.strftime('%Y-%m-%d %H:%M:%S'), ex_type, minutes, bot.exercise_calories(ex_type, minutes)]
+
+
+def weight_row(when, kg):
+    if not 20 <= kg <= 300:
+        return None
+    return 'weight_log', [when.strftime('%Y-%m-%d %H:%M:%S'), round(kg, 1)]
+
+
+# ===== Apple Health =====
+def _apple_time(value, tz):
+    return datetime.strptime(value, '%Y-%m-%d %H:%M:%S %z').astimezone(tz)
+
+
+def parse_apple_health(bot, path):
+    """iterparse export.xml；每處理完一個 Record / Workout 就清掉根節點，記憶體不會隨檔案變大"""
+    tz, note = bot.TZ, SOURCE_NOTE['apple']
+    sleep = SleepNights()
+    context = ET.iterparse(path, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event != 'end' or elem.tag not in ('Record', 'Workout'):
+            continue
+        try:
+            if elem.tag == 'Workout':
+                kind = elem.get('workoutActivityType', '').replace('HKWorkoutActivityType', '')
+                minutes = float(elem.get('duration') or 0)
+                unit = elem.get('durationUnit', 'min')
+                minutes = minutes / 60 if unit == 's' else minutes * 60 if unit == 'hr' else minutes
+                row = exercise_row(bot, _apple_time(elem.get('startDate'), tz), APPLE_WORKOUTS.get(kind, '其他'), minutes, note)
+                if row:
+                    yield row
+            elif elem.get('type') == 'HKQuantityTypeIdentifierBodyMass':
+                kg = float(elem.get('value'))
+                if elem.get('unit') == 'lb':
+                    kg *= 0.45359237
+                row = weight_row(_apple_time(elem.get('startDate'), tz), kg)
+                if row:
+                    yield row
+            elif elem.get('type') == 'HKCategoryTypeIdentifierSleepAnalysis':
+                value = elem.get('value', '')
+                if value.startswith(APPLE_ASLEEP_PREFIX) or value == APPLE_IN_BED:
+                    start, end = _apple_time(elem.get('startDate'), tz), _apple_time(elem.get('endDate'), tz)
+                    sleep.add(end, (end - start).total_seconds() / 60, elem.get('sourceName', ''), value != APPLE_IN_BED)
+        except (TypeError, ValueError):
+            pass
+        root.clear()
+    yield from sleep.rows(note)
+
+
+# ===== Google Fit =====
+def _fit_time(nanos, tz):
+    return datetime.fromtimestamp(int(nanos) / 1e9, timezone.utc).astimezone(tz)
+
+
+def _fit_workout(activity):
+    for prefix, ex_type in FIT_WORKOUTS.items():
+        if activity.startswith(prefix):
+            return ex_type
+    return '其他'
+
+
+def iter_json_array(path, key, chunk_size=1 << 16):
+    """逐筆解析 JSON 檔中 "key": [ ... ] 陣列的元素，不必整份 json.load"""
+    decoder = json.JSONDecoder()
+    with open(path, encoding='utf-8') as f:
+        buf = ''
+        marker = f'"{key}"'
+        while marker not in buf:
+            data = f.read(chunk_size)
+            if not data:
+                return
+            buf = buf[-len(marker):] + data
+        buf = buf[buf.index(marker) + len(marker):]
+        while '[' not in buf:
+            buf += f.read(chunk_size)
+        buf = buf[buf.index('[') + 1:]
+        eof = False
+        while True:
+            buf = buf.lstrip(' \t\r\n,')
+            if buf.startswith(']'):
+                return
+            try:
+                item, end = decoder.raw_decode(buf)
+            except ValueError:
+                if eof:
+                    return
+                data = f.read(chunk_size)
+                eof = not data
+                buf += data
+                continue
+            yield item
+            buf = buf[end:]
+
+
+def parse_fit_session(bot, path):
+    """All Sessions/*.json：一個檔案一次運動，檔案很小"""
+    with open(path, encoding='utf-8') as f:
+        session = json.load(f)
+    start = datetime.fromisoformat(session['startTime'].replace('Z', '+00:00')).astimezone(bot.TZ)
+    end = datetime.fromisoformat(session['endTime'].replace('Z', '+00:00')).astimezone(bot.TZ)
+    minutes = float(str(session.get('duration', '')).rstrip('s') or 0) / 60 or (end - start).total_seconds() / 60
+    row = exercise_row(bot, start, _fit_workout(session.get('fitnessActivity', '')), minutes, SOURCE_NOTE['fit'])
+    if row:
+        yield row
+
+
+def parse_fit_datapoints(bot, path):
+    """All Data/*.json：體重與睡眠片段"""
+    sleep = SleepNights()
+    for point in iter_json_array(path, 'Data Points'):
+        try:
+            kind = point.get('dataTypeName')
+            value = (point.get('fitValue') or [{}])[0].get('value', {})
+            if kind == 'com.google.weight':
+                row = weight_row(_fit_time(point['startTimeNanos'], bot.TZ), float(value['fpVal']))
+                if row:
+                    yield row
+            elif kind == 'com.google.sleep.segment' and value.get('intVal') in FIT_ASLEEP:
+                start, end = _fit_time(point['startTimeNanos'], bot.TZ), _fit_time(point['endTimeNanos'], bot.TZ)
+                sleep.add(end, (end - start).total_seconds() / 60, point.get('originDataSourceId', ''))
+        except (KeyError, TypeError, ValueError):
+            pass
+    yield from sleep.rows(SOURCE_NOTE['fit'])
+
+
+def parse_fit_daily_csv(bot, path):
+    """Daily activity metrics CSV：每日平均體重、睡眠時間"""
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        for rec in csv.DictReader(f):
+            date = rec.get('Date') or rec.get('日期')
+            if not date:
+                continue
+            try:
+                if rec.get('Average weight (kg)'):
+                    row = weight_row(datetime.strptime(f'{date} 08:00:00', '%Y-%m-%d %H:%M:%S'), float(rec['Average weight (kg)']))
+                    if row:
+                        yield row
+                if rec.get('Sleep duration (ms)'):
+                    hours = float(rec['Sleep duration (ms)']) / 3.6e6
+                    if hours >= 1:
+                        yield 'sleep_log', [date, round(hours, 1), DEFAULT_SLEEP_QUALITY, SOURCE_NOTE['fit']]
+            except ValueError:
+                pass
+
+
+def iter_sources(paths):
+    """展開目錄並依副檔名 / 內容判斷格式"""
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, _, files in os.walk(path):
+                for name in sorted(files):
+                    yield from iter_sources([os.path.join(dirpath, name)])
+            continue
+        ext = os.path.splitext(path)[1].lower()
+        if ext == '.xml':
+            yield path, parse_apple_health
+        elif ext == '.csv':
+            yield path, parse_fit_daily_csv
+        elif ext == '.json':
+            with open(path, encoding='utf-8') as f:
+                head = f.read(4096)
+            if '"fitnessActivity"' in head:
+                yield path, parse_fit_session
+            elif '"Data Points"' in head:
+                yield path, parse_fit_datapoints
+
+
+# ===== 寫入 =====
+def dedup_key(sheet_name, row):
+    if sheet_name == 'exercise_log':
+        return row[0][:16], row[1]
+    if sheet_name == 'weight_log':
+        return row[0][:16]
+    return row[0][:10]
+
+
+class BatchWriter:
+    """去重後累積到 batch_size 列再一次 append_rows"""
+
+    def __init__(self, bot, batch_size, dry_run):
+        self.bot = bot
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.seen = {}
+        self.pending = {}
+        self.stats = {}
+        self.write_seconds = 0.0
+
+    def _existing(self, sheet_name):
+        if sheet_name not in self.seen:
+            keys = set()
+            try:
+                for chunk in self.bot.iter_sheet_rows(self.bot.get_sheet(sheet_name)):
+                    keys.update(dedup_key(sheet_name, r) for r in chunk if r and r[0])
+            except Exception as e:
+                print(f"[Import] 讀取 {sheet_name} 失敗，只在本次匯入內去重: {e}")
+            self.seen[sheet_name] = keys
+        return self.seen[sheet_name]
+
+    def add(self, sheet_name, row):
+        stats = self.stats.setdefault(sheet_name, {'parsed': 0, 'duplicates': 0, 'written': 0})
+        stats['parsed'] += 1
+        key = dedup_key(sheet_name, row)
+        seen = self._existing(sheet_name)
+        if key in seen:
+            stats['duplicates'] += 1
+            return
+        seen.add(key)
+        batch = self.pending.setdefault(sheet_name, [])
+        batch.append(row)
+        if len(batch) >= self.batch_size:
+            self.flush(sheet_name)
+
+    def flush(self, sheet_name=None):
+        for name in [sheet_name] if sheet_name else list(self.pending):
+            rows = self.pending.pop(name, [])
+            if not rows:
+                continue
+            if not self.dry_run:
+                start = time.perf_counter()
+                self.bot.append_log_rows(name, rows, value_input_option='RAW')
+                self.write_seconds += time.perf_counter() - start
+            self.stats[name]['written'] += len(rows)
+
+
+def main():
+    p = argparse.ArgumentParser(description='匯入 Apple Health / Google Fit 匯出檔')
+    p.add_argument('paths', nargs='+', help='export.xml、Takeout 目錄或個別 JSON/CSV 檔')
+    p.add_argument('--since', help='只匯入這天（YYYY-MM-DD）以後的紀錄')
+    p.add_argument('--batch-size', type=int, default=500, help='每次 append_rows 的列數')
+    p.add_argument('--dry-run', action='store_true', help='只解析與去重，不寫入')
+    p.add_argument('--fake-sheets', action='store_true', help='寫到假的試算表（量測吞吐用）')
+    args = p.parse_args()
+
+    if args.fake_sheets:
+        os.environ.setdefault('LINE_CHANNEL_SECRET', 'import-secret')
+    import app as bot
+    if args.fake_sheets:
+        from fakes import build_spreadsheet, install
+        install(bot, build_spreadsheet(history_days=30, tz=bot.TZ))
+    bot.set_sheets_priority(bot.PRIORITY_BACKGROUND)
+
+    writer = BatchWriter(bot, args.batch_size, args.dry_run)
+    start = time.perf_counter()
+    total = 0
+    for path, parser in iter_sources(args.paths):
+        file_start, file_rows = time.perf_counter(), 0
+        for sheet_name, row in parser(bot, path):
+            if args.since and str(row[0])[:10] < args.since:
+                continue
+            writer.add(sheet_name, row)
+            file_rows += 1
+        total += file_rows
+        elapsed = time.perf_counter() - file_start
+        print(f"[Import] {os.path.basename(path)}: {file_rows} 列，{file_rows / elapsed if elapsed else 0:,.0f} 列/秒")
+    writer.flush()
+    bot.clear_cache()
+    wall = time.perf_counter() - start
+
+    print(f"\n{'工作表':<14}{'解析':>9}{'重複':>9}{'寫入':>9}")
+    for name, s in sorted(writer.stats.items()):
+        print(f"{name:<14}{s['parsed']:>9}{s['duplicates']:>9}{s['written']:>9}")
+    written = sum(s['written'] for s in writer.stats.values())
+    print(f"\n[Import] 共 {total} 列，耗時 {wall:.1f}s（{total / wall if wall else 0:,.0f} 列/秒），"
+          f"寫入 {written} 列{'（dry run）' if args.dry_run else f'，append_rows 耗時 {writer.write_seconds:.1f}s'}")
+
+
+if __name__ == '__main__':
+    main()
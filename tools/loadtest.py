@@ -0,0 +1,155 @@
+"""
+⚡ /callback 壓力測試工具
+
+產生帶有正確 X-Line-Signature（HMAC-SHA256 + LINE_CHANNEL_SECRET）的 LINE webhook，
+依指令比例以固定速率打 /callback，Sheets 與 MessagingApi 以假物件取代，
+最後輸出各指令的吞吐量、p50/p95/p99 延遲與錯誤率。
+
+用法：
+    python tools/loadtest.py --rate 20 --duration 30
+    python tools/loadtest.py --mix "已喝水=5,今日統計=2" --sheets-latency-ms 80 --history-days 365
+"""
+
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('LINE_CHANNEL_SECRET', 'loadtest-secret')
+os.environ.setdefault('LINE_CHANNEL_ACCESS_TOKEN', 'loadtest-token')
+
+DEFAULT_MIX = '已喝水=5,跑步 30=2,今日統計=3,週報=1,早餐 吐司、豆漿=1,AI分析=1'
+ERROR_TEXT = '系統忙碌'
+
+
+def parse_mix(spec):
+    """解析 "指令=權重,指令=權重" """
+    mix = []
+    for part in spec.split(','):
+        if not part.strip():
+            continue
+        cmd, _, weight = part.rpartition('=')
+        if not cmd:
+            cmd, weight = weight, '1'
+        mix.append((cmd.strip(), max(int(weight), 0)))
+    return [(c, w) for c, w in mix if w > 0]
+
+
+def build_body(text, user_id='Uloadtest0000000000000000000000000'):
+    """建立 LINE webhook 請求內容"""
+    event = {
+        'type': 'message', 'mode': 'active',
+        'timestamp': int(time.time() * 1000),
+        'webhookEventId': uuid.uuid4().hex.upper()[:26],
+        'deliveryContext': {'isRedelivery': False},
+        'source': {'type': 'user', 'userId': user_id},
+        'replyToken': uuid.uuid4().hex,
+        'message': {'type': 'text', 'id': str(int(time.time() * 1e6)), 'quoteToken': uuid.uuid4().hex, 'text': text},
+    }
+    return json.dumps({'destination': 'Uloadtestbot', 'events': [event]}, ensure_ascii=False)
+
+
+def sign(body, secret):
+    """計算 X-Line-Signature"""
+    digest = hmac.new(secret.encode('utf-8'), body.encode('utf-8'), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode('utf-8')
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def run(args):
+    import app as bot
+    from fakes import FakeMessagingApi, build_spreadsheet, install
+
+    secret = os.environ['LINE_CHANNEL_SECRET']
+    ss = build_spreadsheet(history_days=args.history_days, latency=args.sheets_latency_ms / 1000, tz=bot.TZ)
+    install(bot, ss)
+
+    mix = parse_mix(args.mix)
+    schedule = [cmd for cmd, w in mix for _ in range(w)]
+    results = {cmd: [] for cmd, _ in mix}
+    errors = {cmd: 0 for cmd, _ in mix}
+    lock = threading.Lock()
+    local = threading.local()
+
+    def fire(cmd):
+        if not hasattr(local, 'client'):
+            local.client = bot.app.test_client()
+        body = build_body(cmd)
+        token = json.loads(body)['events'][0]['replyToken']
+        t0 = time.perf_counter()
+        try:
+            resp = local.client.post('/callback', data=body.encode('utf-8'), content_type='application/json',
+                                     headers={'X-Line-Signature': sign(body, secret)})
+            ok = resp.status_code == 200
+        except Exception as e:
+            print(f"[LoadTest] {cmd}: {e}")
+            ok = False
+        elapsed = time.perf_counter() - t0
+        if ok:
+            reply = next((r for r in FakeMessagingApi.replies if r.reply_token == token), None)
+            ok = reply is not None and not any(ERROR_TEXT in (getattr(m, 'text', '') or '') for m in reply.messages)
+        with lock:
+            results[cmd].append(elapsed)
+            if not ok:
+                errors[cmd] += 1
+
+    total = int(args.rate * args.duration)
+    interval = 1.0 / args.rate
+    print(f"[LoadTest] {total} 個請求，目標 {args.rate}/s，並行上限 {args.concurrency}，歷史 {args.history_days} 天")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for i in range(total):
+            # 開放式負載：依排程時間送出，不等前一個完成
+            delay = start + i * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(fire, schedule[i % len(schedule)])
+    wall = time.perf_counter() - start
+
+    print(f"\n{'指令':<14}{'請求':>7}{'吞吐/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'錯誤率':>8}")
+    all_lat = []
+    for cmd, _ in mix:
+        lat = sorted(results[cmd])
+        all_lat.extend(lat)
+        n = len(lat)
+        err = errors[cmd] / n * 100 if n else 0
+        print(f"{cmd[:12]:<14}{n:>7}{n / wall:>9.1f}{percentile(lat, 50) * 1000:>9.1f}"
+              f"{percentile(lat, 95) * 1000:>9.1f}{percentile(lat, 99) * 1000:>9.1f}{err:>7.1f}%")
+    all_lat.sort()
+    total_err = sum(errors.values())
+    print(f"{'TOTAL':<14}{len(all_lat):>7}{len(all_lat) / wall:>9.1f}{percentile(all_lat, 50) * 1000:>9.1f}"
+          f"{percentile(all_lat, 95) * 1000:>9.1f}{percentile(all_lat, 99) * 1000:>9.1f}"
+          f"{(total_err / len(all_lat) * 100 if all_lat else 0):>7.1f}%")
+    print(f"\n[LoadTest] 實際耗時 {wall:.1f}s，Sheets API 呼叫 {ss.calls} 次")
+
+
+def main():
+    p = argparse.ArgumentParser(description='LINE webhook 壓力測試')
+    p.add_argument('--rate', type=float, default=10, help='每秒請求數')
+    p.add_argument('--duration', type=float, default=10, help='持續秒數')
+    p.add_argument('--concurrency', type=int, default=16, help='最大並行請求數')
+    p.add_argument('--mix', default=DEFAULT_MIX, help='指令比例，例如 "已喝水=5,今日統計=2"')
+    p.add_argument('--sheets-latency-ms', type=float, default=50, help='模擬每次 Sheets API 延遲')
+    p.add_argument('--history-days', type=int, default=90, help='預先填入的歷史天數')
+    run(p.parse_args())
+
+
+if __name__ == '__main__':
+    main()